@@ -14,6 +14,7 @@ class AgentState(TypedDict):
     victim_function: int
     template_number: int
     selected_model_key: str
+    retrieval_model_key: str       # Model key whose retrieval questions and RAG store are used (normally selected_model_key)
     query_index: int
     conversation: list[BaseMessage]
     programmer_response: BaseMessage
@@ -1,23 +1,67 @@
 # Built-in imports
-import copy
 import json
+from operator import itemgetter
+from types import MappingProxyType
 
 # Langchain imports
 from langchain_core.prompts import ChatPromptTemplate # type: ignore
-from langchain_core.messages.ai import AIMessage # type: ignore
-from langchain_core.runnables.base import RunnableSequence # type: ignore
+from langchain_core.messages import message_chunk_to_message # type: ignore
+from langchain_core.messages.ai import AIMessage, AIMessageChunk # type: ignore
+from langchain_core.runnables.base import RunnableLambda, RunnableSequence # type: ignore
 from langchain_core.language_models.chat_models import BaseChatModel # type: ignore
 
 
 # Local imports
-from app_config import get_logger
+from app_config import config, get_logger
+from llm_factory import add_cache_breakpoints, supports_prompt_caching
 from agents.AgentState import AgentState
 from agents.prompts.PromptTemplateLoader import PromptTemplateLoader
 
+class ReadOnlyList(list):
+    '''A list that refuses in-place modification.
+
+    Prompt templates require real lists (MessagesPlaceholder checks isinstance(list)),
+    so agent inputs get this instead of a tuple.
+    '''
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("agent input lists are read-only")
+
+    append = extend = insert = pop = remove = clear = sort = reverse = _read_only
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _read_only
+
+
+def _freeze(value):
+    if isinstance(value, list):
+        return ReadOnlyList(value)
+    if isinstance(value, dict):
+        return MappingProxyType(value)
+    return value
+
+
+def snapshot_state(state: AgentState, fields=None) -> dict:
+    '''Read-only view of the state fields an agent reads.
+
+    Top-level lists and dicts are wrapped (not copied element by element), so the
+    chain cannot append to or reassign entries of the caller's containers. The
+    messages themselves are shared; the graphs treat them as immutable and replace
+    rather than edit them.
+
+    Args:
+        state (AgentState): The caller's state.
+        fields (Iterable[str], optional): State keys to include; None includes every key.
+    Returns:
+        dict: A new dict of (wrapped) values.
+    '''
+    keys = state.keys() if fields is None else [key for key in fields if key in state]
+    return {key: _freeze(state[key]) for key in keys}
+
+
 class BaseAgent():
     '''
     Langchain Agent responsible for generating PoC code for a given task.
     '''
+    # Prompt variable -> AgentState key read by the agent's input mapping (None: the whole state)
+    INPUT_FIELDS: dict[str, str] | None = None
 
     def __init__(self, name: str, llm: BaseChatModel, tools: list = None, prompt_phase: str = None, version: str = "v1"):
         """Initializes the BaseAgent.
@@ -43,6 +87,10 @@ class BaseAgent():
             self.llm = self.llm.bind_tools(self.tools, tool_choice="auto")
             pass
 
+        # Mark the stable prompt prefixes for providers that only cache at explicit breakpoints
+        if config.PROMPT_CACHING and supports_prompt_caching(llm):
+            self.llm = RunnableLambda(add_cache_breakpoints) | self.llm
+
         # print(f"[DEBUG] {self.name} (EvaluatorAgent): LLM type = {type(self.llm)}")
         # if self.tools:
         #     print(f"[DEBUG] {self.name} (EvaluatorAgent): Number of tools bound = {len(self.tools)}")
@@ -67,6 +115,14 @@ class BaseAgent():
         prompt = ChatPromptTemplate.from_messages(template, template_format="jinja2")
         return prompt | self.llm
 
+    def _input_mapping(self) -> dict:
+        """How to get the variable values for the prompt template (from INPUT_FIELDS)."""
+        return {variable: itemgetter(key) for variable, key in self.INPUT_FIELDS.items()}
+
+    def _snapshot(self, input: AgentState) -> dict:
+        fields = None if self.INPUT_FIELDS is None else self.INPUT_FIELDS.values()
+        return snapshot_state(input, fields)
+
     def invoke(self, input: AgentState) -> AIMessage:
         """Wrapper around the RunnableSequence's (agent's) invoke method.
 
@@ -76,12 +132,113 @@ class BaseAgent():
         Returns:
             AIMessage: The response from the agent
         """  
-        # Defensive copy to avoid in-place mutations by the chain
-        safe_input = copy.deepcopy(input)
+        # Read-only view instead of a deepcopy: the chain cannot mutate the caller's state
+        safe_input = self._snapshot(input)
         response = self.agent.invoke(safe_input)
         # print(f"[DEBUG] {self.name}: Invoked agent with state keys: {list(safe_input.keys())}")
         # print(f"[DEBUG] {self.name}: Model response = {response}")
         return response
         # return self.agent.invoke(safe_input)
+
+    async def ainvoke(self, input: AgentState) -> AIMessage:
+        """Async wrapper around the RunnableSequence's (agent's) ainvoke method.
+
+        Args:
+            input (AgentState):  The input object for the agent
+                
+        Returns:
+            AIMessage: The response from the agent
+        """  
+        # Read-only view instead of a deepcopy: the chain cannot mutate the caller's state
+        safe_input = self._snapshot(input)
+        return await self.agent.ainvoke(safe_input)
     
+    def _on_chunk(self, stream: "_StreamState", chunk: AIMessageChunk, on_tool_call) -> None:
+        stream.message = chunk if stream.message is None else stream.message + chunk
+        stream.log_text(self.log, self.name, chunk.content)
+        if on_tool_call is not None:
+            for tool_call in stream.completed_tool_calls():
+                on_tool_call(tool_call)
+
+    def _finish_stream(self, stream: "_StreamState", on_tool_call) -> AIMessage:
+        stream.log_text(self.log, self.name, "", flush=True)
+        if stream.message is None:
+            return AIMessage(content="")
+        if on_tool_call is not None:
+            for tool_call in stream.completed_tool_calls(final=True):
+                on_tool_call(tool_call)
+        return message_chunk_to_message(stream.message)
+
+    def invoke_streaming(self, input: AgentState, on_tool_call=None) -> AIMessage:
+        """Stream the response, logging its text live and reporting each tool call once its arguments are complete.
+
+        Args:
+            input (AgentState): The input object for the agent
+            on_tool_call (callable, optional): Called with each completed tool call dict
+                (name, args, id) while the rest of the response is still being generated.
+        Returns:
+            AIMessage: The complete response, as invoke() would return it
+        """
+        stream = _StreamState()
+        for chunk in self.agent.stream(self._snapshot(input)):
+            self._on_chunk(stream, chunk, on_tool_call)
+        return self._finish_stream(stream, on_tool_call)
+
+    async def ainvoke_streaming(self, input: AgentState, on_tool_call=None) -> AIMessage:
+        """Async twin of invoke_streaming."""
+        stream = _StreamState()
+        async for chunk in self.agent.astream(self._snapshot(input)):
+            self._on_chunk(stream, chunk, on_tool_call)
+        return self._finish_stream(stream, on_tool_call)
+
     pass # end of BaseAgent
+
+
+class _StreamState:
+    '''Accumulated chunks of one streamed response.'''
+
+    def __init__(self):
+        self.message: AIMessageChunk | None = None
+        self.reported: set = set()
+        self.line = ""
+
+    def completed_tool_calls(self, final: bool = False) -> list[dict]:
+        '''Tool calls whose arguments are complete and that were not reported yet.
+
+        A call is complete once its argument string parses as a JSON object (a
+        streamed object only parses after its closing brace) or, at the end of
+        the stream, whatever the provider sent.
+        '''
+        completed = []
+        if not isinstance(self.message, AIMessageChunk):
+            # Models without native streaming yield the whole message as a single item
+            for tool_call in self.message.tool_calls or []:
+                if tool_call.get("id") not in self.reported:
+                    self.reported.add(tool_call.get("id"))
+                    completed.append({"name": tool_call["name"], "args": tool_call["args"], "id": tool_call.get("id")})
+            return completed
+        for position, chunk in enumerate(self.message.tool_call_chunks or []):
+            key = chunk.get("index", position)
+            if key in self.reported or not chunk.get("name"):
+                continue
+            try:
+                args = json.loads(chunk.get("args") or ("{}" if final else ""))
+            except json.JSONDecodeError:
+                continue
+            if not isinstance(args, dict) or (not chunk.get("id") and not final):
+                continue
+            self.reported.add(key)
+            completed.append({"name": chunk["name"], "args": args, "id": chunk.get("id")})
+        return completed
+
+    def log_text(self, log, name: str, content, flush: bool = False) -> None:
+        '''Log streamed text line by line as it arrives.'''
+        if isinstance(content, list):
+            content = "".join(block.get("text", "") for block in content if isinstance(block, dict))
+        self.line += content or ""
+        *lines, self.line = self.line.split("\n")
+        if flush and self.line:
+            lines.append(self.line)
+            self.line = ""
+        for line in lines:
+            log.info(f"[{name} stream] {line}")
@@ -13,6 +13,14 @@ class ProgrammerEvaluatorAgent(BaseEvaluatorAgent):
     '''
     Langchain Agent responsible for reflecting on PoC code for a given task.
     '''
+    INPUT_FIELDS = {  # prompt variable -> AgentState key
+        "attack_vector":         "attack_vector",
+        "target_language":       "target_language",
+        "target_file_extension": "target_file_extension",
+        # "retrieval_questions": "retrieval_questions",
+        "conversation":          "conversation",
+    }
+
     def _get_agent(self) -> RunnableSequence:
         """Creates the RunnableSequence (LLMChain) for the BaseAgent.
 
@@ -26,13 +34,7 @@ class ProgrammerEvaluatorAgent(BaseEvaluatorAgent):
                                             )
         prompt = ChatPromptTemplate.from_messages(template, template_format="jinja2")
         agent = (
-            {  # how to get the variable values for the prompt template
-                "attack_vector":                lambda state: state["attack_vector"],
-                "target_language":              lambda state: state["target_language"],
-                "target_file_extension":        lambda state: state["target_file_extension"],
-                # "retrieval_questions":          lambda state: state["retrieval_questions"],
-                "conversation":                 lambda state: state["conversation"],
-            }
+            self._input_mapping()
             | prompt   # the prompt template from the yaml file
             | self.llm # the LLM with tools
         )
@@ -1,5 +1,8 @@
 # Built-in imports
 from uuid import uuid4
+import argparse
+import asyncio
+import json
 import logging
 import os
 import importlib
@@ -9,6 +12,7 @@ from app_config import config, get_logger
 from model_configs import models
 from agents.AgentState import AgentState
 from retrieval_queries import get_retrieval_questions
+from timings import timings
 
 
 
@@ -34,11 +38,78 @@ if SELECTED_PHASE not in PHASE_CONFIG:
     raise SystemExit(f"Unknown phase '{SELECTED_PHASE}'. Available: {', '.join(PHASE_CONFIG.keys())}")
 
 
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="uGen PoC generation")
+    parser.add_argument("--batch", metavar="MATRIX_JSON",
+                        help="run a job matrix concurrently (see batch_scheduler.py) instead of a single run")
+    parser.add_argument("--results", default=os.path.expanduser("~/workdir/runs/results.jsonl"),
+                        help="batch result file (.jsonl or .csv)")
+    parser.add_argument("--max-concurrent", type=int, default=None,
+                        help="maximum number of concurrent batch jobs")
+    # Single-run overrides (used by the batch scheduler for each child job)
+    parser.add_argument("--job", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--phase", default=SELECTED_PHASE, choices=list(PHASE_CONFIG.keys()))
+    parser.add_argument("--model", default=None, help="model key from model_configs.py")
+    parser.add_argument("--attack", default=None, help="attack vector, e.g. Spectre-v1 or Prime-Probe")
+    parser.add_argument("--victim", type=int, default=None, help="victim function number")
+    parser.add_argument("--template", type=int, default=None, help="template number")
+    parser.add_argument("--llm-replay", default=None, choices=["passthrough", "record", "replay"],
+                        help="record LLM responses to ~/workdir/.llm_replay or replay them offline (default: config.LLM_REPLAY)")
+    parser.add_argument("--retrieval-model", default=None,
+                        help="use the retrieval questions and RAG store of this model key (e.g. to exercise RAG with mock-local)")
+    parser.add_argument("--uuid", default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def _run_result(state: AgentState, graph) -> dict:
+    """Machine-readable outcome of a single run (consumed by the batch scheduler)."""
+    input_tokens = output_tokens = 0
+    for msg in state.get('conversation', []):
+        meta = getattr(msg, 'usage_metadata', None)
+        if meta:
+            input_tokens  += meta.get('input_tokens', 0)
+            output_tokens += meta.get('output_tokens', 0)
+    if state.get('convergence_achieved'):
+        status = "success"
+    elif getattr(graph, '_timeout_exceeded', False):
+        status = "timeout"
+    else:
+        status = "incomplete"
+    return {
+        "uuid": config.UUID,
+        "status": status,
+        "programmer_iterations": state.get('programmer_count', 0),
+        "reflection_iterations": state.get('programmer_reflection_count', 0),
+        "total_nodes_executed": state.get('total_nodes_executed', 0),
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "timings": timings.samples(),   # durations (seconds) per node / llm / tool / rag, see timings.py
+    }
+
+
 # Framework entry point
 if __name__ == '__main__':
+    args = _parse_args()
+
+    if args.llm_replay:
+        config.LLM_REPLAY = args.llm_replay
+
+    if args.batch:
+        config.UUID = f"batch-{uuid4().hex}"
+        from batch_scheduler import run_batch
+        with open(args.batch, "r", encoding="utf-8") as f:
+            matrix = json.load(f)
+        records = run_batch(matrix, args.phase, args.results, args.max_concurrent)
+        succeeded = sum(1 for r in records if r.get("status") == "success")
+        print(f"Batch completed: {succeeded}/{len(records)} runs converged. Results: {args.results}")
+        raise SystemExit(0)
+
+    SELECTED_PHASE = args.phase
+
     # UUID must be set BEFORE importing the graph module so that all module-level
     # loggers in tool files are initialized with the correct log file path.
-    config.UUID = uuid4().hex
+    config.UUID = args.uuid or uuid4().hex
     graph_module_name = PHASE_CONFIG[SELECTED_PHASE]
     graph_module = importlib.import_module(graph_module_name)
     MainGraph = getattr(graph_module, "MainGraph")
@@ -47,8 +118,9 @@ if __name__ == '__main__':
     # ============ MANUAL MODEL SELECTION ============
     # EDIT THIS LINE ONLY: choose either  "gpt-4o" or "claude-sonnet-4" or "Qwen3-Coder" 
     SELECTED_MODEL_KEY = "Qwen3-Coder" 
-    config.SELECTED_MODEL_KEY = SELECTED_MODEL_KEY
     # ===============================================
+    SELECTED_MODEL_KEY = args.model or SELECTED_MODEL_KEY
+    config.SELECTED_MODEL_KEY = SELECTED_MODEL_KEY
 
     # Validate selection
     if SELECTED_MODEL_KEY not in models:
@@ -67,6 +139,14 @@ if __name__ == '__main__':
     config.VICTIM_FUNCTION = 1  # 1 is default, set as needed for different victim functions
     config.TEMPLATE_NUMBER = 3  # set template number as needed for different attack metrics
 
+    # Command-line overrides (batch jobs pass these explicitly)
+    if args.attack:
+        config.ATTACK_VECTORS = args.attack
+    if args.victim is not None:
+        config.VICTIM_FUNCTION = args.victim
+    if args.template is not None:
+        config.TEMPLATE_NUMBER = args.template
+
     # Run the Langchain
     log.info(f"++++++++++ Starting Langchain with UUID: {config.UUID} ++++++++++")
     log.info(f"++++++++++ Using model: {config.MODEL} ++++++++++")
@@ -78,7 +158,8 @@ if __name__ == '__main__':
     initial_state['target_file_extension'] = config.TARGET_FILE_EXTENSION
     initial_state['victim_function'] = config.VICTIM_FUNCTION
     initial_state['template_number']   = config.TEMPLATE_NUMBER
-    initial_state['retrieval_questions'] = get_retrieval_questions(SELECTED_MODEL_KEY, config.ATTACK_VECTORS)
+    initial_state['retrieval_model_key'] = args.retrieval_model or SELECTED_MODEL_KEY
+    initial_state['retrieval_questions'] = get_retrieval_questions(initial_state['retrieval_model_key'], config.ATTACK_VECTORS)
     initial_state['query_index'] = 0
     initial_state['programmer_count'] = 0
     initial_state['programmer_reflection_count'] = 0
@@ -106,12 +187,20 @@ if __name__ == '__main__':
     initial_state['final_summary'] = ""             # Final summary message with status
 
     graph = MainGraph(SELECTED_MODEL_KEY, prompt_phase=SELECTED_PHASE)
-    graph.run(initial_state)
+    if config.ASYNC_MODE and hasattr(graph, "arun"):
+        asyncio.run(graph.arun(initial_state))
+    else:
+        graph.run(initial_state)
     
     # Display final summary after execution completes
     if initial_state.get('final_summary'):
         print(initial_state['final_summary'])
-    
+
+    if args.result_file:
+        os.makedirs(os.path.dirname(os.path.abspath(args.result_file)), exist_ok=True)
+        with open(args.result_file, "w", encoding="utf-8") as f:
+            json.dump(_run_result(initial_state, graph), f, indent=2)
+
     pass
     log.info(f"++++++++++ Langchain completed with UUID: {config.UUID} ++++++++++")
 
@@ -14,11 +14,40 @@ class AppConfig:
     TEMPLATE_NUMBER: int = 3            # <- default template number (3..11)
     SEEDS: list[int] = None             # Seeds for the LLM model
     NUM_SEEDS: int = 700                  # Number of seeds to generate
-    LLM_NODE_DELAY_SECONDS: int = 0     # Seconds to sleep before each LLM node call (set to 0 to disable, increase if hitting TPM rate limits)
+    RATE_LIMITS: dict = {}              # Static LLM limits, e.g. {"openai/gpt-4o": {"rpm": 500, "tpm": 30000}} or per provider; refined from response headers
+    RATE_LIMIT_BACKOFF_BASE_SECONDS: float = 2    # First 429 backoff without retry-after (doubles per consecutive 429, with jitter)
+    RATE_LIMIT_BACKOFF_MAX_SECONDS: float = 60    # Upper bound of the 429 backoff
     PROG_REF_CNT: int = 8               # Maximum number of calls to the reflection agent
     PROG_EVA_CNT: int = 7               # Maximum number of calls to the Evaluator agent
     RECURSION_LIMIT: int = 15           # Maximum number nodes to be executed
     TIMEOUT_SECONDS: int = 3000          # Maximum wall-clock seconds before forced termination (20 min)
+    ASYNC_MODE: bool = False            # Run the graph with asyncio (astream/ainvoke); the timeout then also interrupts in-flight nodes
+    CONTEXT_TOKEN_BUDGET: int = 60000   # Conversation tokens (tiktoken) above which stale tool outputs / superseded sources are collapsed before an LLM call (0 = off)
+    LLM_REPLAY: str = "passthrough"     # LLM response cache under ~/workdir/.llm_replay: "passthrough" (off), "record" or "replay" (offline, misses fail)
+    LLM_REPLAY_KEY_TOOL_OUTPUTS: bool = False  # Include tool result contents in replay keys (off: runs whose PoC timings/counters differ still replay)
+    PROMPT_CACHING: bool = True         # Anthropic: native client with cache_control breakpoints on stable prompt prefixes (OpenAI caches automatically)
+    DEDUP_SUPERSEDED_SOURCES: bool = True  # Send earlier compile calls' source as a diff to the next compiled version (or a hash reference); off with Anthropic prompt caching
+    RETRIEVAL_PREFETCH_WORKERS: int = 8 # Threads used to run the prefetched similarity searches concurrently
+    RETRIEVAL_ANSWERS_PER_HOP: int = 0  # Prefetched answers delivered per Retriever node visit (0 = all at once)
+    STREAM_TOOL_DISPATCH: bool = False  # Stream LLM responses: log text live and start each tool call as soon as its arguments are complete
+    TOOL_CALL_WORKERS: int = 4          # Threads for running independent tool calls of one LLM turn concurrently (1 = serial)
+    RAG_RESULT_CACHE: bool = True       # Reuse retrieval results stored under ~/workdir/.rag_cache across runs
+    BATCH_MAX_CONCURRENT_RUNS: int = 2  # Concurrent jobs in `app.py --batch` sweeps
+    BATCH_KILL_GRACE_SECONDS: int = 600 # Hard-kill a batch job this long after TIMEOUT_SECONDS
+    PROVIDER_MAX_CONCURRENT_RUNS: dict = {"openai": 2, "anthropic": 2, "together": 2}  # Per-provider job caps (missing = unlimited)
+    PROVIDER_MIN_START_INTERVAL_SECONDS: dict = {"openai": 30, "anthropic": 30, "together": 10}  # Spacing between job starts per provider
+    EXEC_SUCCESS_PATTERN: str = None    # Regex that stops a PoC run early once it appears in stdout (None = run to completion)
+    EXEC_IDLE_TIMEOUT_SECONDS: int = 0  # Terminate a PoC run that produced no output for this long (0 = disabled); buffered output of a killed run is lost
+    EXEC_MAX_OUTPUT_BYTES: int = 1_000_000  # Bytes of stdout/stderr kept per PoC run; the rest is discarded
+    EXEC_LEAK_PATTERN: str = None       # Regex of the leaked-byte lines in execute_binaries trials summaries, groups (Success|Unclear, hex byte) (None = per attack vector)
+    EXEC_METRIC_PATTERN: str = None     # Regex whose first group is the per-run result value in trials summaries, > 0 = success (None = per attack vector)
+    HPC_BACKEND: str = "auto"           # measure_HPC counters: "auto" (perf_event_open, perf CLI fallback), "perf_event_open" or "perf"
+    HPC_COUNTERS_PER_GROUP: int = 4     # Events per perf group in structured measure_HPC (general-purpose PMU counters, 4 with SMT on most x86)
+    CALIBRATION_CACHE_TTL_SECONDS: int = 7 * 24 * 3600  # Reuse measure_cache_threshold results per host fingerprint this long (0 = always measure)
+    COMPILE_CACHE: bool = True          # Reuse binaries and compiler output of identical builds from ~/workdir/.compile_cache
+    EXEC_CORES: list[int] = None        # Cores leased to PoC/calibration executions (None = UGEN_EXEC_CORES env or the process affinity)
+    CORE_LEASE_PHYSICAL: bool = True    # Lease whole physical cores (all SMT siblings) so no execution shares a hyper-thread
+    CORE_LEASE_TIMEOUT_SECONDS: int = 600  # Maximum wait for a free execution core
     LOG_LEVEL: int = logging.DEBUG      # Logging level
     LOG_FORMAT: str = '%(asctime)s %(name)-18s %(levelname)-6s %(message)s'
     LOG_DATE_FORMAT: str = '%Y-%m-%d %H:%M:%S'
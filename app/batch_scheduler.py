@@ -0,0 +1,245 @@
+# batch_scheduler.py
+'''
+Batch scheduler for evaluation sweeps.
+
+Expands a job matrix of (model key, attack vector, victim function, template
+number, repetition) and runs the jobs concurrently, up to a configurable
+limit. Each job is a separate `app.py --job` child process with its own UUID,
+so the workdir (~/workdir/<UUID>/), the log file (~/workdir/logs/<UUID>.log)
+and the process-global state (config, cwd used by do_in_workdir) stay
+isolated. Per-provider concurrency caps and start spacing keep the sweep
+within the providers' rate limits. One result record per job is appended
+to a JSONL or CSV file as soon as the job finishes.
+
+Matrix file (JSON):
+    {
+        "models":            ["gpt-4o", "claude-sonnet-4"],
+        "attack_vectors":    ["Spectre-v1", "Prime-Probe"],
+        "victim_functions":  [1],
+        "template_numbers":  [3],
+        "repetitions":       5
+    }
+or an explicit list of jobs under "jobs", each with the same (singular) keys.
+Optional "llm_replay" (replay mode of the job, default config.LLM_REPLAY) and
+"retrieval_model" (model key whose curated retrieval questions the job uses)
+keys apply to the whole matrix or, under "jobs", to a single job.
+'''
+
+# Built-in imports
+import csv
+import itertools
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from uuid import uuid4
+
+# Local imports
+from app_config import config, get_logger
+from model_configs import models
+
+log = get_logger(__name__)
+
+APP_ENTRY = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+RUNS_DIR = os.path.expanduser("~/workdir/runs")
+
+RESULT_FIELDS = [
+    "uuid", "model", "attack_vector", "victim_function", "template_number", "repetition",
+    "status", "exit_code", "start_time", "end_time", "elapsed_seconds",
+    "programmer_iterations", "reflection_iterations", "total_nodes_executed",
+    "input_tokens", "output_tokens", "log_file",
+]
+
+
+OPTIONAL_JOB_KEYS = ("llm_replay", "retrieval_model")
+
+
+def _optional_keys(spec: dict) -> dict:
+    return {key: spec[key] for key in OPTIONAL_JOB_KEYS if spec.get(key)}
+
+
+def expand_matrix(matrix: dict) -> list[dict]:
+    '''Turn a matrix description into a flat list of job dicts.'''
+    if "jobs" in matrix:
+        jobs = []
+        for job in matrix["jobs"]:
+            for rep in range(1, int(job.get("repetitions", 1)) + 1):
+                jobs.append({
+                    "model": job["model"],
+                    "attack_vector": job["attack_vector"],
+                    "victim_function": int(job.get("victim_function", 1)),
+                    "template_number": int(job.get("template_number", 3)),
+                    "repetition": rep,
+                    **_optional_keys({**matrix, **job}),
+                })
+        return jobs
+
+    jobs = []
+    for model, attack_vector, victim_function, template_number in itertools.product(
+        matrix["models"],
+        matrix["attack_vectors"],
+        matrix.get("victim_functions", [1]),
+        matrix.get("template_numbers", [3]),
+    ):
+        for rep in range(1, int(matrix.get("repetitions", 1)) + 1):
+            jobs.append({
+                "model": model,
+                "attack_vector": attack_vector,
+                "victim_function": int(victim_function),
+                "template_number": int(template_number),
+                "repetition": rep,
+                **_optional_keys(matrix),
+            })
+    return jobs
+
+
+class ProviderGate:
+    '''Per-provider concurrency cap plus a minimum spacing between job starts.'''
+
+    def __init__(self, max_concurrent: dict[str, int], min_interval: dict[str, float]):
+        self._max_concurrent = max_concurrent
+        self._min_interval = min_interval
+        self._semaphores: dict[str, threading.Semaphore] = {}
+        self._last_start: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, provider: str) -> threading.Semaphore | None:
+        limit = self._max_concurrent.get(provider)
+        if not limit:
+            return None
+        with self._lock:
+            if provider not in self._semaphores:
+                self._semaphores[provider] = threading.Semaphore(limit)
+            return self._semaphores[provider]
+
+    def acquire(self, provider: str) -> None:
+        semaphore = self._semaphore(provider)
+        if semaphore is not None:
+            semaphore.acquire()
+        interval = self._min_interval.get(provider, 0)
+        while True:
+            with self._lock:
+                wait = self._last_start.get(provider, 0) + interval - time.time()
+                if wait <= 0:
+                    self._last_start[provider] = time.time()
+                    return
+            time.sleep(wait)
+
+    def release(self, provider: str) -> None:
+        semaphore = self._semaphore(provider)
+        if semaphore is not None:
+            semaphore.release()
+
+
+class ResultWriter:
+    '''Thread-safe appender of job results to a .jsonl or .csv file.'''
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._csv = path.lower().endswith(".csv")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    def write(self, record: dict) -> None:
+        with self._lock:
+            if self._csv:
+                new_file = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                with open(self.path, "a", newline="", encoding="utf-8") as f:
+                    writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS, extrasaction="ignore")
+                    if new_file:
+                        writer.writeheader()
+                    writer.writerow(record)
+            else:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+
+
+def _run_job(job: dict, phase: str, gate: ProviderGate, writer: ResultWriter) -> dict:
+    provider = models[job["model"]]["provider"].lower()
+    run_uuid = uuid4().hex
+    result_file = os.path.join(RUNS_DIR, f"{run_uuid}.json")
+    console_file = os.path.expanduser(f"~/workdir/logs/{run_uuid}.console.log")
+    cmd = [
+        sys.executable, APP_ENTRY, "--job",
+        "--phase", phase,
+        "--model", job["model"],
+        "--attack", job["attack_vector"],
+        "--victim", str(job["victim_function"]),
+        "--template", str(job["template_number"]),
+        "--uuid", run_uuid,
+        "--result-file", result_file,
+        "--llm-replay", job.get("llm_replay") or config.LLM_REPLAY,
+    ]
+    if job.get("retrieval_model"):
+        cmd += ["--retrieval-model", job["retrieval_model"]]
+
+    gate.acquire(provider)
+    start = time.time()
+    try:
+        log.info(f"[batch] Starting {job} as {run_uuid}")
+        os.makedirs(os.path.dirname(console_file), exist_ok=True)
+        with open(console_file, "w") as console:
+            try:
+                # Hard stop well after the run's own TIMEOUT_SECONDS guard should have fired
+                proc = subprocess.run(cmd, stdout=console, stderr=subprocess.STDOUT,
+                                      cwd=os.path.dirname(APP_ENTRY),
+                                      timeout=config.TIMEOUT_SECONDS + config.BATCH_KILL_GRACE_SECONDS)
+                exit_code = proc.returncode
+            except subprocess.TimeoutExpired:
+                exit_code = -1
+                log.error(f"[batch] {run_uuid} killed after exceeding the hard time limit")
+    finally:
+        gate.release(provider)
+    end = time.time()
+
+    record = {field: None for field in RESULT_FIELDS}
+    record.update(job)
+    try:
+        with open(result_file, "r", encoding="utf-8") as f:
+            record.update(json.load(f))
+    except Exception as e:
+        log.warning(f"[batch] No result file for {run_uuid} ({e})")
+        record["status"] = "error"
+    record.update({
+        "uuid": run_uuid,
+        "exit_code": exit_code,
+        "start_time": time.strftime(config.LOG_DATE_FORMAT, time.localtime(start)),
+        "end_time": time.strftime(config.LOG_DATE_FORMAT, time.localtime(end)),
+        "elapsed_seconds": round(end - start, 1),
+        "log_file": os.path.expanduser(f"~/workdir/logs/{run_uuid}.log"),
+    })
+    writer.write(record)
+    log.info(f"[batch] Finished {run_uuid}: status={record['status']} elapsed={record['elapsed_seconds']}s")
+    return record
+
+
+def run_batch(matrix: dict, phase: str, results_path: str, max_concurrent: int | None = None) -> list[dict]:
+    '''Run every job of the matrix and return the result records.
+
+    Args:
+        matrix (dict): Job matrix (see module docstring).
+        phase (str): Graph phase passed to every job (e.g. "Online").
+        results_path (str): Output file; ".csv" writes CSV, anything else JSONL.
+        max_concurrent (int, optional): Overall job concurrency; defaults to config.BATCH_MAX_CONCURRENT_RUNS.
+    Returns:
+        list[dict]: One result record per job, in completion order.
+    '''
+    jobs = expand_matrix(matrix)
+    unknown = sorted({job["model"] for job in jobs if job["model"] not in models})
+    if unknown:
+        raise ValueError(f"Unknown model key(s) {unknown}. Available: {', '.join(models.keys())}")
+
+    workers = max(1, max_concurrent or config.BATCH_MAX_CONCURRENT_RUNS)
+    gate = ProviderGate(config.PROVIDER_MAX_CONCURRENT_RUNS, config.PROVIDER_MIN_START_INTERVAL_SECONDS)
+    writer = ResultWriter(results_path)
+    log.info(f"[batch] {len(jobs)} jobs, up to {workers} concurrent, results -> {results_path}")
+
+    records = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_job, job, phase, gate, writer) for job in jobs]
+        for future in as_completed(futures):
+            records.append(future.result())
+    return records
@@ -0,0 +1,248 @@
+# benchmark.py
+'''
+End-to-end benchmark of the S4 pipeline with a per-node / per-tool timing breakdown.
+
+Runs every (model, attack vector) scenario `--repetitions` times, one job at a
+time, through the batch scheduler (each run is its own `app.py --job`
+process). LLM responses never leave the machine: "mock" models are answered
+by mock_llm_server.py, started in this process unless MOCK_LLM_BASE_URL
+already points at one, and every other model runs with LLM_REPLAY="replay"
+from responses recorded earlier. What is left is the cost of the graph, the
+tools and RAG.
+
+Each run reports the durations recorded by timings.py (graph nodes, LLM
+calls, tools, RAG prefetch). The benchmark pools them per scenario into
+count / total / mean / p50 / p90 / max statistics and writes one JSON report
+that also records the git commit, so two reports can be compared:
+
+    python benchmark.py --attacks Spectre-v1 Prime-Probe --repetitions 5
+    python benchmark.py --compare ~/workdir/benchmarks/<older report>.json
+'''
+
+# Built-in imports
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+from uuid import uuid4
+
+# Local imports
+from app_config import config, get_logger
+
+# UUID must be set before the local imports below create their loggers (log file name)
+config.UUID = config.UUID or f"benchmark-{uuid4().hex}"
+
+from batch_scheduler import run_batch
+from model_configs import models
+from timings import describe
+
+log = get_logger(__name__)
+
+BENCHMARK_DIR = os.path.expanduser("~/workdir/benchmarks")
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPORT_VERSION = 1
+
+# Settings that change where the time goes; recorded so reports stay comparable
+TRACKED_SETTINGS = (
+    "ASYNC_MODE", "STREAM_TOOL_DISPATCH", "TOOL_CALL_WORKERS", "COMPILE_CACHE", "RAG_RESULT_CACHE",
+    "RETRIEVAL_PREFETCH_WORKERS", "RETRIEVAL_ANSWERS_PER_HOP", "CONTEXT_TOKEN_BUDGET", "DEDUP_SUPERSEDED_SOURCES",
+    "RECURSION_LIMIT", "TIMEOUT_SECONDS",
+)
+
+
+def git_revision() -> dict:
+    '''Commit, branch and dirty flag of the checkout (None values outside a git repository).'''
+    def git(*args) -> str | None:
+        try:
+            return subprocess.run(["git", *args], cwd=REPO_DIR, capture_output=True, text=True,
+                                  timeout=30, check=True).stdout.strip()
+        except Exception:
+            return None
+    status = git("status", "--porcelain", "--untracked-files=no")
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "branch": git("rev-parse", "--abbrev-ref", "HEAD"),
+        "dirty": None if status is None else bool(status),
+    }
+
+
+def _is_mock(model_key: str) -> bool:
+    return models[model_key]["provider"].lower() == "mock"
+
+
+def _scenario_report(records: list[dict]) -> dict:
+    '''Pool the timing samples of the repetitions of one scenario.'''
+    pooled: dict[str, dict[str, list[float]]] = {}
+    for record in records:
+        for kind, names in (record.get("timings") or {}).items():
+            for name, samples in names.items():
+                pooled.setdefault(kind, {}).setdefault(name, []).extend(samples)
+    statuses: dict[str, int] = {}
+    for record in records:
+        status = record.get("status") or "error"
+        statuses[status] = statuses.get(status, 0) + 1
+    first = records[0]
+    return {
+        "model": first["model"],
+        "attack_vector": first["attack_vector"],
+        "victim_function": first["victim_function"],
+        "template_number": first["template_number"],
+        "runs": len(records),
+        "statuses": statuses,
+        "elapsed_seconds": describe([r["elapsed_seconds"] for r in records if r.get("elapsed_seconds") is not None]),
+        "nodes_executed": describe([r["total_nodes_executed"] for r in records if r.get("total_nodes_executed") is not None]),
+        "timings": {kind: {name: describe(samples) for name, samples in sorted(names.items())}
+                    for kind, names in sorted(pooled.items())},
+        "uuids": [r["uuid"] for r in records],
+    }
+
+
+def run_benchmark(model_keys: list[str], attack_vectors: list[str], repetitions: int, output: str,
+                  victim_function: int = 1, template_number: int = 3, retrieval_model: str | None = None,
+                  llm_replay: str | None = None, mock_script: dict | None = None,
+                  mock_latency: float = 0.0, mock_tokens_per_second: float = 0.0) -> dict:
+    '''Run the scenarios and write the JSON report to `output`.
+
+    Args:
+        model_keys (list[str]): Keys from model_configs.py; "mock" models use the mock server.
+        attack_vectors (list[str]): Attack vectors to run for every model.
+        repetitions (int): Runs per scenario.
+        output (str): Path of the JSON report; the raw per-run records go next to it (.runs.jsonl).
+        retrieval_model (str, optional): Model key whose retrieval questions and RAG store mock models use (None = no RAG).
+        llm_replay (str, optional): Replay mode of the non-mock models (default "replay").
+        mock_script (dict, optional): Script for the in-process mock server (default: its built-in run).
+        mock_latency / mock_tokens_per_second (float): Mock server response latency and streaming rate.
+    Returns:
+        dict: The report.
+    '''
+    unknown = sorted(set(model_keys) - set(models))
+    if unknown:
+        raise ValueError(f"Unknown model key(s) {unknown}. Available: {', '.join(models.keys())}")
+
+    server = None
+    if any(_is_mock(key) for key in model_keys) and not os.getenv("MOCK_LLM_BASE_URL"):
+        from mock_llm_server import serve_in_thread
+        server = serve_in_thread(mock_script, latency=mock_latency, tokens_per_second=mock_tokens_per_second)
+        # Inherited by the app.py jobs (model_configs reads it at import time)
+        os.environ["MOCK_LLM_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}/v1"
+        log.info(f"[benchmark] Mock LLM server on {os.environ['MOCK_LLM_BASE_URL']}")
+
+    jobs = []
+    for model_key in model_keys:
+        for attack_vector in attack_vectors:
+            job = {"model": model_key, "attack_vector": attack_vector, "victim_function": victim_function,
+                   "template_number": template_number, "repetitions": repetitions}
+            if _is_mock(model_key):
+                job.update(llm_replay="passthrough", retrieval_model=retrieval_model)
+            else:
+                job.update(llm_replay=llm_replay or "replay")
+            jobs.append(job)
+
+    runs_path = f"{os.path.splitext(output)[0]}.runs.jsonl"
+    started = time.time()
+    try:
+        # One job at a time: concurrent runs would compete for the cores being measured
+        records = run_batch({"jobs": jobs}, "Online", runs_path, max_concurrent=1)
+    finally:
+        if server is not None:
+            server.shutdown()
+            os.environ.pop("MOCK_LLM_BASE_URL", None)
+
+    scenarios: dict[tuple, list[dict]] = {}
+    for record in records:
+        scenarios.setdefault((record["model"], record["attack_vector"]), []).append(record)
+    report = {
+        "version": REPORT_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z", time.localtime(started)),
+        "duration_seconds": round(time.time() - started, 1),
+        "git": git_revision(),
+        "host": {"platform": platform.platform(), "machine": platform.machine(),
+                 "python": platform.python_version(), "cpu_count": os.cpu_count()},
+        "settings": {
+            **{name: getattr(config, name) for name in TRACKED_SETTINGS},
+            "repetitions": repetitions,
+            "retrieval_model": retrieval_model,
+            "llm_replay": llm_replay or "replay",
+            "mock_latency": mock_latency,
+            "mock_tokens_per_second": mock_tokens_per_second,
+        },
+        "runs_file": runs_path,
+        "scenarios": [_scenario_report(scenarios[key]) for key in sorted(scenarios)],
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, default=str)
+    return report
+
+
+def format_report(report: dict, baseline: dict | None = None) -> str:
+    '''Text table of mean / p90 / total per node, LLM call, tool and RAG step; with a baseline, the change in mean.'''
+    base = {(s["model"], s["attack_vector"]): s for s in (baseline or {}).get("scenarios", [])}
+    lines = [f"Benchmark at {report['git'].get('commit') or 'unknown commit'}"
+             + (" (dirty)" if report["git"].get("dirty") else "")]
+    if baseline:
+        lines.append(f"Baseline  at {baseline['git'].get('commit') or 'unknown commit'}")
+    for scenario in report["scenarios"]:
+        key = (scenario["model"], scenario["attack_vector"])
+        elapsed = scenario["elapsed_seconds"]
+        lines.append("")
+        lines.append(f"{key[0]} / {key[1]}: {scenario['runs']} run(s) {scenario['statuses']}, "
+                     f"elapsed mean {elapsed.get('mean', 0):.2f}s p90 {elapsed.get('p90', 0):.2f}s")
+        lines.append(f"  {'kind':<5} {'name':<44} {'count':>5} {'mean s':>9} {'p90 s':>9} {'total s':>9}"
+                     + (f" {'vs base':>9}" if baseline else ""))
+        base_timings = base.get(key, {}).get("timings", {})
+        for kind, names in scenario["timings"].items():
+            for name, stats in names.items():
+                line = (f"  {kind:<5} {name:<44} {stats['count']:>5} {stats.get('mean', 0):>9.3f} "
+                        f"{stats.get('p90', 0):>9.3f} {stats['total']:>9.3f}")
+                if baseline:
+                    previous = base_timings.get(kind, {}).get(name, {}).get("mean")
+                    line += f" {(stats.get('mean', 0) - previous) / previous:>+9.1%}" if previous else f" {'new':>9}"
+                lines.append(line)
+    return "\n".join(lines)
+
+
+def _parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="End-to-end S4 benchmark with per-node / per-tool timings")
+    parser.add_argument("--models", nargs="+", default=["mock-local"],
+                        help="model keys; non-mock models replay recorded responses (default: mock-local)")
+    parser.add_argument("--attacks", nargs="+", default=["Spectre-v1", "Prime-Probe"], help="attack vectors")
+    parser.add_argument("--repetitions", type=int, default=3, help="runs per (model, attack vector)")
+    parser.add_argument("--victim", type=int, default=1, help="victim function number")
+    parser.add_argument("--template", type=int, default=3, help="template number")
+    parser.add_argument("--retrieval-model", default="claude-sonnet-4",
+                        help="model key whose retrieval questions mock models use ('' = no RAG)")
+    parser.add_argument("--llm-replay", default=None, choices=["replay", "record", "passthrough"],
+                        help="replay mode of non-mock models (default: replay, i.e. fully offline)")
+    parser.add_argument("--mock-script", default=None, help="JSON script for the mock server (see mock_llm_server.py)")
+    parser.add_argument("--mock-latency", type=float, default=0.0, help="mock response latency in seconds")
+    parser.add_argument("--mock-tokens-per-second", type=float, default=0.0, help="mock streaming rate (0 = unthrottled)")
+    parser.add_argument("--output", default=None, help="report path (default: ~/workdir/benchmarks/<time>-<commit>.json)")
+    parser.add_argument("--compare", metavar="BASELINE_JSON", default=None, help="print the change against an earlier report")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    mock_script = None
+    if args.mock_script:
+        with open(args.mock_script, "r", encoding="utf-8") as f:
+            mock_script = json.load(f)
+    output = args.output
+    if output is None:
+        commit = (git_revision()["commit"] or "nogit")[:12]
+        output = os.path.join(BENCHMARK_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+
+    report = run_benchmark(args.models, args.attacks, args.repetitions, output,
+                           victim_function=args.victim, template_number=args.template,
+                           retrieval_model=args.retrieval_model or None, llm_replay=args.llm_replay,
+                           mock_script=mock_script, mock_latency=args.mock_latency,
+                           mock_tokens_per_second=args.mock_tokens_per_second)
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    print(format_report(report, baseline))
+    print(f"\nReport: {output}")
@@ -0,0 +1,232 @@
+# context_manager.py
+'''
+Token-budgeted compaction of the agent conversation.
+
+Before every LLM call the conversation is measured with tiktoken. When it
+exceeds the budget, content the agents are told to ignore anyway is collapsed
+into one-line summaries, oldest first:
+
+1. execute_binaries / measure_HPC results that precede the latest
+   [FRESH ANALYSIS REQUIRED] signal (they belong to an older code version);
+2. file_contents of compile calls superseded by a later compile call.
+
+Messages are replaced, never removed, so every tool_call keeps its matching
+ToolMessage. Whatever remains over budget is left to the graph's head/tail
+truncation fallback.
+
+Independently of the budget, dedup_superseded_sources() renders a copy of the
+conversation for each LLM call in which every compile call but the latest
+carries a unified diff to the source of the next compile call (or a
+content-hash reference when the diff would not be smaller), so the PoC is
+sent in full once per prompt instead of once per compile attempt. Diffing
+against the next version rather than the current one keeps the rendering of
+a message fixed once its successor exists: each compile changes only the
+previous compile call, and the provider's prompt-prefix cache stays valid
+up to it. The stored conversation is untouched.
+'''
+
+# Built-in imports
+import difflib
+import hashlib
+import json
+from functools import lru_cache
+
+# Langchain imports
+import tiktoken
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage # type: ignore
+from langchain_core.messages.ai import AIMessage # type: ignore
+
+# Local imports
+from app_config import get_logger
+
+log = get_logger(__name__)
+
+FRESH_ANALYSIS_MARKER = "[FRESH ANALYSIS REQUIRED]"
+STALE_AFTER_UPDATE_TOOLS = frozenset({"execute_binaries", "measure_HPC"})
+SOURCE_TOOLS = frozenset({"compile_C", "compile_CPP", "compile_rust"})
+_PER_MESSAGE_OVERHEAD = 4   # role/separator tokens per chat message
+_MAX_DIFF_RATIO = 0.5       # render a diff only if it is at most this fraction of the source size
+
+
+@lru_cache(maxsize=None)
+def _encoding(model_name: str | None):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name or "")
+        except KeyError:
+            # Non-OpenAI models: o200k_base is a close enough estimate for budgeting
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # The BPE files could not be loaded (e.g. offline without a tiktoken cache)
+        log.warning(f"tiktoken encoding unavailable ({e}); estimating 4 characters per token")
+        return None
+
+
+def _text_tokens(text: str, model_name: str | None) -> int:
+    enc = _encoding(model_name)
+    if enc is None:
+        return len(text) // 4
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def _content_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return json.dumps(content, default=str)
+
+
+def message_tokens(message: BaseMessage, model_name: str | None = None) -> int:
+    '''Approximate prompt tokens of one message, including its tool_call arguments.'''
+    tokens = _PER_MESSAGE_OVERHEAD + _text_tokens(_content_text(message.content), model_name)
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        tokens += _text_tokens(json.dumps(tool_call.get("args", {}), default=str), model_name)
+    return tokens
+
+
+def count_tokens(conversation: list[BaseMessage], model_name: str | None = None) -> int:
+    return sum(message_tokens(message, model_name) for message in conversation)
+
+
+def _source_digest(source: str) -> str:
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+
+
+def _source_summary(source: str, name: str) -> str:
+    return (f"[superseded source omitted: sha256 {_source_digest(source)}, {source.count(chr(10)) + 1} lines; "
+            f"a later {name} call contains the current version]")
+
+
+def _source_diff(source: str, next_source: str, name: str) -> str:
+    '''Render a superseded source as a unified diff to the next compiled version, or as a hash reference.'''
+    if source == next_source:
+        return f"[superseded source omitted: identical to the next {name} call's source (sha256 {_source_digest(next_source)})]"
+    diff = "".join(difflib.unified_diff(
+        source.splitlines(keepends=True), next_source.splitlines(keepends=True),
+        fromfile=f"sha256:{_source_digest(source)}", tofile=f"sha256:{_source_digest(next_source)} (next version)", n=1,
+    ))
+    if len(diff) > _MAX_DIFF_RATIO * len(source):
+        return _source_summary(source, name)
+    return (f"[superseded source omitted ({source.count(chr(10)) + 1} lines); "
+            f"unified diff from it to the source of the next {name} call:]\n{diff}")
+
+
+def _is_collapsed(source: str) -> bool:
+    return source.startswith("[superseded source")
+
+
+def _source_call_positions(conversation: list[BaseMessage]) -> list[tuple[int, int]]:
+    '''(message index, tool_call index) of every compile call that carries inline source, in order.'''
+    positions = []
+    for i, message in enumerate(conversation):
+        if not isinstance(message, AIMessage):
+            continue
+        for j, tool_call in enumerate(message.tool_calls or []):
+            if tool_call.get("name") in SOURCE_TOOLS and isinstance((tool_call.get("args") or {}).get("file_contents"), str):
+                positions.append((i, j))
+    return positions
+
+
+def _rewrite_sources(conversation: list[BaseMessage], render) -> int:
+    '''Replace file_contents of every compile call except the most recent one with
+    render(source, tool name, source of the next compile call).
+
+    Messages are replaced (in place in `conversation`) by copies; the originals are not modified.
+    '''
+    positions = _source_call_positions(conversation)
+    by_message: dict[int, dict[int, str]] = {}
+    for (i, j), (next_i, next_j) in zip(positions, positions[1:]):
+        by_message.setdefault(i, {})[j] = conversation[next_i].tool_calls[next_j]["args"]["file_contents"]
+
+    collapsed = 0
+    for i, next_sources in by_message.items():
+        message = conversation[i]
+        tool_calls = []
+        changed = False
+        for j, tool_call in enumerate(message.tool_calls):
+            args = tool_call.get("args") or {}
+            source = args.get("file_contents")
+            if j in next_sources and not _is_collapsed(source):
+                args = {**args, "file_contents": render(source, tool_call["name"], next_sources[j])}
+                changed = True
+                collapsed += 1
+            tool_calls.append({**tool_call, "args": args})
+        if changed:
+            # The provider-format copy of the tool calls would still carry the full source
+            additional_kwargs = {k: v for k, v in message.additional_kwargs.items() if k != "tool_calls"}
+            conversation[i] = message.model_copy(update={"tool_calls": tool_calls, "additional_kwargs": additional_kwargs})
+    return collapsed
+
+
+def latest_source(conversation: list[BaseMessage]) -> str | None:
+    '''file_contents of the most recent compile call in the conversation, if any.'''
+    positions = _source_call_positions(conversation)
+    if not positions:
+        return None
+    i, j = positions[-1]
+    return conversation[i].tool_calls[j]["args"]["file_contents"]
+
+
+def dedup_superseded_sources(conversation: list[BaseMessage]) -> list[BaseMessage]:
+    '''Return a copy of `conversation` for prompt rendering with superseded sources replaced by diffs.
+
+    The latest compile call keeps its full source and every earlier one is rendered as a diff to the
+    source of the compile call that followed it, so a message renders the same in every later prompt.
+
+    Args:
+        conversation (list[BaseMessage]): The agent conversation (not modified).
+    Returns:
+        list[BaseMessage]: A new list; unchanged messages are shared with `conversation`.
+    '''
+    rendered = list(conversation)
+    collapsed = _rewrite_sources(rendered, _source_diff)
+    if collapsed:
+        log.debug(f"Rendered {collapsed} superseded source(s) as diffs / hash references")
+    return rendered
+
+
+def _collapse_stale_tool_outputs(conversation: list[BaseMessage]) -> int:
+    '''Collapse execute_binaries / measure_HPC results older than the latest fresh-analysis signal.'''
+    latest_fresh = max((i for i, m in enumerate(conversation)
+                        if isinstance(m, HumanMessage) and FRESH_ANALYSIS_MARKER in _content_text(m.content)),
+                       default=-1)
+    collapsed = 0
+    for i in range(latest_fresh):
+        message = conversation[i]
+        if (isinstance(message, ToolMessage) and message.name in STALE_AFTER_UPDATE_TOOLS
+                and not _content_text(message.content).startswith("[stale")):
+            conversation[i] = ToolMessage(
+                name=message.name,
+                tool_call_id=message.tool_call_id,
+                content=f"[stale {message.name} output omitted: it was produced by an older version of the code]",
+            )
+            collapsed += 1
+    return collapsed
+
+
+def _collapse_superseded_sources(conversation: list[BaseMessage]) -> int:
+    '''Replace file_contents of every compile call except the most recent one with a hash summary.'''
+    return _rewrite_sources(conversation, lambda source, name, next_source: _source_summary(source, name))
+
+
+def compact_conversation(conversation: list[BaseMessage], budget: int, model_name: str | None = None) -> tuple[int, int]:
+    '''Compact `conversation` in place until it fits `budget` tokens (or nothing is left to collapse).
+
+    Args:
+        conversation (list[BaseMessage]): The agent conversation; modified in place.
+        budget (int): Token budget for the conversation messages (0 disables compaction).
+        model_name (str, optional): Model name used to pick the tiktoken encoding.
+    Returns:
+        tuple[int, int]: (tokens before, tokens after)
+    '''
+    before = count_tokens(conversation, model_name)
+    if budget <= 0 or before <= budget:
+        return before, before
+
+    after = before
+    for step in (_collapse_stale_tool_outputs, _collapse_superseded_sources):
+        if step(conversation):
+            after = count_tokens(conversation, model_name)
+            if after <= budget:
+                break
+    log.info(f"Conversation compacted from {before} to {after} tokens (budget {budget})")
+    return before, after
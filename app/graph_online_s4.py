@@ -6,15 +6,16 @@ Online Stage
 '''
 
 # Built-in imports
+import asyncio
 import logging
 import re, json, ast
 import inspect
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from uuid import uuid4
 from typing import Any, Dict, List
 
 
-import openai
 
 # Langchain imports
 from langchain_core.messages import ToolMessage, HumanMessage # type: ignore
@@ -31,6 +32,10 @@ from agents.AgentState import AgentState
 from agents.programmer.ProgrammerAgent import ProgrammerAgent
 from agents.programmer.ProgrammerReflectionAgent import ProgrammerReflectionAgent
 from agents.programmer.ProgrammerEvaluatorAgent import ProgrammerEvaluatorAgent
+from tool_dispatch import run_tool_calls, StreamingToolDispatcher
+from context_manager import compact_conversation, count_tokens, dedup_superseded_sources, latest_source
+from rate_limiter import get_rate_limiter
+from timings import timings
 
 # Tools imports
 from tools.compiler import compile_C, compile_CPP, compile_rust
@@ -44,12 +49,12 @@ from tools.cache_threshold import measure_cache_threshold
 
 
 # Factory + model registry
-from llm_factory import build_chat_llm
+from llm_factory import build_chat_llm, prompt_cache_usage, supports_prompt_caching, RATE_LIMIT_ERRORS
 from model_configs import models
 
 
 # Import the new retriever tool and the initialize_retriever function
-from tools.retriever_llm import rag_tool
+from tools.retriever_llm import rag_tool, prefetch_retrievals
 
 # The main graph that orchestrates all agents and tools
 class MainGraph():
@@ -74,6 +79,8 @@ class MainGraph():
         """
         self.log = get_logger(__name__)
         self.llm: BaseChatModel = self._get_llm(model_key)
+        self.model_name = models[model_key]['model']
+        self.rate_limiter = get_rate_limiter(models[model_key]['provider'], self.model_name)
         self.prompt_phase = prompt_phase
         self.programmer_agent = self._get_programmer_agent()
         self.programmer_reflection_agent = self._get_programmer_reflection_agent()
@@ -107,7 +114,10 @@ class MainGraph():
         )
 
         self._timeout_exceeded = False
+        self._retrieval_prefetch: Future | None = None
+        self._early_dispatch: StreamingToolDispatcher | None = None
         self.graph = self._create_graph()
+        self.async_graph = None     # built on first arun()
         pass
 
     def _is_timed_out(self) -> bool:
@@ -221,15 +231,26 @@ class MainGraph():
         self.log.info("✓ Convergence detected: PoC passes all benchmark steps")
         return True
 
-    def _create_graph(self) -> Any:
+    def _create_graph(self, async_nodes: bool = False) -> Any:
         workflow = StateGraph(AgentState)
 
-        workflow.add_node(*self.programmer_node)
-        workflow.add_node(*self.programmer_tools_node)
-        workflow.add_node(*self.programmer_reflection_tools_node)
-        workflow.add_node(*self.programmer_reflection_node)    
-        workflow.add_node(*self.programmer_retriever_node)
-        workflow.add_node(*self.final_summary_node)
+        if async_nodes:
+            # Same topology; LLM nodes await agent.ainvoke and every blocking node (tools, the
+            # Retriever waiting on the prefetch / loading the embedder, the final summary) runs in a
+            # worker thread, so the event loop (and the timeout in arun) is never blocked.
+            workflow.add_node(self.programmer_node[0], self._timed_node(self._aprogrammer_node_action, self._programmer_node_action))
+            workflow.add_node(self.programmer_tools_node[0], self._athreaded_node(self._timed_node(self._programmer_tools_node_action)))
+            workflow.add_node(self.programmer_reflection_tools_node[0], self._athreaded_node(self._timed_node(self._programmer_reflection_tools_node_action)))
+            workflow.add_node(self.programmer_reflection_node[0], self._timed_node(self._aprogrammer_reflection_node_action, self._programmer_reflection_node_action))
+            workflow.add_node(self.programmer_retriever_node[0], self._athreaded_node(self._timed_node(self._retriever_node_action)))
+            workflow.add_node(self.final_summary_node[0], self._athreaded_node(self._timed_node(self._final_summary_node_action)))
+        else:
+            workflow.add_node(self.programmer_node[0], self._timed_node(self.programmer_node[1]))
+            workflow.add_node(self.programmer_tools_node[0], self._timed_node(self.programmer_tools_node[1]))
+            workflow.add_node(self.programmer_reflection_tools_node[0], self._timed_node(self.programmer_reflection_tools_node[1]))
+            workflow.add_node(self.programmer_reflection_node[0], self._timed_node(self.programmer_reflection_node[1]))
+            workflow.add_node(self.programmer_retriever_node[0], self._timed_node(self.programmer_retriever_node[1]))
+            workflow.add_node(self.final_summary_node[0], self._timed_node(self.final_summary_node[1]))
 
         #START -> Programmer Agent
         workflow.set_entry_point(self.programmer_node[0])
@@ -270,6 +291,18 @@ class MainGraph():
         return workflow.compile()
     
 
+    @staticmethod
+    def _timed_node(action, sync_action=None):
+        """Record each visit of a node under its (sync) action name in timings.py, so sync and async runs compare."""
+        return timings.timed("node", (sync_action or action).__name__)(action)
+
+    @staticmethod
+    def _athreaded_node(action):
+        """Wrap a blocking node action so the async graph runs it in a worker thread."""
+        async def run_in_thread(state: AgentState) -> AgentState:
+            return await asyncio.to_thread(action, state)
+        return run_in_thread
+
     def _truncate_conversation(self, state: AgentState, keep_head: int = 4, keep_tail: int = 12) -> bool:
         """Remove middle messages from the conversation to reduce token count.
 
@@ -301,37 +334,177 @@ class MainGraph():
         state['conversation'] = head + tail
         return True
 
+    def _compact_conversation(self, state: AgentState) -> None:
+        """Collapse stale tool outputs and superseded sources when the conversation exceeds CONTEXT_TOKEN_BUDGET."""
+        if config.CONTEXT_TOKEN_BUDGET <= 0:
+            return
+        try:
+            before, after = compact_conversation(state['conversation'], config.CONTEXT_TOKEN_BUDGET, self.model_name)
+        except Exception as e:
+            self.log.warning(f"Conversation compaction skipped: {e}")
+            return
+        if after > config.CONTEXT_TOKEN_BUDGET:
+            self.log.warning(f"Conversation still {after} tokens after compaction (budget {config.CONTEXT_TOKEN_BUDGET})")
+
+    def _render_state(self, state: AgentState) -> AgentState:
+        """The state handed to an agent: superseded inline sources are rendered as diffs / hash references.
+
+        Only the prompt copy is rewritten; state['conversation'] keeps every original message.
+        With explicit prompt caching (cache_control breakpoints) nothing is rewritten: turning the
+        previous compile call into a diff would change a prefix that is already cached, and cache
+        reads of the full sources cost less than re-sending everything after them uncached.
+        """
+        if not config.DEDUP_SUPERSEDED_SOURCES or supports_prompt_caching(self.llm):
+            return state
+        rendered = dict(state)
+        rendered['conversation'] = dedup_superseded_sources(state['conversation'])
+        return rendered
+
+    def _record_source(self, state: AgentState) -> None:
+        """Keep the latest compiled PoC source in state['programmer_source_code']."""
+        source = latest_source(state['conversation'][-1:])
+        if source is not None:
+            state['programmer_source_code'] = source
+
     def _invoke_with_retry(self, agent, state: AgentState) -> AIMessage:
-        """Invoke an agent with automatic recovery from OpenAI 429 errors.
+        """Invoke an agent, paced by the provider's rate limiter, with automatic recovery from 429 errors.
 
+        The conversation is compacted to CONTEXT_TOKEN_BUDGET first, so oversized
+        requests are normally avoided before they are sent.
         - 'tokens' type (single request exceeds TPM budget): truncate the conversation
           and retry immediately — sleeping is useless when the request itself is over-size.
-        - Any other 429 (requests-per-minute throttle): sleep 60 s and retry.
+        - Any other 429 (requests-per-minute throttle): wait for the limiter's retry-after /
+          jittered exponential backoff and retry.
         """
+        self._compact_conversation(state)
         while True:
+            rendered = self._render_state(state)
+            estimate = count_tokens(rendered['conversation'], self.model_name)
+            waited = self.rate_limiter.acquire(estimate)
+            if waited:
+                timings.record("llm", "rate_limit_wait", waited)
             try:
-                return agent.invoke(state)
-            except openai.RateLimitError as e:
-                err_body = getattr(e, 'body', None) or {}
-                err_type = err_body.get('error', {}).get('type', '')
-                # Fallback: check error string for providers that don't set body correctly
-                is_token_overflow = (err_type == 'tokens') or ('tokens per min' in str(e).lower())
-                if is_token_overflow:
+                with timings.measure("llm", agent.name):
+                    result = self._call_agent(agent, state, rendered)
+            except RATE_LIMIT_ERRORS as e:
+                if self._is_token_overflow(e):
                     self.log.warning(f"Request too large: {e}. Truncating conversation and retrying...")
                     if not self._truncate_conversation(state):
                         self.log.error("Cannot truncate further — conversation already minimal. Re-raising.")
                         raise
                 else:
-                    self.log.warning(f"Rate limit hit: {e}. Sleeping 60s before retry...")
-                    time.sleep(60)
+                    time.sleep(self.rate_limiter.on_rate_limit(e))
+                continue
+            self.rate_limiter.record(result, estimate)
+            return result
 
-    def _programmer_node_action(self, state: AgentState) -> AgentState:
-        ''' Action for the programmer node.
-        Args:
-            state (AgentState): The current state of the agent.
-        Returns:
-            AgentState: The updated state of the agent.
-        '''
+    async def _ainvoke_with_retry(self, agent, state: AgentState) -> AIMessage:
+        """Async twin of _invoke_with_retry: awaits agent.ainvoke and waits without blocking the event loop."""
+        self._compact_conversation(state)
+        while True:
+            rendered = self._render_state(state)
+            estimate = count_tokens(rendered['conversation'], self.model_name)
+            waited = await self.rate_limiter.aacquire(estimate)
+            if waited:
+                timings.record("llm", "rate_limit_wait", waited)
+            try:
+                with timings.measure("llm", agent.name):
+                    result = await self._acall_agent(agent, state, rendered)
+            except RATE_LIMIT_ERRORS as e:
+                if self._is_token_overflow(e):
+                    self.log.warning(f"Request too large: {e}. Truncating conversation and retrying...")
+                    if not self._truncate_conversation(state):
+                        self.log.error("Cannot truncate further — conversation already minimal. Re-raising.")
+                        raise
+                else:
+                    await asyncio.sleep(self.rate_limiter.on_rate_limit(e))
+                continue
+            self.rate_limiter.record(result, estimate)
+            return result
+
+    def _tool_output_label(self, agent) -> str:
+        return "Programmer Tool Output" if agent is self.programmer_agent else "Reflection Tool Output"
+
+    def _start_early_dispatch(self, agent, state: AgentState):
+        """New dispatcher for the tool calls of the response about to be streamed, and its on_tool_call hook."""
+        dispatcher = StreamingToolDispatcher(agent.tools, state, self._tool_output_label(agent))
+        conversation = list(state['conversation'])
+
+        def on_tool_call(tool_call: dict) -> None:
+            # A call the Programmer router would bypass (repeated clean compile) is left to the tools node
+            if agent is self.programmer_agent and self._is_repeated_clean_call(conversation, {tool_call['name']}):
+                return
+            dispatcher.submit(tool_call)
+        return dispatcher, on_tool_call
+
+    def _discard_early_dispatch(self) -> None:
+        """Wait for tool calls started early whose results were never collected (e.g. the router bypassed the tools node)."""
+        dispatcher, self._early_dispatch = self._early_dispatch, None
+        if dispatcher is not None:
+            if dispatcher.submitted:
+                self.log.info(f"Discarding {len(dispatcher.submitted)} early-started tool call result(s)")
+            dispatcher.close()
+
+    def _call_agent(self, agent, state: AgentState, rendered: AgentState) -> AIMessage:
+        """One LLM call; with STREAM_TOOL_DISPATCH the response is streamed and its tool calls start early."""
+        if not config.STREAM_TOOL_DISPATCH:
+            return agent.invoke(rendered)
+        self._discard_early_dispatch()
+        dispatcher, on_tool_call = self._start_early_dispatch(agent, state)
+        try:
+            result = agent.invoke_streaming(rendered, on_tool_call)
+        except BaseException:
+            dispatcher.close()
+            raise
+        self._early_dispatch = dispatcher
+        return result
+
+    async def _acall_agent(self, agent, state: AgentState, rendered: AgentState) -> AIMessage:
+        """Async twin of _call_agent."""
+        if not config.STREAM_TOOL_DISPATCH:
+            return await agent.ainvoke(rendered)
+        await asyncio.to_thread(self._discard_early_dispatch)
+        dispatcher, on_tool_call = self._start_early_dispatch(agent, state)
+        try:
+            result = await agent.ainvoke_streaming(rendered, on_tool_call)
+        except BaseException:
+            await asyncio.to_thread(dispatcher.close)
+            raise
+        self._early_dispatch = dispatcher
+        return result
+
+    def _run_tool_calls(self, agent, state: AgentState, tool_calls: list[dict]) -> list[ToolMessage]:
+        """Tool results for the last AIMessage, reusing the calls that were started while it streamed."""
+        dispatcher, self._early_dispatch = self._early_dispatch, None
+        if dispatcher is not None:
+            return dispatcher.collect(tool_calls)
+        # Independent tool calls run concurrently; PoC/ tools stay serialized in request order.
+        return run_tool_calls(tool_calls, agent.tools, state, self._tool_output_label(agent))
+
+    @staticmethod
+    def _is_repeated_clean_call(conversation: list, tool_names: set) -> bool:
+        """True if the last message is a clean (error-free) result of one of `tool_names`."""
+        if not conversation:
+            return False
+        prev_msg = conversation[-1]
+        prev_content = getattr(prev_msg, 'content', '')
+        prev_clean = not any(
+            ind in prev_content.lower()
+            for ind in ['error', 'failed', 'exception', 'traceback', 'warning:']
+        )
+        return (isinstance(prev_msg, ToolMessage) and
+                getattr(prev_msg, 'name', None) in tool_names and
+                prev_clean)
+
+    @staticmethod
+    def _is_token_overflow(error: Exception) -> bool:
+        """True if the 429 says the single request exceeds the tokens-per-minute budget."""
+        err_body = getattr(error, 'body', None) or {}
+        err_type = err_body.get('error', {}).get('type', '') if isinstance(err_body, dict) else ''
+        # Fallback: check error string for providers that don't set body correctly
+        return (err_type == 'tokens') or ('tokens per min' in str(error).lower())
+
+    def _before_programmer_turn(self, state: AgentState) -> None:
         self.log.info(f"##### Programmer Node Start {state['programmer_count']+1} #####")
 
 
@@ -340,12 +513,7 @@ class MainGraph():
             state['conversation'].extend(state['retrieval_responses'])
             state['retrieval_responses'].clear()  # Clear after use
 
-
-        if config.LLM_NODE_DELAY_SECONDS > 0:
-            self.log.debug(f"Sleeping {config.LLM_NODE_DELAY_SECONDS}s before LLM call (TPM throttle)")
-            time.sleep(config.LLM_NODE_DELAY_SECONDS)
-
-        result: AIMessage = self._invoke_with_retry(self.programmer_agent, state)
+    def _after_programmer_turn(self, state: AgentState, result: AIMessage) -> AgentState:
         result.content = result.content.strip()
 
         state['programmer_count'] += 1
@@ -355,6 +523,25 @@ class MainGraph():
         # self.log.info(f"Programmer Agent Tool Calls:\n{result.tool_calls}")
         self.log.info('##### Programmer Node End #####')
         return state
+
+    def _programmer_node_action(self, state: AgentState) -> AgentState:
+        ''' Action for the programmer node.
+        Args:
+            state (AgentState): The current state of the agent.
+        Returns:
+            AgentState: The updated state of the agent.
+        '''
+        self._before_programmer_turn(state)
+
+        result: AIMessage = self._invoke_with_retry(self.programmer_agent, state)
+        return self._after_programmer_turn(state, result)
+
+    async def _aprogrammer_node_action(self, state: AgentState) -> AgentState:
+        ''' Async action for the programmer node (used by arun). '''
+        self._before_programmer_turn(state)
+
+        result: AIMessage = await self._ainvoke_with_retry(self.programmer_agent, state)
+        return self._after_programmer_turn(state, result)
     
 
     def _programmer_tools_node_action(self, state: AgentState) -> AgentState:
@@ -371,54 +558,57 @@ class MainGraph():
             self.log.warning('No tool calls found.')
             self.log.info('##### Programmer Tools Node End #####')
             return state
+        self._record_source(state)
 
-        for tool_call in tool_calls:
-            # Find the tool by name
-            tool_obj = next((t for t in self.programmer_agent.tools if getattr(t, "name", None) == tool_call['name']), None)
-            if not tool_obj:
-                self.log.warning(f"Tool '{tool_call['name']}' not found.")
-                state['conversation'].append(ToolMessage(
-                    name=tool_call['name'],
-                    tool_call_id=tool_call.get('id',''),
-                    content=f"ERROR: Tool '{tool_call['name']}' is not registered in this node."
-                ))
-                continue
-            try:
-                # **** start: version 1 ****
-                # ret = tool_obj.invoke(tool_call['args']) 
-                # **** end: version 1 ****
-
-                # **** start: version 2 ****
-                args = dict(tool_call['args'] or {})
-                # If the tool expects `state` but it wasn't provided by the LLM, inject it.
-                fields = getattr(getattr(tool_obj, "args_schema", None), "model_fields", {}) or {}
-                if "state" in fields and "state" not in args:
-                    # Pass a plain dict to avoid TypedDict/Message objects causing serialization issues
-                    args["state"] = dict(state)
-                ret = tool_obj.invoke(args)
-                # **** end: version 2 ****
-
-            except Exception as e:
-                ret = f"Tool execution error: {e}"
-            if isinstance(ret, dict):
-                content = [f"{key}:\n```\n{value}\n```" for key, value in ret.items()]
-            elif isinstance(ret, tuple):
-                content = [f"Programmer Tool Output:\n```\n{ret}\n```"]
-            else:
-                content = [f"Programmer Tool Output:\n```\n{ret}\n```"]
-            result = ToolMessage(
-                name = tool_call['name'],
-                tool_call_id = tool_call.get('id', ''),
-                content = '\n'.join(content)
-            )
+        for result in self._run_tool_calls(self.programmer_agent, state, tool_calls):
             state['conversation'].append(result)
             self.log.debug(result.content)
         self.log.info('##### Programmer Tools Node End #####')
         return state
     
 
+    @staticmethod
+    def _retrieval_model_key(state: AgentState) -> str | None:
+        """Model key selecting the RAG store and embedder (app.py --retrieval-model, else the run's model)."""
+        return state.get('retrieval_model_key') or state.get('selected_model_key')
+
+    def _start_retrieval_prefetch(self, state: AgentState) -> None:
+        """Answer all curated retrieval questions in the background.
+
+        The batch embed + concurrent similarity searches overlap with the first
+        Programmer LLM call; the Retriever node later only dequeues the results.
+        """
+        self._retrieval_prefetch = None
+        questions = list(state.get('retrieval_questions') or [])
+        if not questions:
+            return
+        rag_state = {
+            'selected_model_key': self._retrieval_model_key(state),
+            'attack_vector': state.get('attack_vector'),
+        }
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-prefetch")
+        self._retrieval_prefetch = executor.submit(timings.timed("rag")(prefetch_retrievals), questions, rag_state)
+        executor.shutdown(wait=False)
+        self.log.info(f"Started background prefetch of {len(questions)} retrieval queries.")
+
+    def _get_prefetched_retrievals(self, state: AgentState) -> list | None:
+        """Wait for the prefetch started in run(); None means fall back to per-query rag_tool calls."""
+        if self._retrieval_prefetch is None:
+            return None
+        try:
+            answers = self._retrieval_prefetch.result()
+        except Exception as e:
+            self.log.warning(f"Retrieval prefetch failed ({e}); falling back to per-query retrieval.")
+            self._retrieval_prefetch = None
+            return None
+        if len(answers) != len(state.get('retrieval_questions', [])):
+            self.log.warning("Retrieval prefetch does not match the current questions; falling back to per-query retrieval.")
+            return None
+        return answers
+
     def _retriever_node_action(self, state: AgentState) -> AgentState:
         ''' Action for the retriever node.
+        Dequeues the prefetched answers (RETRIEVAL_ANSWERS_PER_HOP per visit, 0 = all remaining).
         Args:
             state (AgentState): The current state of the agent.
         Returns:
@@ -428,51 +618,50 @@ class MainGraph():
         self.log.info(f"##### Retriever Node Start {state['query_index']+1}#####")
         state['total_nodes_executed'] = state.get('total_nodes_executed', 0) + 1
 
-        # Simulate retrieval based on document questions
-        query_index = state.get('query_index',[])
+        query_index = state.get('query_index', 0)
         retrieval_questions = state.get('retrieval_questions', [])
-        query = retrieval_questions[query_index] if query_index < len(retrieval_questions) else ""
-        # self.log.info(f"Query: {query}")
-        # tool_call_id = state.get('retrieval_tool_call_id', uuid4().hex)
-       
-        # Directly invoke the rag_tool as in offline graph
-        try:
-            ret = rag_tool.invoke({'query': query, 'state': dict(state)})
-        except Exception as e:
-            ret = f"Tool execution error: {e}"
-
-        # Format output as in offline graph
-        if isinstance(ret, dict):
-            content = [f"{key}:\n```\n{value}\n```" for key, value in ret.items()]
-        elif isinstance(ret, tuple):
-            content = [f"Retriever Tool Output:\n```\n{ret}\n```"]
-        else:
-            content = [f"Retriever Tool Output:\n```\n{ret}\n```"]
-
-        # Retrieval responses are injected as HumanMessage (not AIMessage) so the LLM
-        # sees them as externally delivered information, not its own prior output.
-        # Using AIMessage here caused the LLM to treat retrieval content as self-generated
-        # text and fabricate additional retrieval responses in subsequent turns.
-        result = HumanMessage(
-          content=f"""[Retriever Node] Retrieved information for query: \"{query}\"\n{''.join(content)}"""
-        )
-        state['retrieval_responses'].append(result)
-        self.log.info(f"Question: {query}\nRetrieved Answer: {content or 'No answer found.'}")
+        answers = self._get_prefetched_retrievals(state)
+        per_hop = config.RETRIEVAL_ANSWERS_PER_HOP or len(retrieval_questions)
+        end_index = min(len(retrieval_questions), query_index + max(1, per_hop))
+
+        for index in range(query_index, end_index):
+            query = retrieval_questions[index]
+            if answers is not None:
+                ret = answers[index]
+            else:
+                # Directly invoke the rag_tool as in offline graph
+                try:
+                    with timings.measure("tool", "rag_tool"):
+                        ret = rag_tool.invoke({'query': query, 'state': {**state, 'selected_model_key': self._retrieval_model_key(state)}})
+                except Exception as e:
+                    ret = f"Tool execution error: {e}"
+
+            # Format output as in offline graph
+            if isinstance(ret, dict):
+                content = [f"{key}:\n```\n{value}\n```" for key, value in ret.items()]
+            elif isinstance(ret, tuple):
+                content = [f"Retriever Tool Output:\n```\n{ret}\n```"]
+            else:
+                content = [f"Retriever Tool Output:\n```\n{ret}\n```"]
+
+            # Retrieval responses are injected as HumanMessage (not AIMessage) so the LLM
+            # sees them as externally delivered information, not its own prior output.
+            # Using AIMessage here caused the LLM to treat retrieval content as self-generated
+            # text and fabricate additional retrieval responses in subsequent turns.
+            result = HumanMessage(
+              content=f"""[Retriever Node] Retrieved information for query: \"{query}\"\n{''.join(content)}"""
+            )
+            state['retrieval_responses'].append(result)
+            self.log.info(f"Question: {query}\nRetrieved Answer: {content or 'No answer found.'}")
 
-        state['query_index'] += 1
+        state['query_index'] = max(end_index, query_index + 1)
         self.log.info(f"##### Retriever Node End #####")
         return state
 
 
 
 
-    def _programmer_reflection_node_action(self, state: AgentState) -> AgentState:
-        ''' Action for the programmer reflection node.
-        Args:
-            state (AgentState): The current state of the agent.
-        Returns:
-            AgentState: The updated state of the agent.
-        '''
+    def _before_reflection_turn(self, state: AgentState) -> None:
         self.log.info(f"##### Programmer Reflection Node Start {state['programmer_reflection_count']+1} #####")
 
         last_msg = state['conversation'][-1] if state['conversation'] else None
@@ -521,11 +710,7 @@ class MainGraph():
             )))
             self.log.info("Injected fresh-analysis signal into conversation (Programmer handoff detected).")
 
-        if config.LLM_NODE_DELAY_SECONDS > 0:
-            self.log.debug(f"Sleeping {config.LLM_NODE_DELAY_SECONDS}s before LLM call (TPM throttle)")
-            time.sleep(config.LLM_NODE_DELAY_SECONDS)
-
-        result: AIMessage = self._invoke_with_retry(self.programmer_reflection_agent, state)
+    def _after_reflection_turn(self, state: AgentState, result: AIMessage) -> AgentState:
         result.content = result.content.strip()
 
         state['programmer_reflection_count'] += 1
@@ -541,6 +726,25 @@ class MainGraph():
         
         self.log.info('##### Programmer Reflection Node End #####')
         return state
+
+    def _programmer_reflection_node_action(self, state: AgentState) -> AgentState:
+        ''' Action for the programmer reflection node.
+        Args:
+            state (AgentState): The current state of the agent.
+        Returns:
+            AgentState: The updated state of the agent.
+        '''
+        self._before_reflection_turn(state)
+
+        result: AIMessage = self._invoke_with_retry(self.programmer_reflection_agent, state)
+        return self._after_reflection_turn(state, result)
+
+    async def _aprogrammer_reflection_node_action(self, state: AgentState) -> AgentState:
+        ''' Async action for the programmer reflection node (used by arun). '''
+        self._before_reflection_turn(state)
+
+        result: AIMessage = await self._ainvoke_with_retry(self.programmer_reflection_agent, state)
+        return self._after_reflection_turn(state, result)
     
     
     def _programmer_reflection_tools_node_action(self, state: AgentState) -> AgentState:
@@ -557,45 +761,8 @@ class MainGraph():
             self.log.warning('No tool calls found.')
             self.log.info('##### Programmer Reflection Tools Node End #####')
             return state
-        for tool_call in tool_calls:
-            # Find the tool by name
-            tool_obj = next((t for t in self.programmer_reflection_agent.tools if getattr(t, "name", None) == tool_call['name']), None)
-            if not tool_obj:
-                self.log.warning(f"Tool '{tool_call['name']}' not found.")
-                state['conversation'].append(ToolMessage(
-                    name=tool_call['name'],
-                    tool_call_id=tool_call.get('id',''),
-                    content=f"ERROR: Tool '{tool_call['name']}' is not registered in this node."
-                ))
-                continue
-            try:
-                # **** start: version 1 ****
-                # ret = tool_obj.invoke(tool_call['args']) 
-                # **** end: version 1 ****
-
-                # **** start: version 2 ****
-                args = dict(tool_call['args'] or {})
-                # If the tool expects `state` but it wasn't provided by the LLM, inject it.
-                fields = getattr(getattr(tool_obj, "args_schema", None), "model_fields", {}) or {}
-                if "state" in fields and "state" not in args:
-                    # Pass a plain dict to avoid TypedDict/Message objects causing serialization issues
-                    args["state"] = dict(state)
-                ret = tool_obj.invoke(args)
-                # **** end: version 2 ****
-
-            except Exception as e:
-                ret = f"Tool execution error: {e}"
-            if isinstance(ret, dict):
-                content = [f"{key}:\n```\n{value}\n```" for key, value in ret.items()]
-            elif isinstance(ret, tuple):
-                content = [f"Reflection Tool Output:\n```\n{ret}\n```"]
-            else:
-                content = [f"Reflection Tool Output:\n```\n{ret}\n```"]
-            result = ToolMessage(
-                name = tool_call['name'],
-                tool_call_id = tool_call.get('id', ''),
-                content = '\n'.join(content)
-            )
+        self._record_source(state)
+        for result in self._run_tool_calls(self.programmer_reflection_agent, state, tool_calls):
             state['conversation'].append(result)
             self.log.debug(result.content)
         self.log.info('##### Programmer Reflection Tools Node End #####')
@@ -625,22 +792,12 @@ class MainGraph():
             # nothing new to compile — route to Reflection to break the loop.
             current_tool_names = {tc['name'] for tc in last.tool_calls}
             conversation = state['conversation']
-            if len(conversation) >= 2:
-                prev_msg = conversation[-2]
-                prev_content = getattr(prev_msg, 'content', '')
-                prev_tool_name = getattr(prev_msg, 'name', None)
-                prev_clean = not any(
-                    ind in prev_content.lower()
-                    for ind in ['error', 'failed', 'exception', 'traceback', 'warning:']
+            if self._is_repeated_clean_call(conversation[:-1], current_tool_names):
+                self.log.warning(
+                    f"Programmer re-invoking '{conversation[-2].name}' after a clean result "
+                    "— routing to Reflection to break the loop."
                 )
-                if (isinstance(prev_msg, ToolMessage) and
-                        prev_tool_name in current_tool_names and
-                        prev_clean):
-                    self.log.warning(
-                        f"Programmer re-invoking '{prev_tool_name}' after a clean result "
-                        "— routing to Reflection to break the loop."
-                    )
-                    return self.programmer_reflection_node[0]
+                return self.programmer_reflection_node[0]
 
             return self.programmer_tools_node[0]
 
@@ -699,6 +856,7 @@ class MainGraph():
             AgentState: The updated state with final_summary populated.
         '''
         self.log.info("##### Final Summary Node Start #####")
+        self._discard_early_dispatch()
         if increment_counter:
             state['total_nodes_executed'] = state.get('total_nodes_executed', 0) + 1
 
@@ -722,6 +880,21 @@ class MainGraph():
             f"{total_tokens:,}  (input: {total_input_tokens:,} / output: {total_output_tokens:,})"
             if total_tokens > 0 else "N/A (usage metadata unavailable)"
         )
+        cache = prompt_cache_usage(state.get('conversation', []))
+        cache_str = (
+            f"hit: {cache['cache_read']:,} / written: {cache['cache_creation']:,} / "
+            f"miss: {cache['uncached']:,} input tokens"
+            if total_input_tokens > 0 else "N/A (usage metadata unavailable)"
+        )
+        # Wall-clock totals per node and per tool recorded so far (timings.py)
+        breakdown = timings.summary()
+        node_time_str = ", ".join(
+            f"{name.strip('_').removesuffix('_node_action')} {stats['total']:.1f}s ({stats['count']}x)"
+            for name, stats in breakdown.get("node", {}).items()
+        ) or "N/A"
+        tool_time_str = ", ".join(
+            f"{name} {stats['total']:.1f}s ({stats['count']}x)" for name, stats in breakdown.get("tool", {}).items()
+        ) or "N/A"
 
         # Extract key metrics from state
         attack_vector = state.get('attack_vector', 'Unknown')
@@ -748,6 +921,9 @@ class MainGraph():
             # f"Max Reflection Count:   {config.PROG_REF_CNT}",
             f"Execution Time:       {execution_time_str}",
             f"Tokens Generated:     {token_str}",
+            f"Prompt Cache:         {cache_str}",
+            f"Time in Nodes:        {node_time_str}",
+            f"Time in Tools:        {tool_time_str}",
             "-" * 80,
         ]
         
@@ -796,19 +972,42 @@ class MainGraph():
         self.log.info("##### Final Summary Node End #####")
         return state
 
+    def _apply_stream_event(self, state: AgentState, event: Any) -> None:
+        # LangGraph emits {node_name: <state_dict>} where the value is the
+        # full state returned by the node — update our local copy each step.
+        if isinstance(event, dict):
+            for node_name, node_output in event.items():
+                if isinstance(node_output, dict):
+                    state.update(node_output)
+                    # NOTE: total_nodes_executed is now incremented directly by each node action
+
+    @staticmethod
+    def _detach_state(state: AgentState) -> None:
+        """Give `state` its own copies of the lists a cancelled node may still be appending to.
+
+        Cancelling arun does not stop a node already running in a worker thread (a tool or the
+        Retriever); it keeps writing to the lists it was handed (e.g. conversation). The final
+        summary then works on a consistent copy and whatever the thread still adds is dropped.
+        """
+        for key, value in list(state.items()):
+            if isinstance(value, list):
+                state[key] = list(value)
+
+    def _ensure_final_summary(self, state: AgentState) -> None:
+        # Ensure final summary is always generated, even if stream completes normally
+        # but final summary node wasn't reached due to recursion limit
+        if 'final_summary' not in state or not state['final_summary']:
+            self.log.info("Final summary not generated during stream, generating now...")
+            self._final_summary_node_action(state, increment_counter=False)
+
     def run(self, state: AgentState) -> None:
         self._execution_start_time = time.time()
+        self._start_retrieval_prefetch(state)
         try:
             # Stream the graph execution. Each node updates state['total_nodes_executed'] directly.
             events = self.graph.stream(state, {'recursion_limit': config.RECURSION_LIMIT})
             for event in events:
-                # LangGraph emits {node_name: <state_dict>} where the value is the
-                # full state returned by the node — update our local copy each step.
-                if isinstance(event, dict):
-                    for node_name, node_output in event.items():
-                        if isinstance(node_output, dict):
-                            state.update(node_output)
-                            # NOTE: total_nodes_executed is now incremented directly by each node action
+                self._apply_stream_event(state, event)
 
                 # Safety net: catches a single long-running node that blocks the routers.
                 elapsed = time.time() - self._execution_start_time
@@ -820,17 +1019,45 @@ class MainGraph():
             # Handle recursion limit or other stream errors
             self.log.warning(f"Graph stream terminated: {str(e)}")
             # Mark that we hit the limit without convergence
-            if 'final_summary' not in state or not state['final_summary']:
-                state['convergence_achieved'] = state.get('convergence_achieved', False)
-                # Generate final summary if not already done
-                state = self._final_summary_node_action(state, increment_counter=False)
-        
-        # Ensure final summary is always generated, even if stream completes normally
-        # but final summary node wasn't reached due to recursion limit
-        if 'final_summary' not in state or not state['final_summary']:
-            self.log.info("Final summary not generated during stream, generating now...")
-            state = self._final_summary_node_action(state, increment_counter=False)
-        
+            state['convergence_achieved'] = state.get('convergence_achieved', False)
+
+        self._ensure_final_summary(state)
+        return
+
+    async def arun(self, state: AgentState) -> None:
+        """Asyncio counterpart of run().
+
+        Drives the graph with astream, awaiting agent.ainvoke in the LLM nodes.
+        The whole stream is cancelled once TIMEOUT_SECONDS elapse, even while an
+        LLM call or a tool is in flight, instead of only between nodes (a tool
+        already running in its worker thread finishes in the background).
+        Only one run per process: the tools work in the process-wide cwd, the
+        workdir and log file follow the global config.UUID and the timing
+        summary reads the global recorder, so concurrent runs need separate
+        processes (batch_scheduler.py).
+        """
+        self._execution_start_time = time.time()
+        self._start_retrieval_prefetch(state)
+        if self.async_graph is None:
+            self.async_graph = self._create_graph(async_nodes=True)
+
+        async def consume() -> None:
+            async for event in self.async_graph.astream(state, {'recursion_limit': config.RECURSION_LIMIT}):
+                self._apply_stream_event(state, event)
+
+        try:
+            await asyncio.wait_for(consume(), timeout=config.TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            self._timeout_exceeded = True
+            elapsed = time.time() - self._execution_start_time
+            self.log.warning(f"Timeout ({config.TIMEOUT_SECONDS}s) exceeded ({elapsed:.0f}s elapsed) — graph stream cancelled.")
+            self._detach_state(state)
+        except Exception as e:
+            # Handle recursion limit or other stream errors
+            self.log.warning(f"Graph stream terminated: {str(e)}")
+            state['convergence_achieved'] = state.get('convergence_achieved', False)
+
+        self._ensure_final_summary(state)
         return
     
     pass # end of MainGraph
@@ -1,8 +1,93 @@
 # llm_factory.py
 import os
+from contextvars import ContextVar
+
+import openai
+from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage, ToolMessage # type: ignore
 from langchain_openai import ChatOpenAI         # type: ignore
 # from langchain_community.chat_models import ChatTogether     # type: ignore
 
+try:
+    # Optional: without it Anthropic models go through the OpenAI-compatible endpoint (no prompt caching)
+    import anthropic # type: ignore
+    from langchain_anthropic import ChatAnthropic # type: ignore
+except ImportError:
+    anthropic = None
+    ChatAnthropic = None
+
+from app_config import config, get_logger
+from llm_replay import wrap_replay
+
+log = get_logger(__name__)
+
+# Exceptions the graphs treat as provider rate limiting (HTTP 429)
+RATE_LIMIT_ERRORS: tuple = (openai.RateLimitError,) + ((anthropic.RateLimitError,) if anthropic else ())
+
+CACHE_CONTROL = {"type": "ephemeral"}
+MAX_CACHE_BREAKPOINTS = 4               # Anthropic limit per request
+ANTHROPIC_DEFAULT_MAX_TOKENS = 16384    # ChatAnthropic needs an explicit output limit
+
+# Headers of the latest raw Messages API response in this thread / task (see _HeaderChatAnthropic)
+_anthropic_headers: ContextVar[dict | None] = ContextVar("anthropic_response_headers", default=None)
+
+
+def _attach_headers(message) -> None:
+    headers = _anthropic_headers.get()
+    if headers is not None:
+        message.response_metadata["headers"] = headers
+
+
+if ChatAnthropic is not None:
+    class _HeaderChatAnthropic(ChatAnthropic):
+        '''ChatAnthropic that puts the HTTP response headers in response_metadata["headers"].
+
+        ChatAnthropic has no include_response_headers option; it fetches the raw
+        response (_create / _acreate) and drops the headers after parsing. They
+        carry the anthropic-ratelimit-* limits the rate limiter reads, so they are
+        kept here and added to the message (the first chunk when streaming).
+        '''
+
+        def _create(self, payload: dict):
+            raw_response = super()._create(payload)
+            _anthropic_headers.set(dict(raw_response.headers))
+            return raw_response
+
+        async def _acreate(self, payload: dict):
+            raw_response = await super()._acreate(payload)
+            _anthropic_headers.set(dict(raw_response.headers))
+            return raw_response
+
+        def _generate(self, *args, **kwargs):
+            _anthropic_headers.set(None)
+            result = super()._generate(*args, **kwargs)
+            _attach_headers(result.generations[0].message)
+            return result
+
+        async def _agenerate(self, *args, **kwargs):
+            _anthropic_headers.set(None)
+            result = await super()._agenerate(*args, **kwargs)
+            _attach_headers(result.generations[0].message)
+            return result
+
+        def _stream(self, *args, **kwargs):
+            _anthropic_headers.set(None)
+            first = True
+            for chunk in super()._stream(*args, **kwargs):
+                if first:
+                    _attach_headers(chunk.message)
+                    first = False
+                yield chunk
+
+        async def _astream(self, *args, **kwargs):
+            _anthropic_headers.set(None)
+            first = True
+            async for chunk in super()._astream(*args, **kwargs):
+                if first:
+                    _attach_headers(chunk.message)
+                    first = False
+                yield chunk
+
+
 def build_chat_llm(name: str, registry: dict):
     spec = registry[name]
     provider = spec["provider"].lower()
@@ -10,7 +95,7 @@ def build_chat_llm(name: str, registry: dict):
     args = spec.get("args", {})
     temperature = args.get("temperature", 0)
     max_tokens = args.get("max_tokens", None)
-    
+
 
     if provider == "openai":
         api_key  = args.get("api_key")  or os.getenv("OPENAI_API_KEY")
@@ -29,15 +114,102 @@ def build_chat_llm(name: str, registry: dict):
         api_key  = args.get("api_key")  or os.getenv("OLLAMA_API_KEY", "ollama")
         base_url = args.get("base_url") or os.getenv("OLLAMA_OPENAI_BASE_URL", "http://host.docker.internal:11434/v1")
 
+    elif provider == "mock":
+        # app/mock_llm_server.py: scripted OpenAI-compatible responses, no key required
+        api_key  = args.get("api_key")  or os.getenv("MOCK_LLM_API_KEY", "mock")
+        base_url = args.get("base_url") or os.getenv("MOCK_LLM_BASE_URL", "http://127.0.0.1:8765/v1")
+
     elif provider == "anthropic":
         api_key  = args.get("api_key")  or os.getenv("ANTHROPIC_API_KEY")
         base_url = args.get("base_url") or os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com/v1")
 
     else:
         raise RuntimeError(f"Unknown provider '{provider}' for model '{name}'.")
-    
+
     if not api_key:
         raise RuntimeError(f"Missing API key for provider '{provider}'")
-    
-    return ChatOpenAI(model=model, api_key=api_key, base_url=base_url, temperature=temperature, max_tokens=max_tokens)
 
+    llm = None
+    if provider == "anthropic" and config.PROMPT_CACHING:
+        if ChatAnthropic is not None:
+            # Native Messages API: honours cache_control and reports cache read/write tokens.
+            # The SDK appends /v1 itself.
+            llm = _HeaderChatAnthropic(model=model, api_key=api_key, base_url=base_url.rstrip("/").removesuffix("/v1"),
+                                temperature=temperature, max_tokens=max_tokens or ANTHROPIC_DEFAULT_MAX_TOKENS)
+        else:
+            log.warning("langchain_anthropic is not installed; using the OpenAI-compatible endpoint without prompt caching")
+
+    if llm is None:
+        # Rate-limit headers feed the per-model limiter (rate_limiter.py) through response_metadata["headers"]
+        # (_HeaderChatAnthropic does the same for the native Anthropic client)
+        llm = ChatOpenAI(model=model, api_key=api_key, base_url=base_url, temperature=temperature, max_tokens=max_tokens,
+                         include_response_headers=True, stream_usage=True)
+
+    # Record/replay cache (config.LLM_REPLAY); "passthrough" returns llm unchanged
+    return wrap_replay(llm, name)
+
+
+def supports_prompt_caching(llm) -> bool:
+    '''True if the model needs explicit cache_control breakpoints (OpenAI-style APIs cache prefixes automatically).'''
+    llm = getattr(llm, "inner", llm)    # ReplayChatModel
+    return ChatAnthropic is not None and isinstance(llm, ChatAnthropic)
+
+
+def _with_cache_control(message: BaseMessage) -> BaseMessage:
+    content = message.content
+    if isinstance(content, str):
+        if not content:
+            return message
+        blocks = [{"type": "text", "text": content}]
+    else:
+        blocks = [block if isinstance(block, dict) else {"type": "text", "text": str(block)} for block in content]
+        if not blocks:
+            return message
+    blocks[-1] = {**blocks[-1], "cache_control": CACHE_CONTROL}
+    return message.model_copy(update={"content": blocks})
+
+
+def cache_breakpoints(messages: list[BaseMessage]) -> list[int]:
+    '''Indices of the messages that end a stable prompt prefix.
+
+    The system prompt (cached together with the tool definitions), the problem
+    statement, the latest retrieval result and the newest message, so the next
+    turn can reuse everything the current one sent.
+    '''
+    candidates = [
+        max((i for i, m in enumerate(messages) if isinstance(m, SystemMessage)), default=None),
+        next((i for i, m in enumerate(messages)
+              if isinstance(m, ToolMessage) and m.name == "read_problem_statement"), None),
+        max((i for i, m in enumerate(messages)
+             if isinstance(m, HumanMessage) and isinstance(m.content, str) and m.content.startswith("[Retriever Node]")),
+            default=None),
+        len(messages) - 1 if messages else None,
+    ]
+    return sorted({i for i in candidates if i is not None})[-MAX_CACHE_BREAKPOINTS:]
+
+
+def add_cache_breakpoints(prompt) -> list[BaseMessage]:
+    '''Prompt -> messages step that marks cache_control breakpoints (messages are copied, not modified).'''
+    messages = prompt.to_messages() if hasattr(prompt, "to_messages") else list(prompt)
+    for i in cache_breakpoints(messages):
+        messages[i] = _with_cache_control(messages[i])
+    return messages
+
+
+def prompt_cache_usage(conversation: list[BaseMessage]) -> dict[str, int]:
+    '''Sum the prompt-cache token counts reported in the AIMessages' usage_metadata.
+
+    Returns:
+        dict: cache_read (hits), cache_creation (written to the cache) and uncached input tokens.
+    '''
+    usage = {"cache_read": 0, "cache_creation": 0, "uncached": 0}
+    for message in conversation:
+        meta = getattr(message, "usage_metadata", None)
+        if not meta:
+            continue
+        details = meta.get("input_token_details") or {}
+        read, created = details.get("cache_read") or 0, details.get("cache_creation") or 0
+        usage["cache_read"] += read
+        usage["cache_creation"] += created
+        usage["uncached"] += max(0, meta.get("input_tokens", 0) - read - created)
+    return usage
@@ -0,0 +1,150 @@
+# llm_replay.py
+'''
+Record/replay cache of LLM responses, layered around build_chat_llm.
+
+With config.LLM_REPLAY = "record" every response is stored under
+~/workdir/.llm_replay/<model key>/<hash>.json, keyed by a hash of the model,
+the rendered messages and the bound tool schemas; a request that was already
+recorded is answered from the cache. "replay" answers only from the cache and
+raises ReplayMiss for anything that was not recorded, so a whole S4 run can be
+re-executed offline in seconds to benchmark tools, routing and RAG.
+"passthrough" (the default) does not wrap the model at all.
+
+The key leaves out what legitimately differs between otherwise identical
+runs: message ids, response/usage metadata, the run UUID and, unless
+LLM_REPLAY_KEY_TOOL_OUTPUTS is set, the contents of tool results (PoC timings
+and counter values change on every execution).
+'''
+
+# Built-in imports
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any
+
+# Langchain imports
+from langchain_core.language_models.chat_models import BaseChatModel # type: ignore
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage, message_to_dict, messages_from_dict # type: ignore
+from langchain_core.outputs import ChatGeneration, ChatResult # type: ignore
+from langchain_core.utils.function_calling import convert_to_openai_tool # type: ignore
+
+# Local imports
+from app_config import config, get_logger
+
+log = get_logger(__name__)
+
+REPLAY_DIR = os.path.expanduser("~/workdir/.llm_replay")
+REPLAY_MODES = ("passthrough", "record", "replay")
+
+
+class ReplayMiss(RuntimeError):
+    '''A request in replay mode has no recorded response.'''
+    pass
+
+
+def _canonical_message(message: BaseMessage) -> dict:
+    data: dict[str, Any] = {"type": message.type, "content": message.content}
+    if isinstance(message, ToolMessage):
+        data["name"] = message.name
+        data["tool_call_id"] = message.tool_call_id
+        if not config.LLM_REPLAY_KEY_TOOL_OUTPUTS:
+            data.pop("content")
+    for tool_call in getattr(message, "tool_calls", None) or []:
+        data.setdefault("tool_calls", []).append(
+            {"name": tool_call.get("name"), "args": tool_call.get("args"), "id": tool_call.get("id")})
+    return data
+
+
+def replay_key(model: str, messages: list[BaseMessage], tools: list[dict], options: dict) -> str:
+    '''Hash of everything that determines a temperature-0 response.'''
+    payload = json.dumps({
+        "model": model,
+        "messages": [_canonical_message(m) for m in messages],
+        "tools": tools,
+        "options": options,
+    }, sort_keys=True, default=str)
+    if config.UUID:
+        payload = payload.replace(config.UUID, "<uuid>")
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ReplayChatModel(BaseChatModel):
+    '''Chat model that records responses of `inner` and/or replays them by request hash.'''
+
+    inner: Any                      # The provider chat model
+    model_key: str                  # Key in model_configs.models, used as the cache sub-directory
+    mode: str = "record"            # "record" or "replay"
+    bound: Any = None               # inner with tools bound (bind_tools)
+    tool_schemas: list = []
+    bind_kwargs: dict = {}
+
+    @property
+    def _llm_type(self) -> str:
+        return f"replay-{getattr(self.inner, '_llm_type', 'chat')}"
+
+    @property
+    def model_name(self) -> str:
+        return getattr(self.inner, "model_name", None) or getattr(self.inner, "model", None) or self.model_key
+
+    def bind_tools(self, tools: list, **kwargs) -> "ReplayChatModel":
+        return self.model_copy(update={
+            "bound": self.inner.bind_tools(tools, **kwargs),
+            "tool_schemas": [convert_to_openai_tool(t) for t in tools],
+            "bind_kwargs": kwargs,
+        })
+
+    def _path(self, key: str) -> str:
+        return os.path.join(REPLAY_DIR, self.model_key.replace("/", "_"), f"{key}.json")
+
+    def _load(self, path: str) -> AIMessage | None:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return messages_from_dict([json.load(f)["message"]])[0]
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            log.warning(f"[!] Ignoring unreadable replay entry {path} ({e})")
+            return None
+
+    def _store(self, path: str, message: AIMessage) -> None:
+        # Rate-limit headers of the recorded call must not throttle replays
+        metadata = {k: v for k, v in message.response_metadata.items() if k != "headers"}
+        data = message_to_dict(message.model_copy(update={"response_metadata": metadata}))
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                # recorded_at orders the entries for mock_llm_server.py --from-replay
+                json.dump({"model": self.model_name, "recorded_at": time.time(), "message": data}, f)
+            os.replace(tmp, path)
+        except Exception as e:
+            log.warning(f"[!] Failed to write replay entry {path} ({e})")
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None,
+                  run_manager=None, **kwargs) -> ChatResult:
+        key = replay_key(self.model_name, messages, self.tool_schemas,
+                         {"stop": stop, **self.bind_kwargs, **kwargs})
+        path = self._path(key)
+        message = self._load(path)
+        if message is not None:
+            log.info(f"[replay] Response {key[:12]} replayed from cache")
+        elif self.mode == "replay":
+            raise ReplayMiss(f"No recorded response for request {key[:12]} ({self.model_key}); record it with LLM_REPLAY='record'")
+        else:
+            message = (self.bound or self.inner).invoke(messages, stop=stop, **kwargs)
+            self._store(path, message)
+            log.info(f"[replay] Response {key[:12]} recorded")
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+def wrap_replay(llm: BaseChatModel, model_key: str, mode: str | None = None) -> BaseChatModel:
+    '''Wrap `llm` according to `mode` (default config.LLM_REPLAY); "passthrough" returns it unchanged.'''
+    mode = mode or config.LLM_REPLAY
+    if mode not in REPLAY_MODES:
+        raise ValueError(f"Unknown LLM_REPLAY mode '{mode}'. Available: {', '.join(REPLAY_MODES)}")
+    if mode == "passthrough":
+        return llm
+    log.info(f"[replay] LLM responses for '{model_key}' in {mode} mode ({REPLAY_DIR})")
+    return ReplayChatModel(inner=llm, model_key=model_key, mode=mode)
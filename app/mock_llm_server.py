@@ -0,0 +1,248 @@
+# mock_llm_server.py
+'''
+Local stand-in for an OpenAI-compatible chat-completions endpoint, for
+offline end-to-end runs and throughput benchmarks of the S4 graph.
+
+It speaks the /v1/chat/completions protocol (including tool calls and SSE
+streaming) and answers from a script instead of a model. The response for a
+request is chosen by the number of assistant messages already in it: both
+the Programmer and the Reflection prompt carry the whole shared conversation,
+so the n-th LLM turn of a run always gets script entry n, statelessly and
+independently of how many runs share the server. Past the end of the script
+the last entry is repeated. The Programmer turn that follows a Retriever hop
+is answered with the script's "after_retrieval" response and not counted, so
+one script serves runs with and without RAG.
+
+Script file (JSON):
+    {"responses": [
+        {"content": "text", "tool_calls": [{"name": "compile_C", "arguments": {...}}]},
+        ...
+    ],
+     "after_retrieval": {"content": "text"}}
+Without --script a built-in run is served (read the problem statement,
+compile a small program, hand off, execute and measure it, report success). With
+--from-replay the responses recorded by llm_replay.py for one model key are
+served in recording order.
+
+Usage:
+    python mock_llm_server.py [--port 8765] [--latency 0.5] [--tokens-per-second 200]
+and select the "mock-local" model (MOCK_LLM_BASE_URL overrides the address).
+'''
+
+# Built-in imports
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+MOCK_MODEL = "mock-local"
+RETRIEVAL_MARKER = "[Retriever Node]"    # prefix of the HumanMessages injected by the Retriever node
+DEFAULT_PORT = 8765
+_STREAM_CHUNK_CHARS = 16
+
+_DEFAULT_PROGRAM = r'''#include <stdio.h>
+
+int main(void) {
+    const char *secret = "The Magic Words are Squeamish Ossifrage.";
+    for (const char *p = secret; *p; p++)
+        printf("Success: 0x%02X='%c'\n", (unsigned char)*p, *p);
+    return 0;
+}
+'''
+
+DEFAULT_SCRIPT = {"responses": [
+    {"content": "Reading the problem statement first.",
+     "tool_calls": [{"name": "read_problem_statement", "arguments": {}}]},
+    {"content": "Compiling the PoC.",
+     "tool_calls": [{"name": "compile_C", "arguments": {"file_contents": _DEFAULT_PROGRAM}}]},
+    {"content": "The PoC compiles; handing it over for review."},
+    {"content": "Executing the binary and measuring its cache behaviour.",
+     "tool_calls": [{"name": "execute_binaries", "arguments": {"file_path": "PoC"}},
+                    {"name": "measure_HPC", "arguments": {"perf_events": ["cache-misses", "branch-misses"]}}]},
+    {"content": "The PoC compiles successfully and executes without errors; all steps completed.\n"
+                "THE PoC CODE IS CORRECT AND SATISFACTORY\n[STATUS: SUCCESS]"},
+],
+    "after_retrieval": {"content": "Retrieved information noted; the PoC already covers it. Handing it over for review."},
+}
+
+
+def load_replay_script(directory: str) -> dict:
+    '''Script made of the responses llm_replay.py recorded in `directory`, in recording order.'''
+    entries = []
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+            entry = json.load(f)
+        data = entry["message"]["data"]
+        entries.append((entry.get("recorded_at", 0), {
+            "content": data.get("content") if isinstance(data.get("content"), str) else "",
+            "tool_calls": [{"name": tc["name"], "arguments": tc.get("args", {})} for tc in data.get("tool_calls") or []],
+        }))
+    if not entries:
+        raise SystemExit(f"No recorded responses in {directory}")
+    return {"responses": [response for _, response in sorted(entries, key=lambda e: e[0])]}
+
+
+def _text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "".join(part.get("text", "") for part in content or [] if isinstance(part, dict))
+
+
+def _estimate_tokens(value) -> int:
+    return max(1, len(json.dumps(value)) // 4)
+
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, script: dict, latency: float = 0.0, tokens_per_second: float = 0.0):
+        super().__init__(address, _Handler)
+        self.script = script["responses"]
+        self.after_retrieval = script.get("after_retrieval")
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.requests_served = 0
+        self._lock = threading.Lock()
+
+    def response_for(self, messages: list[dict]) -> tuple[int, dict]:
+        turn, after_retrieval = 0, False
+        for message in messages:
+            if message.get("role") == "assistant":
+                turn += 0 if after_retrieval and self.after_retrieval else 1
+                after_retrieval = False
+            elif message.get("role") == "user" and _text(message.get("content")).startswith(RETRIEVAL_MARKER):
+                after_retrieval = True
+        with self._lock:
+            self.requests_served += 1
+        if after_retrieval and self.after_retrieval:
+            return turn, self.after_retrieval
+        return turn, self.script[min(turn, len(self.script) - 1)]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: MockLLMServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):   # keep benchmark output clean
+        pass
+
+    def _send_json(self, status: int, body: dict) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": MOCK_MODEL, "object": "model", "owned_by": "uGEN"}]})
+        else:
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": f"unknown path {self.path}", "type": "not_found"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        messages = request.get("messages", [])
+        offered = {t.get("function", {}).get("name") for t in request.get("tools") or []}
+        turn, scripted = self.server.response_for(messages)
+        tool_calls = [
+            {"id": f"call_{uuid.uuid4().hex[:24]}", "type": "function",
+             "function": {"name": tc["name"], "arguments": json.dumps(tc.get("arguments", {}))}}
+            for tc in scripted.get("tool_calls") or [] if not offered or tc["name"] in offered
+        ]
+        content = scripted.get("content") or ""
+        usage = {"prompt_tokens": _estimate_tokens(messages),
+                 "completion_tokens": _estimate_tokens([content, tool_calls])}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-mock-{turn}-{uuid.uuid4().hex[:8]}"
+        model = request.get("model", MOCK_MODEL)
+
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        if request.get("stream"):
+            include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+            self._stream(completion_id, model, content, tool_calls, usage if include_usage else None)
+            return
+
+        message = {"role": "assistant", "content": content}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+        self._send_json(200, {
+            "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model,
+            "choices": [{"index": 0, "message": message, "finish_reason": "tool_calls" if tool_calls else "stop"}],
+            "usage": usage,
+        })
+
+    def _stream(self, completion_id: str, model: str, content: str, tool_calls: list, usage: dict | None) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        delay = _STREAM_CHUNK_CHARS / 4 / self.server.tokens_per_second if self.server.tokens_per_second > 0 else 0
+
+        def event(delta: dict | None, finish_reason: str | None = None, extra: dict | None = None) -> None:
+            body = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": model,
+                    "choices": [] if delta is None else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            body.update(extra or {})
+            self.wfile.write(f"data: {json.dumps(body)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        event({"role": "assistant", "content": ""})
+        for start in range(0, len(content), _STREAM_CHUNK_CHARS):
+            time.sleep(delay)
+            event({"content": content[start:start + _STREAM_CHUNK_CHARS]})
+        for index, tool_call in enumerate(tool_calls):
+            event({"tool_calls": [{"index": index, "id": tool_call["id"], "type": "function",
+                                   "function": {"name": tool_call["function"]["name"], "arguments": ""}}]})
+            arguments = tool_call["function"]["arguments"]
+            for start in range(0, len(arguments), _STREAM_CHUNK_CHARS):
+                time.sleep(delay)
+                event({"tool_calls": [{"index": index, "function": {"arguments": arguments[start:start + _STREAM_CHUNK_CHARS]}}]})
+        event({}, "tool_calls" if tool_calls else "stop")
+        if usage is not None:
+            event(None, extra={"usage": usage})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def serve_in_thread(script: dict | None = None, port: int = 0, latency: float = 0.0,
+                    tokens_per_second: float = 0.0) -> MockLLMServer:
+    '''Start a server on 127.0.0.1 in a daemon thread (port 0 = any free port); stop it with shutdown().'''
+    server = MockLLMServer(("127.0.0.1", port), script or DEFAULT_SCRIPT, latency, tokens_per_second)
+    threading.Thread(target=server.serve_forever, name="mock-llm", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server for offline uGEN runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--script", help="JSON script of responses (default: built-in success run)")
+    parser.add_argument("--from-replay", metavar="DIR", help="serve the responses llm_replay.py recorded in DIR")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before each response starts")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="streaming rate (0 = unthrottled)")
+    args = parser.parse_args()
+
+    if args.from_replay:
+        script = load_replay_script(os.path.expanduser(args.from_replay))
+    elif args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            script = json.load(f)
+    else:
+        script = DEFAULT_SCRIPT
+    server = MockLLMServer((args.host, args.port), script, args.latency, args.tokens_per_second)
+    print(f"Mock LLM server on http://{args.host}:{server.server_address[1]}/v1 ({len(script['responses'])} scripted responses)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
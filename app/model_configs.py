@@ -72,6 +72,15 @@ models = {
             "api_key": os.getenv("OLLAMA_API_KEY", "ollama")
         }
     },
+    "mock-local": {
+        "provider": "mock",
+        "model": "mock-local",   # served by app/mock_llm_server.py (offline runs and benchmarks)
+        "args": {
+            "temperature": 0,
+            "base_url": os.getenv("MOCK_LLM_BASE_URL", "http://127.0.0.1:8765/v1"),
+            "api_key": os.getenv("MOCK_LLM_API_KEY", "mock")
+        }
+    },
     "claude-sonnet-4": {
         "provider": "anthropic",
         "model": "claude-sonnet-4-20250514",
@@ -0,0 +1,218 @@
+# rate_limiter.py
+'''
+Adaptive client-side rate limiting of LLM calls, shared per (provider, model).
+
+Each limiter keeps two token buckets, requests and tokens, that refill
+continuously at their per-minute limit. Limits come from config.RATE_LIMITS
+and, once the provider has answered, from its rate-limit response headers
+(OpenAI / Together x-ratelimit-*, Anthropic anthropic-ratelimit-*), which also
+reset the bucket levels to the provider's own "remaining" counts. A call
+reserves one request plus its locally estimated prompt tokens and only waits
+when a bucket would go negative; the estimate is corrected with the reported
+usage afterwards.
+
+A 429 blocks the limiter (so concurrent callers pause too) for the
+provider's retry-after when given, otherwise for a jittered exponential
+backoff; the next successful call resets the backoff.
+'''
+
+# Built-in imports
+import asyncio
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+# Local imports
+from app_config import config, get_logger
+
+log = get_logger(__name__)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+# (limit, remaining, reset) header names per bucket, most specific first
+_HEADERS = {
+    "requests": [
+        ("x-ratelimit-limit-requests", "x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+        ("anthropic-ratelimit-requests-limit", "anthropic-ratelimit-requests-remaining", "anthropic-ratelimit-requests-reset"),
+        ("x-ratelimit-limit", "x-ratelimit-remaining", "x-ratelimit-reset"),
+    ],
+    "tokens": [
+        ("x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+        ("anthropic-ratelimit-input-tokens-limit", "anthropic-ratelimit-input-tokens-remaining", "anthropic-ratelimit-input-tokens-reset"),
+        ("anthropic-ratelimit-tokens-limit", "anthropic-ratelimit-tokens-remaining", "anthropic-ratelimit-tokens-reset"),
+        ("x-tokenlimit-limit", "x-tokenlimit-remaining", None),
+    ],
+}
+
+
+def parse_reset(value) -> float | None:
+    '''Seconds until a rate-limit reset given as "6m0s" / "20ms" / "1.5" or an RFC 3339 timestamp.'''
+    if value is None:
+        return None
+    text = str(value).strip()
+    try:
+        return max(0.0, float(text))
+    except ValueError:
+        pass
+    parts = _DURATION_PART.findall(text)
+    if parts and "".join(number + unit for number, unit in parts) == text:
+        return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+    try:
+        return max(0.0, datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp() - time.time())
+    except ValueError:
+        return None
+
+
+def _number(value) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Bucket:
+    '''Continuously refilling budget of `capacity` units per minute (unknown capacity = unlimited).'''
+
+    def __init__(self, capacity: float | None):
+        self.capacity = capacity
+        self.level = capacity or 0.0
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        if self.capacity:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if not self.capacity:
+            return 0.0
+        # A single request larger than the whole budget only needs a full bucket
+        missing = min(amount, self.capacity) - self.level
+        return max(0.0, missing * 60.0 / self.capacity)
+
+    def observe(self, limit: float | None, remaining: float | None) -> None:
+        if limit:
+            self.capacity = limit
+        if remaining is not None and self.capacity:
+            self.level = min(self.capacity, remaining)
+
+
+class RateLimiter:
+    '''Request/token pacing and 429 backoff for one provider and model.'''
+
+    def __init__(self, key: str, requests_per_minute: float | None = None, tokens_per_minute: float | None = None):
+        self.key = key
+        self._lock = threading.Lock()
+        self._buckets = {"requests": _Bucket(requests_per_minute), "tokens": _Bucket(tokens_per_minute)}
+        self._blocked_until = 0.0
+        self._failures = 0
+
+    def _reserve(self, tokens: int) -> float:
+        '''Take one request and `tokens` from the buckets, or return the seconds to wait first.'''
+        with self._lock:
+            now = time.monotonic()
+            for bucket in self._buckets.values():
+                bucket.refill(now)
+            wait = max(self._blocked_until - now,
+                       self._buckets["requests"].wait_time(1),
+                       self._buckets["tokens"].wait_time(tokens))
+            if wait > 0:
+                return wait
+            self._buckets["requests"].level -= 1
+            self._buckets["tokens"].level -= tokens
+            return 0.0
+
+    def acquire(self, tokens: int = 0) -> float:
+        '''Block until a request of about `tokens` prompt tokens may be sent; returns the seconds waited.'''
+        waited = 0.0
+        while (wait := self._reserve(tokens)) > 0:
+            if not waited:
+                log.info(f"[rate_limiter] {self.key}: pacing request ({tokens} tokens) for {wait:.1f}s")
+            time.sleep(wait)
+            waited += wait
+        return waited
+
+    async def aacquire(self, tokens: int = 0) -> float:
+        '''Async twin of acquire.'''
+        waited = 0.0
+        while (wait := self._reserve(tokens)) > 0:
+            if not waited:
+                log.info(f"[rate_limiter] {self.key}: pacing request ({tokens} tokens) for {wait:.1f}s")
+            await asyncio.sleep(wait)
+            waited += wait
+        return waited
+
+    def observe_headers(self, headers) -> None:
+        '''Update limits and remaining budgets from provider rate-limit headers.'''
+        if not headers:
+            return
+        headers = {str(k).lower(): v for k, v in dict(headers).items()}
+        with self._lock:
+            now = time.monotonic()
+            for name, bucket in self._buckets.items():
+                bucket.refill(now)
+                for limit_key, remaining_key, reset_key in _HEADERS[name]:
+                    if limit_key not in headers and remaining_key not in headers:
+                        continue
+                    limit, remaining = _number(headers.get(limit_key)), _number(headers.get(remaining_key))
+                    bucket.observe(limit, remaining)
+                    if remaining is not None and remaining < 1 and reset_key:
+                        reset = parse_reset(headers.get(reset_key))
+                        if reset:
+                            self._blocked_until = max(self._blocked_until, now + reset)
+                    break
+
+    def record(self, message, estimated_tokens: int = 0) -> None:
+        '''Account a completed call: reported usage replaces the estimate, headers refresh the buckets.'''
+        meta = getattr(message, "usage_metadata", None) or {}
+        actual = meta.get("input_tokens", 0) + meta.get("output_tokens", 0)
+        with self._lock:
+            self._failures = 0
+            if actual:
+                self._buckets["tokens"].level -= actual - estimated_tokens
+        response_metadata = getattr(message, "response_metadata", None) or {}
+        self.observe_headers(response_metadata.get("headers"))
+
+    def on_rate_limit(self, error: Exception) -> float:
+        '''Block the limiter after a 429 and return the delay before the next attempt.'''
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        self.observe_headers(headers)
+        retry_after = None
+        if headers.get("retry-after-ms"):
+            retry_after = (_number(headers.get("retry-after-ms")) or 0) / 1000.0
+        elif headers.get("retry-after"):
+            retry_after = parse_reset(headers.get("retry-after"))
+        with self._lock:
+            self._failures += 1
+            if retry_after:
+                # Small jitter so concurrent runs do not all retry at the same instant
+                delay = retry_after + random.uniform(0, min(1.0, retry_after / 4))
+            else:
+                ceiling = min(config.RATE_LIMIT_BACKOFF_MAX_SECONDS,
+                              config.RATE_LIMIT_BACKOFF_BASE_SECONDS * 2 ** (self._failures - 1))
+                delay = random.uniform(ceiling / 2, ceiling)
+            now = time.monotonic()
+            self._blocked_until = max(self._blocked_until, now + delay)
+            delay = self._blocked_until - now
+        log.warning(f"[rate_limiter] {self.key}: rate limited (attempt {self._failures}); retrying in {delay:.1f}s")
+        return delay
+
+
+_limiters: dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider: str, model: str) -> RateLimiter:
+    '''The limiter shared by every agent calling `model` at `provider` in this process.
+
+    Static limits are looked up in config.RATE_LIMITS under "provider/model", then "provider".
+    '''
+    key = f"{provider.lower()}/{model}"
+    with _limiters_lock:
+        if key not in _limiters:
+            limits = config.RATE_LIMITS.get(key) or config.RATE_LIMITS.get(provider.lower()) or {}
+            _limiters[key] = RateLimiter(key, limits.get("rpm"), limits.get("tpm"))
+        return _limiters[key]
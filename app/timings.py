@@ -0,0 +1,97 @@
+# timings.py
+'''
+Process-wide wall-clock timing of graph nodes, LLM calls, tools and RAG.
+
+The S4 graph records every node visit under "node", every LLM request
+(including rate-limit pacing) under "llm", every tool invocation under
+"tool" and the retrieval prefetch under "rag". summary() turns the samples
+into count / total / mean / percentile statistics; app.py adds it to the
+run result so benchmark.py can compare runs across commits.
+'''
+
+# Built-in imports
+import functools
+import inspect
+import threading
+import time
+from contextlib import contextmanager
+
+
+def _percentile(ordered: list[float], fraction: float) -> float:
+    '''Linear-interpolated percentile of an already sorted, non-empty list.'''
+    position = (len(ordered) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def describe(samples: list[float]) -> dict[str, float]:
+    '''count, total, mean, min, p50, p90, max (seconds) of a list of durations.'''
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0, "total": 0.0}
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "total": round(total, 6),
+        "mean": round(total / len(ordered), 6),
+        "min": round(ordered[0], 6),
+        "p50": round(_percentile(ordered, 0.5), 6),
+        "p90": round(_percentile(ordered, 0.9), 6),
+        "max": round(ordered[-1], 6),
+    }
+
+
+class TimingRecorder:
+    '''Thread-safe collection of durations per (kind, name).'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples: dict[str, dict[str, list[float]]] = {}
+
+    def record(self, kind: str, name: str, seconds: float) -> None:
+        with self._lock:
+            self._samples.setdefault(kind, {}).setdefault(name, []).append(seconds)
+
+    @contextmanager
+    def measure(self, kind: str, name: str):
+        '''Time the enclosed block (also when it raises).'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(kind, name, time.perf_counter() - start)
+
+    def timed(self, kind: str, name: str | None = None):
+        '''Decorator timing every call of a sync or async function (default name: its __name__).'''
+        def decorator(func):
+            label = name or func.__name__
+            if inspect.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.measure(kind, label):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.measure(kind, label):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def samples(self) -> dict[str, dict[str, list[float]]]:
+        with self._lock:
+            return {kind: {name: list(values) for name, values in names.items()} for kind, names in self._samples.items()}
+
+    def summary(self) -> dict[str, dict[str, dict[str, float]]]:
+        '''{kind: {name: describe(samples)}}'''
+        return {kind: {name: describe(values) for name, values in sorted(names.items())}
+                for kind, names in sorted(self.samples().items())}
+
+    def reset(self) -> None:
+        with self._lock:
+            self._samples.clear()
+
+
+timings: TimingRecorder = TimingRecorder()
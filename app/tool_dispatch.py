@@ -0,0 +1,180 @@
+# tool_dispatch.py
+'''
+Dependency-aware execution of the tool_calls emitted in a single AIMessage.
+
+Tool calls that only read inputs (problem statement, system info, ...) run
+concurrently in a thread pool. Tools that touch the run's PoC/ directory, or
+that rely on do_in_workdir() (os.chdir is process-wide), share one serial
+lane and run in the order the LLM requested them, so sequences such as
+compile_C -> execute_binaries keep their meaning. The returned ToolMessages
+are always in the original tool_calls order.
+'''
+
+# Built-in imports
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+
+# Langchain imports
+from langchain_core.messages import ToolMessage # type: ignore
+
+# Local imports
+from app_config import config, get_logger
+from timings import timings
+
+log = get_logger(__name__)
+
+# Tools that are safe to run concurrently with anything else. Every tool not
+# listed here is assumed to depend on the PoC/ directory and is serialized.
+INDEPENDENT_TOOLS = frozenset({
+    "read_problem_statement",
+    "collect_system_info",
+    "source_code_reader",
+    "template_code_reader",
+    "evaluation_metrics_reader",
+    "rag_tool",
+})
+
+
+def _find_tool(tools: list, name: str):
+    return next((t for t in tools or [] if getattr(t, "name", None) == name), None)
+
+
+def _invoke_tool(tool_obj, tool_call: dict, state: dict) -> Any:
+    try:
+        args = dict(tool_call['args'] or {})
+        # If the tool expects `state` but it wasn't provided by the LLM, inject it.
+        fields = getattr(getattr(tool_obj, "args_schema", None), "model_fields", {}) or {}
+        if "state" in fields and "state" not in args:
+            # Pass a plain dict to avoid TypedDict/Message objects causing serialization issues
+            args["state"] = dict(state)
+        with timings.measure("tool", tool_call['name']):
+            return tool_obj.invoke(args)
+    except Exception as e:
+        return f"Tool execution error: {e}"
+
+
+def format_tool_message(tool_call: dict, ret: Any, output_label: str) -> ToolMessage:
+    '''Wrap a tool's return value in the ToolMessage format used by the graphs.'''
+    if isinstance(ret, dict):
+        content = [f"{key}:\n```\n{value}\n```" for key, value in ret.items()]
+    else:
+        content = [f"{output_label}:\n```\n{ret}\n```"]
+    return ToolMessage(
+        name = tool_call['name'],
+        tool_call_id = tool_call.get('id', ''),
+        content = '\n'.join(content)
+    )
+
+
+def run_tool_calls(tool_calls: list[dict], tools: list, state: dict, output_label: str) -> list[ToolMessage]:
+    '''Execute tool_calls and return one ToolMessage per call, in request order.
+
+    Args:
+        tool_calls (list[dict]): The tool_calls of the AIMessage being answered.
+        tools (list): The tools registered on the calling node's agent.
+        state (dict): The agent state, injected into tools that declare a `state` argument.
+        output_label (str): Heading for non-dict tool results (e.g. "Programmer Tool Output").
+    Returns:
+        list[ToolMessage]: The tool responses, aligned with tool_calls.
+    '''
+    results: list[Any] = [None] * len(tool_calls)
+    serial_lane: list[int] = []
+    independent: list[int] = []
+
+    for index, tool_call in enumerate(tool_calls):
+        tool_obj = _find_tool(tools, tool_call['name'])
+        if not tool_obj:
+            log.warning(f"Tool '{tool_call['name']}' not found.")
+            results[index] = ToolMessage(
+                name=tool_call['name'],
+                tool_call_id=tool_call.get('id', ''),
+                content=f"ERROR: Tool '{tool_call['name']}' is not registered in this node."
+            )
+        elif tool_call['name'] in INDEPENDENT_TOOLS:
+            independent.append(index)
+        else:
+            serial_lane.append(index)
+
+    def run_one(index: int) -> None:
+        tool_call = tool_calls[index]
+        ret = _invoke_tool(_find_tool(tools, tool_call['name']), tool_call, state)
+        results[index] = format_tool_message(tool_call, ret, output_label)
+
+    def run_serial_lane() -> None:
+        for index in serial_lane:
+            run_one(index)
+
+    tasks = [lambda index=index: run_one(index) for index in independent]
+    if serial_lane:
+        tasks.append(run_serial_lane)
+
+    if len(tasks) <= 1 or config.TOOL_CALL_WORKERS <= 1:
+        for task in tasks:
+            task()
+    else:
+        log.info(
+            f"Running {len(independent)} independent tool call(s) concurrently"
+            f" alongside {len(serial_lane)} serialized PoC/ tool call(s)"
+        )
+        with ThreadPoolExecutor(max_workers=min(len(tasks), config.TOOL_CALL_WORKERS)) as pool:
+            for future in [pool.submit(task) for task in tasks]:
+                future.result()
+
+    return results
+
+
+class StreamingToolDispatcher:
+    '''Starts the tool calls of an AIMessage while the message is still being streamed.
+
+    submit() is called for each tool call as soon as its arguments are complete.
+    Independent tools start immediately in the pool; PoC/ tools go through a
+    single worker, so they still run one at a time in request order. collect()
+    then returns the ToolMessages of the final tool_calls, running any call
+    that was not submitted early (e.g. because the stream ended first).
+    '''
+
+    def __init__(self, tools: list, state: dict, output_label: str):
+        self.tools = tools
+        self.state = state
+        self.output_label = output_label
+        self._pool = ThreadPoolExecutor(max_workers=max(1, config.TOOL_CALL_WORKERS), thread_name_prefix="tool-stream")
+        self._serial_lane = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tool-stream-serial")
+        self._futures: dict[str, Any] = {}
+
+    def _run(self, tool_call: dict) -> ToolMessage:
+        tool_obj = _find_tool(self.tools, tool_call['name'])
+        if not tool_obj:
+            log.warning(f"Tool '{tool_call['name']}' not found.")
+            return ToolMessage(
+                name=tool_call['name'],
+                tool_call_id=tool_call.get('id', ''),
+                content=f"ERROR: Tool '{tool_call['name']}' is not registered in this node."
+            )
+        return format_tool_message(tool_call, _invoke_tool(tool_obj, tool_call, self.state), self.output_label)
+
+    def submit(self, tool_call: dict) -> None:
+        call_id = tool_call.get('id') or ''
+        if not call_id or call_id in self._futures:
+            return
+        lane = self._pool if tool_call['name'] in INDEPENDENT_TOOLS else self._serial_lane
+        log.info(f"Starting tool call '{tool_call['name']}' while the response is still streaming")
+        self._futures[call_id] = lane.submit(self._run, tool_call)
+
+    @property
+    def submitted(self) -> set[str]:
+        return set(self._futures)
+
+    def collect(self, tool_calls: list[dict]) -> list[ToolMessage]:
+        '''Return one ToolMessage per call of the final tool_calls, in request order.'''
+        for tool_call in tool_calls:
+            self.submit(tool_call)
+        try:
+            return [self._futures[tool_call.get('id') or ''].result() if tool_call.get('id') else self._run(tool_call)
+                    for tool_call in tool_calls]
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        '''Wait for everything that was started (results are discarded if not collected).'''
+        self._serial_lane.shutdown(wait=True)
+        self._pool.shutdown(wait=True)
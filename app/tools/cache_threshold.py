@@ -6,12 +6,19 @@ for the current architecture and returns a safe CACHE_HIT_THRESHOLD value.
 
 Strategy
 --------
-1. Write a small C calibration program to the workdir.
-2. Compile it with gcc (no special flags needed — it auto-selects the timer
-   and flush instruction via preprocessor #ifdefs).
-3. Run it (CPU-pinned to core 2 for consistency with the rest of the framework).
-4. Parse THRESHOLD=, HIT_MEDIAN=, MISS_MEDIAN= from stdout.
-5. Return a formatted summary string the Reflection Agent can use directly.
+1. Return the cached result for this host fingerprint if it is younger than
+   CALIBRATION_CACHE_TTL_SECONDS (unless recalibrate=True).
+2. Compile the C calibration program with gcc into the host's cache entry
+   under ~/workdir/.calibration_cache/ (no special flags needed — it
+   auto-selects the timer and flush instruction via preprocessor #ifdefs).
+   The binary is kept and reused while the source is unchanged.
+3. Run it (CPU-pinned to an exclusively leased core, see core_lease.py).
+4. Parse THRESHOLD=, HIT_MEDIAN=, MISS_MEDIAN= (flush+reload of one line)
+   and the per-level LEVEL=/THRESHOLD_<level>= lines from stdout. The
+   per-level pass chases pointers through working sets sized from the sysfs
+   cache topology to get L1/L2/LLC/DRAM latency percentiles and a threshold
+   at every level boundary (e.g. for Prime+Probe).
+5. Cache and return a formatted summary string the Reflection Agent can use directly.
 
 Architecture coverage
 ---------------------
@@ -21,19 +28,26 @@ Architecture coverage
 * fallback  – clock_gettime,      no-op flush  (threshold is advisory only)
 '''
 
+import hashlib
+import json
 import os
 import platform
 import subprocess
 import tempfile
+import time
 
 from langchain.tools import tool           # type: ignore
-from pydantic import BaseModel             # type: ignore
+from pydantic import BaseModel, Field      # type: ignore
 
-from tools.file_ops import do_in_workdir, write_file, _expandpath
-from app_config import get_logger
+from tools.core_lease import lease_core
+from tools.extract_system_info import host_fingerprint, get_cache_sizes
+from app_config import config, get_logger
 
 log = get_logger(__name__)
 
+CALIBRATION_CACHE_DIR = os.path.expanduser("~/workdir/.calibration_cache")
+CALIBRATION_RESULT_FILE = "calibration.json"
+
 # ---------------------------------------------------------------------------
 # C calibration source
 # ---------------------------------------------------------------------------
@@ -45,6 +59,8 @@ _CALIBRATION_C = r"""
 
 #define SAMPLES   10000
 #define STRIDE    512
+#define LEVEL_SAMPLES 20000
+#define MAX_SET_BYTES (256UL << 20)
 
 /* Use a large array so the compiler cannot optimise accesses away */
 static volatile uint8_t probe_array[256 * STRIDE];
@@ -95,7 +111,102 @@ static int cmp_u64(const void *a, const void *b) {
     return (x > y) - (x < y);
 }
 
-int main(void) {
+/* ---- Multi-level latency: random pointer chase over a working set ---------
+   One pointer per cache line, linked in a random cyclic order so hardware
+   prefetchers cannot predict the next line. A working set that fits a level
+   (but not the level below) makes every chased load hit that level.        */
+static uint64_t pct(const uint64_t *sorted, size_t n, int p) {
+    size_t i = (size_t)((double)p / 100.0 * (double)(n - 1));
+    return sorted[i];
+}
+
+static int chase_level(const char *name, size_t set_bytes, size_t line,
+                       uint64_t *p50_out, uint64_t *p10_out, uint64_t *p90_out) {
+    size_t n = set_bytes / line, i;
+    uint64_t *times;
+    size_t *order;
+    char *buf;
+    void **p;
+    uint64_t t1, t2;
+    static uint64_t seed = 88172645463325252ULL;
+
+    if (n < 16) return -1;
+    buf = (char *)aligned_alloc(4096, (n * line + 4095) & ~(size_t)4095);
+    order = (size_t *)malloc(n * sizeof(size_t));
+    times = (uint64_t *)malloc(LEVEL_SAMPLES * sizeof(uint64_t));
+    if (!buf || !order || !times) { free(buf); free(order); free(times); return -1; }
+
+    for (i = 0; i < n; i++) order[i] = i;
+    for (i = n - 1; i > 0; i--) {            /* Fisher-Yates with xorshift64 */
+        size_t j, tmp;
+        seed ^= seed << 13; seed ^= seed >> 7; seed ^= seed << 17;
+        j = (size_t)(seed % (i + 1));
+        tmp = order[i]; order[i] = order[j]; order[j] = tmp;
+    }
+    for (i = 0; i < n; i++)
+        *(void **)(buf + order[i] * line) = (void *)(buf + order[(i + 1) % n] * line);
+
+    /* Warm-up: two full laps bring the set into the target level (and TLBs) */
+    p = (void **)(buf + order[0] * line);
+    for (i = 0; i < 2 * n; i++) p = (void **)*p;
+
+    for (i = 0; i < LEVEL_SAMPLES; i++) {
+        asm volatile("" ::: "memory");
+        t1 = rdtime();
+        p = (void **)*(void * volatile *)p;
+        t2 = rdtime();
+        times[i] = (t2 >= t1) ? (t2 - t1) : 0;
+    }
+    if (p == NULL) printf("#\n");           /* keep the chase live */
+
+    qsort(times, LEVEL_SAMPLES, sizeof(uint64_t), cmp_u64);
+    printf("LEVEL=%s SET_BYTES=%zu P10=%llu P25=%llu P50=%llu P75=%llu P90=%llu P99=%llu\n",
+           name, n * line,
+           (unsigned long long)pct(times, LEVEL_SAMPLES, 10), (unsigned long long)pct(times, LEVEL_SAMPLES, 25),
+           (unsigned long long)pct(times, LEVEL_SAMPLES, 50), (unsigned long long)pct(times, LEVEL_SAMPLES, 75),
+           (unsigned long long)pct(times, LEVEL_SAMPLES, 90), (unsigned long long)pct(times, LEVEL_SAMPLES, 99));
+    *p50_out = pct(times, LEVEL_SAMPLES, 50);
+    *p10_out = pct(times, LEVEL_SAMPLES, 10);
+    *p90_out = pct(times, LEVEL_SAMPLES, 90);
+    free(buf); free(order); free(times);
+    return 0;
+}
+
+/* Boundary between two adjacent levels: between the faster level's P90 and the
+   slower level's P10 when the distributions separate, else between the medians. */
+static uint64_t level_threshold(uint64_t lo_p50, uint64_t lo_p90, uint64_t hi_p10, uint64_t hi_p50) {
+    if (hi_p10 > lo_p90) return lo_p90 + (hi_p10 - lo_p90) / 2;
+    return lo_p50 + (hi_p50 > lo_p50 ? (hi_p50 - lo_p50) / 2 : 0);
+}
+
+static void calibrate_levels(size_t l1, size_t l2, size_t llc, size_t line) {
+    const char *names[4] = {"L1", "L2", "LLC", "DRAM"};
+    size_t sets[4];
+    uint64_t p50[4], p10[4], p90[4];
+    int ok[4] = {0, 0, 0, 0}, i, prev = -1;
+
+    /* Working sets: comfortably inside each level, and larger than the level below */
+    sets[0] = l1 / 2;
+    sets[1] = l2 / 2 > 2 * l1 ? l2 / 2 : 2 * l1;
+    sets[2] = llc > l2 ? (llc / 2 > 2 * l2 ? llc / 2 : 2 * l2) : 0;   /* no separate LLC */
+    sets[3] = 4 * (llc > l2 ? llc : l2);
+    if (sets[3] < (64UL << 20)) sets[3] = 64UL << 20;
+    if (sets[3] > MAX_SET_BYTES) sets[3] = MAX_SET_BYTES;
+
+    for (i = 0; i < 4; i++)
+        if (sets[i] && chase_level(names[i], sets[i], line, &p50[i], &p10[i], &p90[i]) == 0)
+            ok[i] = 1;
+
+    for (i = 0; i < 4; i++) {
+        if (!ok[i]) continue;
+        if (prev >= 0)
+            printf("THRESHOLD_%s=%llu\n", names[prev],
+                   (unsigned long long)level_threshold(p50[prev], p90[prev], p10[i], p50[i]));
+        prev = i;
+    }
+}
+
+int main(int argc, char **argv) {
     uint64_t hit_times[SAMPLES], miss_times[SAMPLES];
     volatile uint8_t *addr = &probe_array[128 * STRIDE];
     uint64_t t1, t2;
@@ -158,15 +269,26 @@ int main(void) {
     printf("HIT_MEDIAN=%llu\n",  (unsigned long long)hit_med);
     printf("MISS_MEDIAN=%llu\n", (unsigned long long)miss_med);
     printf("THRESHOLD=%llu\n",   (unsigned long long)threshold);
+    fflush(stdout);
+
+    /* ---------- Per-level latency tables: argv = L1 L2 LLC line (bytes) ---- */
+    {
+        size_t l1   = argc > 1 ? strtoul(argv[1], NULL, 10) : 32 * 1024;
+        size_t l2   = argc > 2 ? strtoul(argv[2], NULL, 10) : 256 * 1024;
+        size_t llc  = argc > 3 ? strtoul(argv[3], NULL, 10) : 8 * 1024 * 1024;
+        size_t line = argc > 4 ? strtoul(argv[4], NULL, 10) : 64;
+        if (line < sizeof(void *)) line = 64;
+        calibrate_levels(l1, l2, llc, line);
+    }
     return 0;
 }
 """
 
 # ---------------------------------------------------------------------------
-# Pydantic schema – no arguments needed
+# Pydantic schema
 # ---------------------------------------------------------------------------
 class CacheThresholdInput(BaseModel):
-    """This tool requires no arguments."""
+    recalibrate: bool = Field(default=False, description="ignore the cached calibration of this host and measure again")
     pass
 
 
@@ -174,12 +296,15 @@ class CacheThresholdInput(BaseModel):
 # Tool
 # ---------------------------------------------------------------------------
 @tool("measure_cache_threshold", args_schema=CacheThresholdInput, return_direct=True)
-def measure_cache_threshold() -> tuple[str, str]:
+def measure_cache_threshold(recalibrate: bool = False) -> tuple[str, str]:
     """
     Empirically measures the CACHE_HIT_THRESHOLD for the current CPU architecture
-    by timing cache-hit vs cache-miss memory accesses.
+    by timing cache-hit vs cache-miss memory accesses, plus latency percentiles and a
+    threshold per cache level (L1, L2, LLC, DRAM).
 
-    Compiles and runs a small C calibration program inside the workdir.
+    Compiles and runs a small C calibration program. The result is cached per host
+    (architecture, CPU model, microcode, kernel, cache topology) for
+    CALIBRATION_CACHE_TTL_SECONDS; set recalibrate=True to measure again.
     Works on: aarch64, armv7l, x86_64, i686.
 
     Returns:
@@ -192,51 +317,45 @@ def measure_cache_threshold() -> tuple[str, str]:
     arch = platform.machine()
     log.info(f"[measure_cache_threshold] Detected architecture: {arch}")
 
-    src_rel  = "PoC/cache_calibrate.c"
-    bin_rel  = "PoC/cache_calibrate"
+    fingerprint, details = host_fingerprint()
+    entry_dir = os.path.join(CALIBRATION_CACHE_DIR, fingerprint)
+
+    # 1. Reuse a previous calibration of this exact host, unless asked to recalibrate
+    if not recalibrate:
+        cached = _load_cached_calibration(entry_dir)
+        if cached is not None:
+            log.info(f"[measure_cache_threshold] Using cached calibration for host {fingerprint}")
+            return _format_result(arch, cached["hit_median"], cached["miss_median"], cached["threshold"],
+                                  levels=cached.get("levels"), level_thresholds=cached.get("level_thresholds"),
+                                  measured_at=cached["measured_at"]), ""
 
     errors: list[str] = []
 
-    # 1. Write the C source into the workdir
+    # 2. Build (or reuse) the calibration binary kept next to the cached results
     try:
-        write_file(src_rel, _CALIBRATION_C)
+        bin_abs, warnings = _build_calibration_binary(entry_dir)
     except Exception as e:
-        msg = f"Failed to write calibration source: {e}"
+        msg = f"Compilation failed:\n{e}"
         log.error(msg)
         return _fallback_result(arch), msg
+    if warnings:
+        errors.append(f"Compiler warnings:\n{warnings}")
 
-    # 2. Compile
-    src_abs = _expandpath(src_rel)
-    bin_abs = _expandpath(bin_rel)
-
-    compile_cmd = ["gcc", "-O2", "-o", bin_abs, src_abs]
-    log.info(f"[measure_cache_threshold] Compiling: {' '.join(compile_cmd)}")
-    comp = subprocess.run(compile_cmd, capture_output=True, text=True)
-    if comp.returncode != 0:
-        msg = f"Compilation failed:\n{comp.stderr}"
-        log.error(msg)
-        errors.append(msg)
-        _cleanup_calibration_files(src_abs, bin_abs)
-        return _fallback_result(arch), "\n".join(errors)
-    if comp.stderr:
-        errors.append(f"Compiler warnings:\n{comp.stderr}")
-
-    # 3. Run (CPU-pinned to core 2, consistent with the rest of the framework)
-    run_cmd = ["taskset", "-c", "2", bin_abs]
-    log.info(f"[measure_cache_threshold] Running: {' '.join(run_cmd)}")
+    # 3. Run (CPU-pinned to an exclusively leased core, like the PoC executions)
     try:
-        run = subprocess.run(run_cmd, capture_output=True, text=True, timeout=30)
+        with lease_core() as core:
+            run_cmd = ["taskset", "-c", str(core), bin_abs, *_level_args()]
+            log.info(f"[measure_cache_threshold] Running: {' '.join(run_cmd)}")
+            run = subprocess.run(run_cmd, capture_output=True, text=True, timeout=30)
     except subprocess.TimeoutExpired:
         msg = "Calibration binary timed out (>30 s)."
         log.error(msg)
         errors.append(msg)
-        _cleanup_calibration_files(src_abs, bin_abs)
         return _fallback_result(arch), "\n".join(errors)
     except Exception as e:
         msg = f"Execution error: {e}"
         log.error(msg)
         errors.append(msg)
-        _cleanup_calibration_files(src_abs, bin_abs)
         return _fallback_result(arch), "\n".join(errors)
 
     if run.returncode != 0:
@@ -244,9 +363,18 @@ def measure_cache_threshold() -> tuple[str, str]:
 
     # 4. Parse output
     hit_med = miss_med = threshold = None
+    levels: dict[str, dict[str, int]] = {}
+    level_thresholds: dict[str, int] = {}
     for line in run.stdout.splitlines():
         line = line.strip()
-        if line.startswith("HIT_MEDIAN="):
+        if line.startswith("LEVEL="):
+            fields = dict(token.split("=", 1) for token in line.split() if "=" in token)
+            name = fields.pop("LEVEL")
+            levels[name] = {key: int(value) for key, value in fields.items()}
+        elif line.startswith("THRESHOLD_"):
+            name, value = line[len("THRESHOLD_"):].split("=", 1)
+            level_thresholds[name] = int(value)
+        elif line.startswith("HIT_MEDIAN="):
             hit_med = int(line.split("=", 1)[1])
         elif line.startswith("MISS_MEDIAN="):
             miss_med = int(line.split("=", 1)[1])
@@ -257,41 +385,132 @@ def measure_cache_threshold() -> tuple[str, str]:
         msg = f"Could not parse calibration output:\n{run.stdout}\n{run.stderr}"
         log.error(msg)
         errors.append(msg)
-        _cleanup_calibration_files(src_abs, bin_abs)
         return _fallback_result(arch), "\n".join(errors)
 
-    result = _format_result(arch, hit_med, miss_med, threshold)
+    result = _format_result(arch, hit_med, miss_med, threshold, levels=levels, level_thresholds=level_thresholds)
     log.info(f"[measure_cache_threshold] Result:\n{result}")
-    
-    # Clean up temporary calibration files before returning
-    _cleanup_calibration_files(src_abs, bin_abs)
-    
+
+    # 5. Persist for later calls and runs on this host (clean live measurements only, never fallbacks;
+    #    a non-zero exit may have left a partial or skewed result)
+    if run.returncode != 0:
+        log.warning("[measure_cache_threshold] Calibration binary failed; result not cached")
+        return result, "\n".join(errors)
+    _store_calibration(entry_dir, {
+        "hit_median": hit_med,
+        "miss_median": miss_med,
+        "threshold": threshold,
+        "levels": levels,
+        "level_thresholds": level_thresholds,
+        "source_hash": _source_hash(),
+        "measured_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "measured_ts": time.time(),
+        "host": details,
+    })
+
     return result, "\n".join(errors)
 
 
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
-def _cleanup_calibration_files(src_path: str, bin_path: str) -> None:
-    """Remove temporary calibration C source and binary files."""
-    files_to_remove = [src_path, bin_path]
-    for fpath in files_to_remove:
-        try:
-            if os.path.exists(fpath):
-                os.remove(fpath)
-                log.info(f"[measure_cache_threshold] Cleaned up: {fpath}")
-        except Exception as e:
-            log.warning(f"[measure_cache_threshold] Failed to remove {fpath}: {e}")
-
-
-def _format_result(arch: str, hit_med: int, miss_med: int, threshold: int) -> str:
+def _load_cached_calibration(entry_dir: str) -> dict | None:
+    """Return the stored calibration of this host, or None if missing or older than the TTL."""
+    if config.CALIBRATION_CACHE_TTL_SECONDS <= 0:
+        return None
+    try:
+        with open(os.path.join(entry_dir, CALIBRATION_RESULT_FILE), "r") as f:
+            cached = json.load(f)
+    except Exception:
+        return None
+    if cached.get("source_hash") != _source_hash():
+        return None
+    if time.time() - cached.get("measured_ts", 0) > config.CALIBRATION_CACHE_TTL_SECONDS:
+        log.info("[measure_cache_threshold] Cached calibration expired; recalibrating")
+        return None
+    return cached
+
+
+def _store_calibration(entry_dir: str, record: dict) -> None:
+    try:
+        os.makedirs(entry_dir, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(record, f, indent=2)
+        os.replace(tmp, os.path.join(entry_dir, CALIBRATION_RESULT_FILE))
+    except Exception as e:
+        log.warning(f"[measure_cache_threshold] Could not store calibration result: {e}")
+
+
+def _build_calibration_binary(entry_dir: str) -> tuple[str, str]:
+    """Compile _CALIBRATION_C into the host's cache entry, reusing an existing build of the same source.
+
+    Returns:
+        tuple[str, str]: (absolute binary path, compiler warnings)
+    Raises:
+        RuntimeError: If gcc fails.
+    """
+    src_hash = _source_hash()
+    bin_abs = os.path.join(entry_dir, f"cache_calibrate-{src_hash}")
+    if os.access(bin_abs, os.X_OK):
+        return bin_abs, ""
+
+    os.makedirs(entry_dir, exist_ok=True)
+    src_abs = os.path.join(entry_dir, f"cache_calibrate-{src_hash}.c")
+    with open(src_abs, "w") as f:
+        f.write(_CALIBRATION_C)
+    tmp_bin = f"{bin_abs}.{os.getpid()}.tmp"
+    compile_cmd = ["gcc", "-O2", "-o", tmp_bin, src_abs]
+    log.info(f"[measure_cache_threshold] Compiling: {' '.join(compile_cmd)}")
+    comp = subprocess.run(compile_cmd, capture_output=True, text=True)
+    if comp.returncode != 0:
+        raise RuntimeError(comp.stderr)
+    os.replace(tmp_bin, bin_abs)
+    return bin_abs, comp.stderr
+
+
+def _source_hash() -> str:
+    return hashlib.sha256(_CALIBRATION_C.encode("utf-8")).hexdigest()[:12]
+
+
+def _level_args() -> list[str]:
+    """argv for the calibration binary: L1, L2, LLC and line sizes in bytes, from sysfs."""
+    sizes = get_cache_sizes()
+    l1 = sizes.get("L1") or 32 * 1024
+    l2 = sizes.get("L2") or 256 * 1024
+    llc = max([size for key, size in sizes.items() if key != "line"] + [l2])
+    return [str(l1), str(l2), str(llc), str(sizes.get("line") or 64)]
+
+
+def _format_levels(levels: dict | None, level_thresholds: dict | None) -> str:
+    if not levels:
+        return ""
+    lines = ["Latency percentiles per level (timer ticks, random pointer-chase loads):",
+             f"  {'level':<5} {'working set':>12} {'P10':>6} {'P25':>6} {'P50':>6} {'P75':>6} {'P90':>6} {'P99':>6}"]
+    for name, row in levels.items():
+        lines.append(f"  {name:<5} {str(row.get('SET_BYTES', 0) // 1024) + 'K':>12} "
+                     + " ".join(f"{row.get(p, 0):>6}" for p in ("P10", "P25", "P50", "P75", "P90", "P99")))
+    if level_thresholds:
+        names = list(levels)
+        lines.append("Recommended threshold per level (access time <= threshold => served by that level or closer):")
+        for name, value in level_thresholds.items():
+            slower = names[names.index(name) + 1] if name in names and names.index(name) + 1 < len(names) else "next level"
+            lines.append(f"  {name} vs {slower}: {value} timer ticks")
+    return "\n".join(lines) + "\n\n"
+
+
+def _format_result(arch: str, hit_med: int, miss_med: int, threshold: int,
+                   levels: dict | None = None, level_thresholds: dict | None = None,
+                   measured_at: str | None = None) -> str:
+    cached = f"Measured      : {measured_at} (cached for this host; pass recalibrate=true to re-measure)\n" if measured_at else ""
     return (
         f"\n*** Cache Threshold Calibration Result ***\n"
         f"Architecture  : {arch}\n"
+        f"{cached}"
         f"Hit  Median   : {hit_med} timer ticks\n"
         f"Miss Median   : {miss_med} timer ticks\n"
         f"Recommended Threshold: {threshold} timer ticks\n"
         f"\n"
+        f"{_format_levels(levels, level_thresholds)}"
         f"Use this in the PoC source code:\n"
         f"NOTE: The threshold is derived from live measurements on this "
         f"machine ({arch}).\n"
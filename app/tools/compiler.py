@@ -2,7 +2,12 @@
 import os
 import subprocess
 import logging
-import platform
+import hashlib
+import json
+import shutil
+import stat
+import tempfile
+from functools import lru_cache
 # Langchain imports
 from langchain.tools import tool # type: ignore
 from pydantic import BaseModel, Field # type: ignore
@@ -10,14 +15,17 @@ from typing import Dict, Any
 
 # Local imports
 from tools.file_ops import do_in, do_in_workdir, write_file
-from app_config import get_logger
+from tools.extract_system_info import get_system_info
+from app_config import config, get_logger
 
 log = get_logger(__name__)
 
+COMPILE_CACHE_DIR = os.path.expanduser("~/workdir/.compile_cache")
+
 # ARM Architecture Detection
 def get_arch_flags():
     """Detect system architecture and return appropriate compiler flags."""
-    machine = platform.machine()
+    machine = get_system_info().arch
     flags = []
     
     log.info(f"[*] Detected Architecture: {machine}")
@@ -39,6 +47,78 @@ def get_arch_flags():
     
     return flags
 
+@lru_cache(maxsize=None)
+def _compiler_version(compiler: str) -> str:
+    """First line of `<compiler> --version`, so a toolchain upgrade invalidates cached builds."""
+    try:
+        ret = subprocess.run([compiler, "--version"], capture_output=True, text=True, timeout=10)
+        return ret.stdout.splitlines()[0] if ret.stdout else ""
+    except Exception:
+        return ""
+
+def _compile_cache_key(cmd: list[str], output_file: str, file_path: str, file_contents: str) -> str:
+    """Content address of a build: source hash, compiler (and version), flags and architecture."""
+    flags = [arg for arg in cmd[1:] if arg not in (output_file, file_path)]
+    material = json.dumps({
+        "source": hashlib.sha256(file_contents.encode("utf-8")).hexdigest(),
+        "source_name": os.path.basename(file_path),
+        "compiler": cmd[0],
+        "compiler_version": _compiler_version(cmd[0]),
+        "flags": flags,
+        "arch": get_system_info().arch,     # the -march / -mcpu flags are chosen from the same field
+    }, sort_keys=True)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+def _run_compiler(cmd: list[str], output_file: str, file_path: str, file_contents: str) -> tuple[int, str, str]:
+    """Run `cmd` in the workdir, or restore the binary and compiler output of an identical earlier build.
+
+    Returns:
+        tuple[int, str, str]: (return code, stdout, stderr) of the (possibly cached) compilation.
+    """
+    key = _compile_cache_key(cmd, output_file, file_path, file_contents) if config.COMPILE_CACHE else None
+    entry_dir = os.path.join(COMPILE_CACHE_DIR, key) if key else None
+
+    if entry_dir and os.path.isfile(os.path.join(entry_dir, "result.json")):
+        try:
+            with open(os.path.join(entry_dir, "result.json"), "r") as f:
+                cached = json.load(f)
+            with do_in_workdir():
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                if cached["return_code"] == 0:
+                    shutil.copyfile(os.path.join(entry_dir, "binary"), output_file)
+                    os.chmod(output_file, os.stat(output_file).st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+            log.info(f"[+] Compile cache hit ({key[:12]}); skipped: {' '.join(cmd)}")
+            return cached["return_code"], cached["stdout"], cached["stderr"]
+        except Exception as e:
+            log.warning(f"[!] Ignoring unreadable compile cache entry {key[:12]}: {e}")
+
+    with do_in_workdir():
+        log.info(f"[+] Running command: {' '.join(cmd)}")
+        log.info(f"File path: {os.path.dirname(file_path)}")
+        ret = subprocess.run(cmd, capture_output=True)
+        stdout_str = ret.stdout.decode('utf-8', errors='replace')
+        stderr_str = ret.stderr.decode('utf-8', errors='replace')
+
+        if entry_dir:
+            try:
+                os.makedirs(COMPILE_CACHE_DIR, exist_ok=True)
+                tmp_dir = tempfile.mkdtemp(dir=COMPILE_CACHE_DIR, prefix=".tmp-")
+                if ret.returncode == 0:
+                    shutil.copyfile(output_file, os.path.join(tmp_dir, "binary"))
+                with open(os.path.join(tmp_dir, "result.json"), "w") as f:
+                    json.dump({"return_code": ret.returncode, "stdout": stdout_str, "stderr": stderr_str}, f)
+                try:
+                    os.rename(tmp_dir, entry_dir)
+                except OSError:
+                    # Another run stored the same build concurrently
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+            except Exception as e:
+                log.warning(f"[!] Could not store compile cache entry: {e}")
+        pass
+
+    return ret.returncode, stdout_str, stderr_str
+
 class CompileGCCInput(BaseModel):
     file_contents: str = Field(..., description="the contents of the file (source code) to compile")
     state: dict[str, Any] = Field(..., description="The state of the Agent")
@@ -79,16 +159,8 @@ def compile_C(file_contents: str, state: Dict[str, Any] | None = None) -> dict[s
     # cmd = ["gcc"] + arch_flags + ["-o", output_file, file_path]
     cmd = ["gcc", "-O2", "-o", output_file, file_path]
 
-    with do_in_workdir():
-        log.info(f"[+] Running command: {' '.join(cmd)}")
-        file_path = os.path.join(os.getcwd(), folder_path)
-        log.info(f"File path: {folder_path}") 
-        ret = subprocess.run(cmd, capture_output=True)
-        pass
-
-    stdout_str = ret.stdout.decode('utf-8', errors='replace')
-    stderr_str = ret.stderr.decode('utf-8', errors='replace')
-    status = "success" if ret.returncode == 0 else "failed"
+    return_code, stdout_str, stderr_str = _run_compiler(cmd, output_file, file_path, file_contents)
+    status = "success" if return_code == 0 else "failed"
     
     output = f"""
     *** Compiler Output Start ***
@@ -105,8 +177,8 @@ def compile_C(file_contents: str, state: Dict[str, Any] | None = None) -> dict[s
         "status": status,
         "stdout": stdout_str,
         "stderr": stderr_str,
-        "return_code": ret.returncode,
-        "message": "Compilation completed successfully" if ret.returncode == 0 else f"Compilation failed with return code {ret.returncode}"
+        "return_code": return_code,
+        "message": "Compilation completed successfully" if return_code == 0 else f"Compilation failed with return code {return_code}"
     }
 
 @tool("compile_CPP", args_schema=CompileGCCInput, return_direct=True)
@@ -139,16 +211,8 @@ def compile_CPP(file_contents: str, state: Dict[str, Any] | None = None) -> dict
     output_file = os.path.join(folder_path, base_name)
     cmd = ["g++", "-std=gnu++17","-o", output_file, file_path]
 
-    with do_in_workdir():
-        log.info(f"[+] Running command: {' '.join(cmd)}")
-        file_path = os.path.join(os.getcwd(), folder_path)
-        log.info(f"File path: {folder_path}") 
-        ret = subprocess.run(cmd, capture_output=True)
-        pass
-
-    stdout_str = ret.stdout.decode('utf-8', errors='replace')
-    stderr_str = ret.stderr.decode('utf-8', errors='replace')
-    status = "success" if ret.returncode == 0 else "failed"
+    return_code, stdout_str, stderr_str = _run_compiler(cmd, output_file, file_path, file_contents)
+    status = "success" if return_code == 0 else "failed"
     
     output = f"""
     *** Compiler Output Start ***
@@ -165,8 +229,8 @@ def compile_CPP(file_contents: str, state: Dict[str, Any] | None = None) -> dict
         "status": status,
         "stdout": stdout_str,
         "stderr": stderr_str,
-        "return_code": ret.returncode,
-        "message": "Compilation completed successfully" if ret.returncode == 0 else f"Compilation failed with return code {ret.returncode}"
+        "return_code": return_code,
+        "message": "Compilation completed successfully" if return_code == 0 else f"Compilation failed with return code {return_code}"
     }
 
 
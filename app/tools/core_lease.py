@@ -0,0 +1,124 @@
+'''
+core_lease.py
+
+Exclusive CPU-core leases for timing-sensitive executions (PoC binaries,
+cache calibration, perf measurements).
+
+Every tool used to pin its binary with a hard-coded `taskset -c 2`, so any
+concurrency (parallel tool calls, batch sweeps) made cache-timing binaries
+share one core and corrupted their measurements. A lease hands each
+execution a core nobody else is using; callers queue when none is free.
+
+Leases are advisory flock()s on ~/workdir/.core_leases/cpu<N>.lock, so they
+hold across threads and across the separate processes of a batch sweep, and
+are released automatically if a process dies. With CORE_LEASE_PHYSICAL the
+whole physical core is leased (all SMT siblings, from the sysfs topology), so
+no other execution runs on the hyper-thread sibling.
+'''
+
+import fcntl
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from tools.extract_system_info import get_thread_siblings, _parse_cpu_list
+from app_config import config, get_logger
+
+log = get_logger(__name__)
+
+LEASE_DIR = os.path.expanduser("~/workdir/.core_leases")
+_POLL_SECONDS = 0.1
+
+
+def candidate_cores() -> list[int]:
+    '''Cores that executions may be pinned to.
+
+    Order of precedence: config.EXEC_CORES, the UGEN_EXEC_CORES environment
+    variable (sysfs list syntax, e.g. "2-5"), then this process's affinity.
+    '''
+    if config.EXEC_CORES:
+        return sorted(set(config.EXEC_CORES))
+    env = os.getenv("UGEN_EXEC_CORES", "").strip()
+    if env:
+        return sorted(set(_parse_cpu_list(env)))
+    return sorted(os.sched_getaffinity(0))
+
+
+def _lease_groups(preferred: int | None) -> list[tuple[int, ...]]:
+    '''Candidate leases as (core to run on, *cores to lock), preferred core first.'''
+    groups = []
+    seen = set()
+    for cpu in candidate_cores():
+        if cpu in seen:
+            continue
+        if config.CORE_LEASE_PHYSICAL:
+            siblings = get_thread_siblings(cpu)
+        else:
+            siblings = [cpu]
+        seen.update(siblings)
+        groups.append((cpu, *[c for c in siblings if c != cpu]))
+    if preferred is not None:
+        groups.sort(key=lambda group: preferred not in group)
+    return groups
+
+
+def _try_lock(cpus: tuple[int, ...]) -> list | None:
+    handles = []
+    for cpu in cpus:
+        handle = open(os.path.join(LEASE_DIR, f"cpu{cpu}.lock"), "a+")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            _release(handles)
+            return None
+        handles.append(handle)
+    return handles
+
+
+def _release(handles: list) -> None:
+    for handle in handles:
+        try:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+        finally:
+            handle.close()
+
+
+@contextmanager
+def lease_core(preferred: int | None = None, timeout: float | None = None) -> Iterator[int]:
+    '''Lease an exclusive core for the duration of the `with` block.
+
+    Args:
+        preferred (int, optional): Core to try first (e.g. one requested by the agent).
+        timeout (float, optional): Seconds to wait for a free core; defaults to
+            config.CORE_LEASE_TIMEOUT_SECONDS.
+    Yields:
+        int: The core to pin the execution to (e.g. `taskset -c <core>`).
+    Raises:
+        TimeoutError: If no core became free within the timeout.
+    '''
+    os.makedirs(LEASE_DIR, exist_ok=True)
+    timeout = config.CORE_LEASE_TIMEOUT_SECONDS if timeout is None else timeout
+    deadline = time.time() + timeout
+    waited = False
+    while True:
+        for group in _lease_groups(preferred):
+            handles = _try_lock(group)
+            if handles is None:
+                continue
+            if waited:
+                log.info(f"[core_lease] Core {group[0]} became free")
+            log.debug(f"[core_lease] Leased core {group[0]} (locked: {list(group)})")
+            try:
+                yield group[0]
+            finally:
+                _release(handles)
+                log.debug(f"[core_lease] Released core {group[0]}")
+            return
+        if time.time() >= deadline:
+            raise TimeoutError(f"No free execution core among {candidate_cores()} after {timeout}s")
+        if not waited:
+            log.info("[core_lease] All execution cores are leased; waiting for a free core")
+            waited = True
+        time.sleep(_POLL_SECONDS)
@@ -1,15 +1,23 @@
 # Built-in imports
 import subprocess
 import os
+import re
+import selectors
+import shutil
+import time
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor
 import stat
 # Langchain imports
 from langchain.tools import tool # type: ignore
 from pydantic import BaseModel, Field # type: ignore
+from typing import Any
 
 # Local imports
-from app_config import get_logger
+from app_config import config, get_logger
 from tools.file_ops import do_in_workdir, read_file
+from tools.core_lease import lease_core, candidate_cores
+from timings import describe
 
 log = get_logger(__name__)
 
@@ -17,7 +25,11 @@ log = get_logger(__name__)
 
 class ExecuteBinaries(BaseModel):
     file_path: str = Field(default="PoC",description="the path of the file to execute")
-    cpu_core: int = Field(default=2, description="the cpu core in which the file will be executed")
+    cpu_core: int | None = Field(default=None, description="preferred cpu core for the execution; by default an exclusive core is leased from the free execution cores")
+    trials: int = Field(default=1, description="number of times to run each binary; with trials > 1 a statistical summary (leaked byte distribution or per-trial result value such as the Prime+Probe delta, success rate, runtime percentiles) is returned instead of the raw output of every run")
+    parallel: bool = Field(default=False, description="with trials > 1, run the trials in parallel on separately leased cores instead of sequentially on one pinned core")
+    success_pattern: str | None = Field(default=None, description="optional regular expression (e.g. the full secret string from the problem statement); the binary is stopped as soon as its output matches it")
+    state: dict[str, Any] | None = Field(default=None, description="The state of the Agent")
     pass # end of ExecuteBinary
     
 def execute_binary(file_path: str, cpu_core: int) -> dict[str, str]:
@@ -48,10 +60,257 @@ def execute_binary(file_path: str, cpu_core: int) -> dict[str, str]:
 
     return stdout, stderr
 
+# How the PoC of each attack vector reports its result, for the trials summary (matched by name prefix).
+# "leak": leaked-byte lines, groups (Success|Unclear, hex byte), e.g. "Success: 0x54='T' score=2"
+# "metric": a number per run whose first group is the value, a run succeeds when it is > 0
+_TRIAL_FORMATS = {
+    "Spectre": {"leak": r"\b(Success|Unclear):\s*0x([0-9A-Fa-f]{1,2})\b"},
+    # Average cycles of Prime->Victim->Probe minus Prime->Probe, e.g. "Delta: 12.50 cycles"
+    "Prime-Probe": {"metric": r"\bDelta\b[^\d\n+-]*([-+]?\d+(?:\.\d+)?)"},
+}
+_TRIAL_TIMEOUT_SECONDS = 40
+_MAX_TRIALS = 100
+_STDBUF = shutil.which("stdbuf")
+
+def line_buffered(cmd: list[str]) -> list[str]:
+    ''' Prefix `cmd` with `stdbuf -oL -eL` so a (dynamically linked) PoC that printf()s into our pipe
+    flushes every line instead of its whole block-buffered output at exit; otherwise neither the
+    success pattern nor the idle timeout can see the output while it runs. Only used when one of
+    them is active, since the extra write per line disturbs the timing the PoC measures.
+    '''
+    return [_STDBUF, "-oL", "-eL", *cmd] if _STDBUF else cmd
+
+if _STDBUF is None:
+    log.warning("stdbuf not found; PoC output on the pipe stays block-buffered until the process exits")
+
+def stream_process(cmd: list[str], timeout: float, success_pattern: str | None = None,
+                   idle_timeout: float | None = None, max_bytes: int | None = None) -> dict:
+    ''' Runs `cmd` reading stdout/stderr incrementally, and stops it early once `success_pattern`
+    matches the stdout or no output arrived for `idle_timeout` seconds. At most `max_bytes` of
+    each stream are kept; the rest is drained and discarded.
+
+    Returns:
+        dict: stdout, stderr, returncode, seconds, timed_out and stop_reason
+            ("exit", "success_pattern", "idle" or "timeout").
+    '''
+    pattern = re.compile(success_pattern) if success_pattern else None
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout_fd, stderr_fd = proc.stdout.fileno(), proc.stderr.fileno()
+    buffers = {stdout_fd: bytearray(), stderr_fd: bytearray()}
+    truncated = {stdout_fd: False, stderr_fd: False}
+    stop_reason = "exit"
+    last_output = start
+
+    with selectors.DefaultSelector() as selector:
+        for fd in buffers:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            now = time.perf_counter()
+            if now - start >= timeout:
+                stop_reason = "timeout"
+                break
+            if idle_timeout and now - last_output >= idle_timeout:
+                stop_reason = "idle"
+                break
+            wait = timeout - (now - start)
+            if idle_timeout:
+                wait = min(wait, idle_timeout - (now - last_output))
+            for key, _ in selector.select(max(wait, 0.01)):
+                chunk = os.read(key.fd, 65536)
+                if not chunk:
+                    selector.unregister(key.fd)
+                    continue
+                last_output = time.perf_counter()
+                buf = buffers[key.fd]
+                if max_bytes is None or len(buf) < max_bytes:
+                    room = len(chunk) if max_bytes is None else max_bytes - len(buf)
+                    buf.extend(chunk[:room])
+                    truncated[key.fd] |= room < len(chunk)
+                else:
+                    truncated[key.fd] = True
+                if pattern and key.fd == stdout_fd:
+                    # Only re-scan the tail so long outputs are not searched quadratically
+                    tail = bytes(buf[-(len(chunk) + 4096):]).decode('utf-8', errors='replace')
+                    if pattern.search(tail):
+                        stop_reason = "success_pattern"
+            if stop_reason == "success_pattern":
+                break
+
+    if proc.poll() is None:
+        proc.kill()
+    returncode = proc.wait()
+    proc.stdout.close()
+    proc.stderr.close()
+
+    def text(fd: int) -> str:
+        out = buffers[fd].decode('utf-8', errors='replace')
+        if truncated[fd]:
+            out += f"\n[... output truncated after {max_bytes} bytes ...]\n"
+        return out
+
+    return {
+        "stdout": text(stdout_fd),
+        "stderr": text(stderr_fd),
+        "returncode": returncode,
+        "seconds": time.perf_counter() - start,
+        "timed_out": stop_reason == "timeout",
+        "stop_reason": stop_reason,
+    }
+
+def _run_trial(binary: str, core: int, success_pattern: str | None = None) -> dict:
+    success_pattern = success_pattern or config.EXEC_SUCCESS_PATTERN
+    idle_timeout = config.EXEC_IDLE_TIMEOUT_SECONDS or None
+    cmd = ["taskset", "-c", str(core), binary]
+    if success_pattern or idle_timeout:
+        # Only when the output is watched while it runs: a write per line perturbs timing-sensitive PoCs
+        cmd = line_buffered(cmd)
+    log.info(f"[+] Running command: {' '.join(cmd)}")
+    result = stream_process(
+        cmd,
+        timeout=_TRIAL_TIMEOUT_SECONDS,
+        success_pattern=success_pattern,
+        idle_timeout=idle_timeout,
+        max_bytes=config.EXEC_MAX_OUTPUT_BYTES or None,
+    )
+    if result["stop_reason"] == "success_pattern":
+        result["stdout"] += f"\n[Execution stopped early after {result['seconds']:.1f} s: success pattern matched]\n"
+    elif result["stop_reason"] == "idle":
+        result["stderr"] += f"Idle Error: {binary} produced no output for {config.EXEC_IDLE_TIMEOUT_SECONDS} seconds and was terminated.\n"
+    elif result["stop_reason"] == "timeout":
+        result["stderr"] += f"Timeout Error: Execution of {binary} exceeded {_TRIAL_TIMEOUT_SECONDS} seconds.\n"
+    return result
+
+def _run_trials(binary: str, trials: int, parallel: bool, cpu_core: int | None,
+                success_pattern: str | None = None) -> list[dict]:
+    ''' Runs `binary` `trials` times, either on one leased core or concurrently on separately leased cores. '''
+    if not parallel:
+        with lease_core(preferred=cpu_core) as core:
+            log.info(f"[+] Running {trials} trials of {binary} on core {core}")
+            return [_run_trial(binary, core, success_pattern) for _ in range(trials)]
+
+    def leased_trial(_) -> dict:
+        with lease_core() as core:
+            return _run_trial(binary, core, success_pattern)
+
+    workers = max(1, min(trials, len(candidate_cores())))
+    log.info(f"[+] Running {trials} trials of {binary} on up to {workers} leased cores")
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(leased_trial, range(trials)))
+
+def trial_formats(attack_vector: str | None) -> list[dict[str, str]]:
+    ''' Result formats to look for in the output: the configured patterns, else the attack vector's
+    format, else every known format (the first one that matches any trial is used).
+    '''
+    configured = {kind: pattern for kind, pattern in (("leak", config.EXEC_LEAK_PATTERN),
+                                                     ("metric", config.EXEC_METRIC_PATTERN)) if pattern}
+    if configured:
+        return [{kind: pattern} for kind, pattern in configured.items()]
+    vector = (attack_vector or "").strip()
+    known = [fmt for prefix, fmt in _TRIAL_FORMATS.items() if vector.startswith(prefix)]
+    return known or list(_TRIAL_FORMATS.values())
+
+def _printable(value: int) -> str:
+    return chr(value) if 32 <= value < 127 else "?"
+
+def _summarize_leaks(results: list[dict], pattern: str) -> list[str]:
+    ''' Leaked-byte distribution per offset, consensus secret and success rate ([] if no trial has a leak line). '''
+    trials = len(results)
+    # Leaked bytes per offset, in order of appearance in each trial's output
+    leaks_per_trial = [[(kind, int(value, 16)) for kind, value in re.findall(pattern, r["stdout"])] for r in results]
+    offsets = max((len(leaks) for leaks in leaks_per_trial), default=0)
+    if not offsets:
+        return []
+    distributions = [Counter(leaks[i][1] for leaks in leaks_per_trial if len(leaks) > i) for i in range(offsets)]
+    consensus = [dist.most_common(1)[0][0] for dist in distributions]
+    reads = sum(len(leaks) for leaks in leaks_per_trial)
+    success_reads = sum(1 for leaks in leaks_per_trial for kind, _ in leaks if kind == "Success")
+    matching = sum(1 for leaks in leaks_per_trial if [value for _, value in leaks] == consensus)
+
+    lines = [f"Leaked bytes read: {reads} (Success: {success_reads}, Unclear: {reads - success_reads}); "
+             f"success rate {100.0 * success_reads / reads:.1f}%"]
+    lines.append(f"Consensus secret ({offsets} bytes): \"{''.join(_printable(v) for v in consensus)}\"")
+    lines.append(f"Trials reproducing the full consensus: {matching}/{trials}")
+    disputed = [i for i, dist in enumerate(distributions) if dist.most_common(1)[0][1] < trials]
+    if disputed:
+        lines.append("Offsets where trials disagree (value: count):")
+        for i in disputed[:40]:
+            top = ", ".join(f"0x{v:02X}='{_printable(v)}': {c}" for v, c in distributions[i].most_common(3))
+            lines.append(f"  [{i}] {top}")
+        if len(disputed) > 40:
+            lines.append(f"  ... {len(disputed) - 40} more disputed offsets")
+    else:
+        lines.append("All trials agree on every leaked byte.")
+    return lines
+
+def _summarize_metric(results: list[dict], pattern: str) -> list[str]:
+    ''' Distribution of the last reported value per trial and the share of trials where it is > 0 ([] if none reported one). '''
+    trials = len(results)
+    values = []
+    for r in results:
+        found = re.findall(pattern, r["stdout"])
+        if found:
+            value = found[-1][0] if isinstance(found[-1], tuple) else found[-1]
+            try:
+                values.append(float(value))
+            except ValueError:
+                continue
+    if not values:
+        return []
+    stats = describe(values)
+    positive = sum(1 for v in values if v > 0)
+    return [f"Reported value per trial (last match of /{pattern}/): {len(values)}/{trials} trials reported one",
+            f"  mean {stats['mean']:.3f}, median {stats['p50']:.3f}, p90 {stats['p90']:.3f}, "
+            f"min {stats['min']:.3f}, max {stats['max']:.3f}",
+            f"Value > 0 (success condition) in {positive}/{len(values)} trials; success rate {100.0 * positive / len(values):.1f}%"]
+
+def summarize_trials(binary: str, results: list[dict], parallel: bool, attack_vector: str | None = None) -> str:
+    ''' Aggregates repeated runs of a PoC binary into a statistical summary for the agent. '''
+    trials = len(results)
+    runtimes = [r["seconds"] for r in results if not r["timed_out"]]
+    timeouts = sum(1 for r in results if r["timed_out"])
+    clean_exits = sum(1 for r in results if r["returncode"] == 0)
+    pattern_stops = sum(1 for r in results if r["stop_reason"] == "success_pattern")
+
+    mode = "in parallel on leased cores" if parallel else "sequentially on one pinned core"
+    lines = [f"*** Trial Summary: {os.path.basename(binary)} ({trials} trials, {mode}) ***"]
+    lines.append(f"Exit code 0: {clean_exits}/{trials}, timeouts: {timeouts}/{trials}"
+                 + (f", stopped on success pattern: {pattern_stops}/{trials}" if pattern_stops else ""))
+    if runtimes:
+        stats = describe(runtimes)
+        lines.append(f"Runtime (s): median {stats['p50']:.3f}, p90 {stats['p90']:.3f}, "
+                     f"min {stats['min']:.3f}, max {stats['max']:.3f}")
+
+    formats = trial_formats(attack_vector)
+    verdict = []
+    for fmt in formats:
+        verdict = _summarize_leaks(results, fmt["leak"]) if "leak" in fmt else _summarize_metric(results, fmt["metric"])
+        if verdict:
+            break
+    if verdict:
+        lines.extend(verdict)
+    else:
+        expected = "; ".join(f"{kind} lines /{pattern}/" for fmt in formats for kind, pattern in fmt.items())
+        lines.append(f"No recognised result format in the output of any trial (attack vector: {attack_vector or 'unknown'}; "
+                     f"looked for {expected}), so there is no verdict. Set EXEC_LEAK_PATTERN or EXEC_METRIC_PATTERN "
+                     f"to match the PoC's result lines.")
+
+    sample = next((r for r in results if r["stdout"]), results[0] if results else None)
+    if sample is not None:
+        lines.append("")
+        lines.append(f"*** Sample output (trial {results.index(sample) + 1}) ***")
+        lines.append(sample["stdout"])
+    return "\n".join(lines) + "\n"
+
 @tool("execute_binaries", args_schema=ExecuteBinaries, return_direct=True)
-def execute_binaries(file_path: str = "PoC", cpu_core: int = 2) -> dict[str, str]:
+def execute_binaries(file_path: str = "PoC", cpu_core: int | None = None, trials: int = 1, parallel: bool = False,
+                     success_pattern: str | None = None, state: dict[str, Any] | None = None) -> dict[str, str]:
     ''' Executes all the binaries at the specified path in parallel. The function returns a tuple of the execution output, 
     the execution error.
+    With trials > 1 every binary is run repeatedly and the output is a statistical summary of the runs
+    (leaked byte distribution per offset and consensus secret, or the distribution of a per-run value such as
+    the Prime+Probe delta, success rate and runtime percentiles), in the format of the state's attack vector.
+    Output is streamed: a run stops as soon as `success_pattern` matches, or when it stays silent too long.
     '''
     executable=[]
     # folder_path=os.path.dirname(file_path)
@@ -76,20 +335,34 @@ def execute_binaries(file_path: str = "PoC", cpu_core: int = 2) -> dict[str, str
             # if is_executable==True:
             #     executable.append(file) 
 
-        # Run all binaries sequentially, pinned to the specified CPU core
-        # cpu_core=2;
+        # Repeated-trial mode: one aggregated summary per binary
+        if trials > 1:
+            trials = min(trials, _MAX_TRIALS)
+            for binary in executable:
+                try:
+                    results = _run_trials(binary, trials, parallel, cpu_core, success_pattern)
+                except TimeoutError as e:
+                    log.error(str(e))
+                    stderr.append(f"Execution of {binary} skipped: {e}")
+                    continue
+                stdout.append(summarize_trials(binary, results, parallel, (state or {}).get("attack_vector")))
+                errors = Counter(r["stderr"] for r in results if r["stderr"])
+                stderr.extend(f"[{count}/{trials} trials] {err.rstrip()}\n" for err, count in errors.items())
+            executable = []
+
+        # Run all binaries sequentially, each pinned to an exclusively leased CPU core
         for binary in executable:
-            cmd=["taskset", "-c", str(cpu_core), binary]
-            log.info(f"[+] Running command: {' '.join(cmd)}")
             try:
-                ret = subprocess.run(cmd, capture_output=True, timeout=40)  # 40 seconds timeout
-                stdout.append(ret.stdout.decode('utf-8', errors='replace'))
-                stderr.append(ret.stderr.decode('utf-8', errors='replace'))
-            except subprocess.TimeoutExpired:
-                timeout_msg = f"Timeout Error: Execution of {binary} exceeded 40 seconds."
-                log.error(timeout_msg)
+                with lease_core(preferred=cpu_core) as core:
+                    ret = _run_trial(binary, core, success_pattern)  # 40 seconds timeout
+                if ret["timed_out"]:
+                    log.error(f"Timeout Error: Execution of {binary} exceeded {_TRIAL_TIMEOUT_SECONDS} seconds.")
+                stdout.append(ret["stdout"])
+                stderr.append(ret["stderr"])
+            except TimeoutError as e:
+                log.error(str(e))
                 stdout.append("")
-                stderr.append(timeout_msg)
+                stderr.append(f"Execution of {binary} skipped: {e}")
         pass
         
     # Output the result
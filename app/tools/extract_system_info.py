@@ -1,9 +1,12 @@
 # Built-in imports
+import hashlib
+import json
 import os
 import re
 import subprocess
 import logging
 import platform
+import threading
 from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor
 # Langchain imports
@@ -20,6 +23,29 @@ class ExtractSystemInfoInput(BaseModel):
     """This tool takes no arguments."""
     pass # end of ExtractSystemInfoInput
 
+class CacheLevel(BaseModel):
+    level: int = Field(description="cache level (1, 2, 3, ...)")
+    type: str = Field(description="Data, Instruction or Unified")
+    size_bytes: int = Field(description="cache size in bytes")
+    ways: int | None = Field(default=None, description="associativity")
+    line_size: int | None = Field(default=None, description="coherency line size in bytes")
+    sets: int | None = Field(default=None, description="number of sets")
+    shared_cpus: list[int] = Field(default_factory=list, description="logical CPUs sharing this cache")
+    pass # end of CacheLevel
+
+class SystemInfo(BaseModel):
+    fingerprint: str = Field(description="host fingerprint (see host_fingerprint)")
+    arch: str = Field(description="machine architecture, e.g. 'x86_64' or 'aarch64'")
+    cpu_model: str = Field(default="", description="CPU model name from /proc/cpuinfo")
+    microcode: str = Field(default="", description="microcode revision ('' on ARM)")
+    kernel: str = Field(default="", description="kernel release")
+    cpu_flags: list[str] = Field(default_factory=list, description="CPU feature flags (x86 'flags' / ARM 'Features')")
+    online_cpus: list[int] = Field(default_factory=list, description="online logical CPUs")
+    smt_siblings: dict[int, list[int]] = Field(default_factory=dict, description="logical CPU -> CPUs on the same physical core")
+    numa_node: dict[int, int] = Field(default_factory=dict, description="logical CPU -> NUMA node")
+    caches: list[CacheLevel] = Field(default_factory=list, description="cache hierarchy of cpu0")
+    pass # end of SystemInfo
+
 def _get_architecture() -> str:
     """Get the system architecture (e.g., 'aarch64', 'x86_64', 'armv7l')."""
     return platform.machine()
@@ -168,6 +194,228 @@ def _collect_via_sysfs() -> tuple[str, str]:
     except Exception as e:
         return "", str(e)
 
+def _parse_cpu_list(text: str) -> list[int]:
+    """Parse a sysfs CPU list such as '0-3,8,10-11'."""
+    cpus = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-", 1)
+            cpus.extend(range(int(lo), int(hi) + 1))
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def _parse_size(text: str) -> int:
+    """Parse a sysfs cache size such as '48K' or '32M' into bytes (0 if unknown)."""
+    m = re.match(r"^\s*(\d+)\s*([KMG]?)", text or "")
+    if not m:
+        return 0
+    return int(m.group(1)) * {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3}[m.group(2)]
+
+def _read_cpuinfo_field(*names: str) -> str:
+    """First value of any of `names` in /proc/cpuinfo ('' when absent, e.g. microcode on ARM)."""
+    try:
+        with open("/proc/cpuinfo", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key.strip() in names:
+                    return value.strip()
+    except Exception:
+        pass
+    return ""
+
+def host_fingerprint() -> tuple[str, dict[str, str]]:
+    """Identify the host for caching hardware measurements.
+
+    Combines architecture, CPU model, microcode revision, kernel release and the
+    sysfs cache topology, so a cached measurement is invalidated whenever any of
+    them changes.
+
+    Returns:
+        tuple[str, dict[str, str]]: (short hex digest, the fingerprinted fields)
+    """
+    details = {
+        "arch": _get_architecture(),
+        "cpu_model": _read_cpuinfo_field("model name", "CPU part", "Hardware", "cpu model"),
+        "microcode": _read_cpuinfo_field("microcode"),
+        "kernel": platform.release(),
+        "cache_topology": _collect_via_sysfs()[0],
+    }
+    digest = hashlib.sha256(json.dumps(details, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return digest, details
+
+SYSTEM_INFO_CACHE_DIR = os.path.expanduser("~/workdir/.system_info")
+_SYSTEM_INFO: SystemInfo | None = None
+_SYSTEM_INFO_LOCK = threading.Lock()
+
+def _read_text(path: str) -> str:
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except Exception:
+        return ""
+
+def _read_int(path: str) -> int | None:
+    try:
+        return int(_read_text(path))
+    except ValueError:
+        return None
+
+def _read_sysfs_caches() -> list[CacheLevel]:
+    base = "/sys/devices/system/cpu/cpu0/cache"
+    caches = []
+    try:
+        entries = sorted(e for e in os.listdir(base) if e.startswith("index"))
+    except Exception:
+        return caches
+    for entry in entries:
+        idx_path = os.path.join(base, entry)
+        level = _read_int(os.path.join(idx_path, "level"))
+        size = _parse_size(_read_text(os.path.join(idx_path, "size")))
+        if level is None or not size:
+            continue
+        shared = _read_text(os.path.join(idx_path, "shared_cpu_list"))
+        caches.append(CacheLevel(
+            level=level,
+            type=_read_text(os.path.join(idx_path, "type")) or "Unified",
+            size_bytes=size,
+            ways=_read_int(os.path.join(idx_path, "ways_of_associativity")),
+            line_size=_read_int(os.path.join(idx_path, "coherency_line_size")),
+            sets=_read_int(os.path.join(idx_path, "number_of_sets")),
+            shared_cpus=_parse_cpu_list(shared) if shared else [],
+        ))
+    return caches
+
+def _read_topology() -> tuple[list[int], dict[int, list[int]], dict[int, int]]:
+    base = "/sys/devices/system/cpu"
+    online_text = _read_text(os.path.join(base, "online"))
+    online = _parse_cpu_list(online_text) if online_text else sorted(os.sched_getaffinity(0))
+    siblings = {}
+    numa = {}
+    for cpu in online:
+        text = _read_text(os.path.join(base, f"cpu{cpu}", "topology", "thread_siblings_list"))
+        siblings[cpu] = sorted(set(_parse_cpu_list(text)) | {cpu}) if text else [cpu]
+    node_base = "/sys/devices/system/node"
+    try:
+        for node in os.listdir(node_base):
+            if node.startswith("node") and node[4:].isdigit():
+                for cpu in _parse_cpu_list(_read_text(os.path.join(node_base, node, "cpulist"))):
+                    numa[cpu] = int(node[4:])
+    except Exception:
+        pass
+    return online, siblings, numa
+
+def _build_system_info(fingerprint: str, details: dict[str, str]) -> SystemInfo:
+    online, siblings, numa = _read_topology()
+    flags = _read_cpuinfo_field("flags", "Features")
+    return SystemInfo(
+        fingerprint=fingerprint,
+        arch=details["arch"],
+        cpu_model=details["cpu_model"],
+        microcode=details["microcode"],
+        kernel=details["kernel"],
+        cpu_flags=flags.split(),
+        online_cpus=online,
+        smt_siblings=siblings,
+        numa_node=numa,
+        caches=_read_sysfs_caches(),
+    )
+
+def get_system_info(refresh: bool = False) -> SystemInfo:
+    """System information, gathered once per process from sysfs and /proc/cpuinfo.
+
+    The result is also persisted per host fingerprint under ~/workdir/.system_info/,
+    so later runs on the same host only re-read the fingerprint inputs and the CPU
+    topology. The topology (online CPUs, SMT siblings, NUMA nodes) is not part of the
+    fingerprint and changes with CPU hotplug or an SMT toggle, so it is never taken
+    from the cache.
+
+    Args:
+        refresh (bool): Re-read the system instead of using the cached object.
+    Returns:
+        SystemInfo: The structured system information.
+    """
+    global _SYSTEM_INFO
+    with _SYSTEM_INFO_LOCK:
+        if _SYSTEM_INFO is not None and not refresh:
+            return _SYSTEM_INFO
+        fingerprint, details = host_fingerprint()
+        path = os.path.join(SYSTEM_INFO_CACHE_DIR, f"{fingerprint}.json")
+        info = None
+        if not refresh:
+            try:
+                with open(path, "r") as f:
+                    info = SystemInfo.model_validate_json(f.read())
+                online, siblings, numa = _read_topology()
+                info = info.model_copy(update={"online_cpus": online, "smt_siblings": siblings, "numa_node": numa})
+                log.info(f"[*] System info loaded from cache ({fingerprint})")
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                log.warning(f"[!] Ignoring unreadable system info cache {path}: {e}")
+        if info is None:
+            info = _build_system_info(fingerprint, details)
+            try:
+                os.makedirs(SYSTEM_INFO_CACHE_DIR, exist_ok=True)
+                tmp = f"{path}.{os.getpid()}.tmp"
+                with open(tmp, "w") as f:
+                    f.write(info.model_dump_json(indent=2))
+                os.replace(tmp, path)
+            except Exception as e:
+                log.warning(f"[!] Could not persist system info: {e}")
+        _SYSTEM_INFO = info
+        return info
+
+def format_cache_info(info: SystemInfo) -> str:
+    """Human-readable cache hierarchy and topology, in the layout of _collect_via_sysfs."""
+    lines = []
+    for cache in info.caches:
+        sets = cache.sets
+        set_bits = sets.bit_length() - 1 if sets and (sets & (sets - 1)) == 0 else "N/A"
+        size = f"{cache.size_bytes // 1024 ** 2}M" if cache.size_bytes % 1024 ** 2 == 0 else f"{cache.size_bytes // 1024}K"
+        lines.append(
+            f"L{cache.level} {cache.type} cache:\n"
+            f"  size              = {size}\n"
+            f"  ways (assoc)      = {cache.ways if cache.ways is not None else 'N/A'}\n"
+            f"  coherency_line_sz = {cache.line_size if cache.line_size is not None else 'N/A'} B\n"
+            f"  sets              = {sets if sets is not None else 'N/A'}  [index bits = {set_bits}]\n"
+            f"  shared by CPUs    = {','.join(map(str, cache.shared_cpus)) or 'N/A'}"
+        )
+    if info.cpu_model:
+        lines.append(f"CPU model: {info.cpu_model}")
+    if info.online_cpus:
+        lines.append(f"Online CPUs: {','.join(map(str, info.online_cpus))}")
+    cores = sorted({tuple(sib) for sib in info.smt_siblings.values()})
+    if cores:
+        lines.append(f"Physical cores (SMT siblings): {' '.join('(' + ','.join(map(str, c)) + ')' for c in cores)}")
+    if info.numa_node:
+        nodes: dict[int, list[int]] = {}
+        for cpu, node in sorted(info.numa_node.items()):
+            nodes.setdefault(node, []).append(cpu)
+        lines.append("NUMA nodes: " + "; ".join(f"node{n}: {','.join(map(str, c))}" for n, c in sorted(nodes.items())))
+    return "\n".join(lines)
+
+def get_thread_siblings(cpu: int) -> list[int]:
+    """Logical CPUs sharing a physical core with `cpu` (including itself), from sysfs topology."""
+    return get_system_info().smt_siblings.get(cpu, [cpu])
+
+def get_cache_sizes() -> dict[str, int]:
+    """Data/unified cache sizes of cpu0 by level, in bytes.
+
+    Returns:
+        dict[str, int]: keys "L1", "L2", "L3", ... for the levels present, plus "line" (line size).
+    """
+    sizes: dict[str, int] = {}
+    for cache in get_system_info().caches:
+        if cache.type == "Instruction":
+            continue
+        sizes[f"L{cache.level}"] = cache.size_bytes
+        if cache.line_size:
+            sizes.setdefault("line", cache.line_size)
+    return sizes
+
 @tool("collect_system_info", args_schema=ExtractSystemInfoInput, return_direct=True)
 def collect_system_info() -> tuple[str, str, str]:
     '''
@@ -179,53 +427,49 @@ def collect_system_info() -> tuple[str, str, str]:
         - architecture: System architecture (e.g., 'aarch64', 'x86_64', 'armv7l')
         - error: Any error messages from collection attempts
     '''
-    arch = _get_architecture()
+    info = get_system_info()
+    arch = info.arch
     log.info(f"[*] Detected Architecture: {arch}")
 
-    # --- Source 1: getconf ---
-    # Reliable on x86 (populated from CPUID leaf 0x4) but returns all-zeros on
-    # ARM64 because the kernel does not map CCSIDR_EL1/CLIDR_EL1 into POSIX
-    # sysconf(). We therefore validate that the values are actually non-zero
-    # before accepting getconf output.
-    out, err = _collect_via_getconf()
-    if out.strip() and _has_complete_cache_info(out):
-        log.info("[*] Cache info source: getconf")
+    # --- Source 1: sysfs, read once per process (see get_system_info) ---
+    # /sys/devices/system/cpu/cpu0/cache/index* exposes the kernel's parsed
+    # view of CCSIDR_EL1/CLIDR_EL1 on ARM64 and CPUID on x86. This path is
+    # always correct and includes size, associativity, line size, and set count.
+    if info.caches:
+        log.info("[*] Cache info source: sysfs")
+        out = format_cache_info(info)
         output = f"""
     *** System Info Output Start ***
     Architecture: {arch}
     *** Cache Info Start ***
     {out}
     *** Cache Info End ***
-    **************************
-    *** Error Messages Start ***
-    {err}
-    *** Error Messages End ***
     """
         print(output)
-        return out, arch, err
+        return out, arch, ""
 
-    log.info("[*] getconf returned zero/empty cache values — falling through to sysfs")
+    log.info("[*] sysfs exposes no cache hierarchy — falling back to getconf")
 
-    # --- Source 2: sysfs (authoritative fallback, always complete on Linux) ---
-    # /sys/devices/system/cpu/cpu0/cache/index* exposes the kernel's parsed
-    # view of CCSIDR_EL1/CLIDR_EL1 on ARM64 and CPUID on x86. This path is
-    # always correct and includes size, associativity, line size, and set count.
-    out3, err3 = _collect_via_sysfs()
-    log.info("[*] Cache info source: sysfs")
-    combined_err = "\n".join(filter(None, [err, err3]))
+    # --- Source 2: getconf (fallback only; forks up to ~30 processes) ---
+    # Reliable on x86 (populated from CPUID leaf 0x4) but returns all-zeros on
+    # ARM64 because the kernel does not map CCSIDR_EL1/CLIDR_EL1 into POSIX
+    # sysconf().
+    out, err = _collect_via_getconf()
+    if not _has_complete_cache_info(out):
+        err = "\n".join(filter(None, [err, "getconf returned zero/empty cache values"]))
     output = f"""
     *** System Info Output Start ***
     Architecture: {arch}
     *** Cache Info Start ***
-    {out3}
+    {out}
     *** Cache Info End ***
     **************************
     *** Error Messages Start ***
-    {combined_err}
+    {err}
     *** Error Messages End ***
     """
     print(output)
-    return out3, arch, combined_err
+    return out, arch, err
 
 
 # Backward compatibility: keep the old function name as an alias
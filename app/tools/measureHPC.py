@@ -2,6 +2,7 @@
 import os
 import subprocess
 import logging
+import tempfile
 from contextlib import contextmanager
 from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any
@@ -11,30 +12,184 @@ from pydantic import BaseModel, Field # type: ignore
 
 # Local imports
 from tools.file_ops import _expandpath, create_dir, do_in, do_in_workdir, read_file, write_file, setup_cargo_project #create_rust_project, run_perf_command
-from app_config import get_logger
+from tools.core_lease import lease_core
+from tools.perf_events import PerfEventUnavailable, collect as collect_counters
+from app_config import config, get_logger
 
 log = get_logger(__name__)
 
 class PerformanceCounterInput(BaseModel):
     perf_events: list[str] = Field(description="perf performance events to measure")
     state: dict[str, Any] = Field(..., description="The state of the Agent")
+    repeat: int = Field(default=1, description="number of runs to average over (perf stat -r); repeat > 1 implies structured output")
+    structured: bool = Field(default=False, description="return a compact per-event table (mean, variance, multiplexing ratio) instead of perf's raw output")
     pass # end of CompileGCCInput
 
+_PERF_TIMEOUT_SECONDS = 40
+_MAX_REPEAT = 20
+
+def group_events(perf_events: list[str], counters: int) -> list[list[str]]:
+    ''' Splits events into groups of at most `counters` events, so every group fits the PMU's
+    general-purpose counters and its events are always measured together.
+    '''
+    counters = max(1, counters)
+    return [perf_events[i:i + counters] for i in range(0, len(perf_events), counters)]
+
+def parse_perf_csv(text: str) -> list[dict]:
+    ''' Parses `perf stat -x,` output into one dict per event.
+
+    Field layout: value, unit, event, [variance%,] run time, running %, metric value, metric unit
+    '''
+    rows = []
+    for line in text.splitlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        fields = line.split(",")
+        if len(fields) < 3:
+            continue
+        raw_value, unit, event, rest = fields[0], fields[1], fields[2], fields[3:]
+        variance = None
+        if rest and rest[0].endswith("%"):
+            variance = float(rest[0].rstrip("%") or 0)
+            rest = rest[1:]
+        running = None
+        if len(rest) >= 2 and rest[1]:
+            try:
+                running = float(rest[1])
+            except ValueError:
+                pass
+        try:
+            value = float(raw_value)
+        except ValueError:
+            value = None  # "<not counted>" / "<not supported>"
+        rows.append({
+            "event": event,
+            "value": value,
+            "status": "ok" if value is not None else raw_value.strip("<>"),
+            "unit": unit,
+            "variance_pct": variance,
+            "running_pct": running,
+        })
+    return rows
+
+def format_hpc_summary(rows: list[dict], repeat: int, detail: str, source: str) -> str:
+    ''' Compact table of per-event results for the agent. '''
+    lines = [f"*** HPC Summary ({source}, {repeat} run(s), {detail}) ***",
+             "event | mean | stddev % | counter running % (100 = not multiplexed)"]
+    for row in rows:
+        if row["value"] is None:
+            lines.append(f"{row['event']} | {row['status']} | - | -")
+            continue
+        value = f"{row['value']:.0f}" if row["value"].is_integer() else f"{row['value']:.3f}"
+        variance = "-" if row["variance_pct"] is None else f"{row['variance_pct']:.2f}"
+        running = "-" if row["running_pct"] is None else f"{row['running_pct']:.1f}"
+        lines.append(f"{row['event']} | {value}{(' ' + row['unit']) if row['unit'] else ''} | {variance} | {running}")
+    multiplexed = [r["event"] for r in rows if r["value"] is not None and r["running_pct"] is not None and r["running_pct"] < 100]
+    if multiplexed:
+        lines.append(f"Note: {', '.join(multiplexed)} were multiplexed; values are scaled estimates.")
+    return "\n".join(lines)
+
+def measure_HPC_structured(perf_events: list[str], binary: str, repeat: int) -> tuple[str, str]:
+    ''' Runs `perf stat -x, -r <repeat>` with events grouped to the PMU counter limit.
+
+    Returns:
+        tuple[str, str]: (program stdout, per-event summary followed by the program's stderr)
+    '''
+    repeat = max(1, min(repeat, _MAX_REPEAT))
+    groups = group_events(perf_events, config.HPC_COUNTERS_PER_GROUP)
+    event_spec = ",".join("{" + ",".join(group) + "}" if len(group) > 1 else group[0] for group in groups)
+    fd, csv_path = tempfile.mkstemp(prefix="perf-", suffix=".csv")
+    os.close(fd)
+    try:
+        with do_in_workdir(), lease_core() as core:
+            cmd = ["taskset", "-c", str(core), "perf", "stat", "-x,", "-o", csv_path,
+                   "-r", str(repeat), "-e", event_spec, f"./{binary}"]
+            log.info(f"[+] Running command: {' '.join(cmd)}")
+            ret = subprocess.run(cmd, capture_output=True, timeout=_PERF_TIMEOUT_SECONDS * repeat)
+        with open(csv_path, "r", errors="replace") as f:
+            rows = parse_perf_csv(f.read())
+    finally:
+        os.remove(csv_path)
+
+    stdout = ret.stdout.decode('utf-8', errors='replace')
+    stderr = ret.stderr.decode('utf-8', errors='replace')
+    if not rows:
+        return stdout, f"perf stat produced no counter values.\n{stderr}"
+    summary = format_hpc_summary(rows, repeat, f"{len(groups)} event group(s)", "perf stat")
+    return stdout, summary + (f"\n\n*** Program stderr ***\n{stderr}" if stderr.strip() else "")
+
+def format_perf_stat_text(rows: list[dict], binary: str, elapsed: float) -> str:
+    ''' perf-stat-like text for in-process measurements, so the default output keeps its familiar shape. '''
+    lines = [f" Performance counter stats for './{binary}' (perf_event_open):", ""]
+    for row in rows:
+        if row["value"] is None:
+            lines.append(f"{'<' + row['status'] + '>':>20}      {row['event']}")
+            continue
+        value = f"{row['value']:,.2f}" if row["unit"] else f"{row['value']:,.0f}"
+        running = f"  ({row['running_pct']:.2f}%)" if row["running_pct"] is not None and row["running_pct"] < 100 else ""
+        lines.append(f"{value:>20} {row['unit']:<5} {row['event']}{running}")
+    lines.extend(["", f"{elapsed:>15.9f} seconds time elapsed", ""])
+    return "\n".join(lines)
+
+def _measure_in_process(perf_events: list[str], binary: str, repeat: int, structured: bool) -> tuple[str, str]:
+    ''' Measures with perf_event_open counters instead of the perf CLI.
+
+    Raises:
+        PerfEventUnavailable: If an event or the syscall is unavailable (the caller falls back to perf).
+    '''
+    repeat = max(1, min(repeat, _MAX_REPEAT))
+    with do_in_workdir(), lease_core() as core:
+        log.info(f"[+] Counting {','.join(perf_events)} on ./{binary} via perf_event_open (core {core}, {repeat} run(s))")
+        stdout, stderr, rows, elapsed = collect_counters([f"./{binary}"], perf_events, repeat=repeat,
+                                                         core=core, timeout=_PERF_TIMEOUT_SECONDS)
+    if structured:
+        summary = format_hpc_summary(rows, repeat, f"{len(rows)} counter(s)", "perf_event_open")
+        return stdout, summary + (f"\n\n*** Program stderr ***\n{stderr}" if stderr.strip() else "")
+    return stdout, stderr + format_perf_stat_text(rows, binary, elapsed)
+
 @tool("measure_HPC", args_schema=PerformanceCounterInput, return_direct=True)
-def measure_HPC(perf_events: list[str], state: dict[str, any] | None = None) -> dict[str, str, str]:
+def measure_HPC(perf_events: list[str], state: dict[str, any] | None = None,
+                repeat: int = 1, structured: bool = False) -> dict[str, str, str]:
     ''' Executes the binary at the specified path with the given arguments and measures the specified performance events with the perf tool.
     Useful to run compiled binaries and inspect their output and micro-architectural behavior.
     The list of performance events must only contain events that are supported by the perf tool.
     The function returns a tuple of the execution output, the execution error, and the performance event measurements.
+    With structured=True (or repeat > 1) the measurements are a compact per-event table with the mean over
+    `repeat` runs, the run-to-run variance and the multiplexing ratio of each counter.
     '''
     # Define the command to run
     #perf_events = ["cache-misses", "branch-misses"]
     attack_vector=state.get("attack_vector")
     file_path = f"PoC/{attack_vector}"
-    cmd = ["perf", "stat", "-e",",".join(perf_events), f"./{file_path}"]
+    if config.HPC_BACKEND != "perf":
+        try:
+            return _measure_in_process(perf_events, file_path, repeat, structured or repeat > 1)
+        except PerfEventUnavailable as e:
+            if config.HPC_BACKEND == "perf_event_open":
+                log.error(f"perf_event_open unavailable: {e}")
+                return '', f"perf_event_open unavailable: {e}"
+            log.info(f"[measure_HPC] perf_event_open unavailable ({e}); falling back to the perf CLI")
+        except subprocess.TimeoutExpired:
+            timeout_msg = f"Timeout Error: measure_HPC execution of {file_path} exceeded {_PERF_TIMEOUT_SECONDS} seconds."
+            log.error(timeout_msg)
+            return '', timeout_msg
+    if structured or repeat > 1:
+        try:
+            return measure_HPC_structured(perf_events, file_path, repeat)
+        except subprocess.TimeoutExpired:
+            timeout_msg = f"Timeout Error: measure_HPC execution of {file_path} exceeded {_PERF_TIMEOUT_SECONDS * repeat} seconds."
+            log.error(timeout_msg)
+            return '', timeout_msg
+        except FileNotFoundError:
+            log.error("perf is not installed or not found in PATH")
+            return '', ''
+        except Exception as e:
+            log.error(f"An unexpected error occurred: {e}")
+            return '', ''
     try:
-        # Execute the command
-        with do_in_workdir():
+        # Execute the command, pinned to an exclusively leased core
+        with do_in_workdir(), lease_core() as core:
+            cmd = ["taskset", "-c", str(core), "perf", "stat", "-e",",".join(perf_events), f"./{file_path}"]
             log.info(f"[+] Running command: {' '.join(cmd)}")
             ret = subprocess.run(cmd, capture_output=True, timeout=40)
 
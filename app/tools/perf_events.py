@@ -0,0 +1,278 @@
+'''
+perf_events.py
+
+In-process hardware performance counter collection through the
+perf_event_open(2) syscall (via ctypes), used by measure_HPC instead of
+forking the perf CLI for every measurement.
+
+The PoC is started through a shell trampoline that is pinned to its leased
+core and blocks until the parent has opened the counters on the child's pid
+with enable_on_exec, so exactly the PoC's execution (and its threads and
+children, through inherit) is counted. Counters are read with
+TOTAL_TIME_ENABLED/RUNNING, so multiplexed counters are scaled like perf does.
+
+Like perf stat, counters include kernel space unless the event says ":u".
+Where the kernel refuses that (perf_event_paranoid, missing CAP_PERFMON) the
+counter is reopened for user space only and reported as "<event>:u", so the
+caller can see the numbers mean something else.
+
+Only generic perf event names (hardware, software, hardware-cache) and raw
+rNNNN events are understood; anything else raises PerfEventUnavailable and
+the caller falls back to the perf CLI.
+'''
+
+import ctypes
+import errno
+import math
+import os
+import platform
+import statistics
+import struct
+import subprocess
+import time
+
+from app_config import get_logger
+
+log = get_logger(__name__)
+
+_SYSCALL_NR = {"x86_64": 298, "aarch64": 241, "armv7l": 364, "armv6l": 364, "i686": 336, "i386": 336}
+
+PERF_TYPE_HARDWARE = 0
+PERF_TYPE_SOFTWARE = 1
+PERF_TYPE_HW_CACHE = 3
+PERF_TYPE_RAW = 4
+
+PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+PERF_FLAG_FD_CLOEXEC = 1 << 3
+
+_FLAG_DISABLED = 1 << 0
+_FLAG_INHERIT = 1 << 1
+_FLAG_EXCLUDE_KERNEL = 1 << 5
+_FLAG_EXCLUDE_HV = 1 << 6
+_FLAG_ENABLE_ON_EXEC = 1 << 12
+
+_HARDWARE_EVENTS = {
+    "cycles": 0, "cpu-cycles": 0, "instructions": 1, "cache-references": 2, "cache-misses": 3,
+    "branch-instructions": 4, "branches": 4, "branch-misses": 5, "bus-cycles": 6,
+    "stalled-cycles-frontend": 7, "idle-cycles-frontend": 7,
+    "stalled-cycles-backend": 8, "idle-cycles-backend": 8, "ref-cycles": 9,
+}
+_SOFTWARE_EVENTS = {
+    "cpu-clock": 0, "task-clock": 1, "page-faults": 2, "faults": 2, "context-switches": 3, "cs": 3,
+    "cpu-migrations": 4, "migrations": 4, "minor-faults": 5, "major-faults": 6,
+    "alignment-faults": 7, "emulation-faults": 8,
+}
+_CACHE_IDS = {"L1-dcache": 0, "L1-icache": 1, "LLC": 2, "dTLB": 3, "iTLB": 4, "branch": 5, "node": 6}
+_CACHE_OPS = {"load": 0, "loads": 0, "store": 1, "stores": 1, "prefetch": 2, "prefetches": 2}
+
+
+class PerfEventUnavailable(Exception):
+    '''perf_event_open cannot be used for this measurement (unsupported event, arch or permissions).'''
+    pass
+
+
+class PerfEventAttr(ctypes.Structure):
+    '''struct perf_event_attr (PERF_ATTR_SIZE_VER5 layout; the kernel accepts smaller known sizes).'''
+    _fields_ = [
+        ("type", ctypes.c_uint32),
+        ("size", ctypes.c_uint32),
+        ("config", ctypes.c_uint64),
+        ("sample_period", ctypes.c_uint64),
+        ("sample_type", ctypes.c_uint64),
+        ("read_format", ctypes.c_uint64),
+        ("flags", ctypes.c_uint64),
+        ("wakeup_events", ctypes.c_uint32),
+        ("bp_type", ctypes.c_uint32),
+        ("config1", ctypes.c_uint64),
+        ("config2", ctypes.c_uint64),
+        ("branch_sample_type", ctypes.c_uint64),
+        ("sample_regs_user", ctypes.c_uint64),
+        ("sample_stack_user", ctypes.c_uint32),
+        ("clockid", ctypes.c_int32),
+        ("sample_regs_intr", ctypes.c_uint64),
+        ("aux_watermark", ctypes.c_uint32),
+        ("sample_max_stack", ctypes.c_uint16),
+        ("reserved_2", ctypes.c_uint16),
+    ]
+
+
+def resolve_event(name: str) -> tuple[int, int, bool]:
+    '''Map a perf event name to (type, config, exclude_kernel).
+
+    Raises:
+        PerfEventUnavailable: If the name is not a generic or raw event.
+    '''
+    event, _, modifiers = name.strip().partition(":")
+    # Same default as perf stat: user and kernel space, user space only on ":u"
+    exclude_kernel = "u" in modifiers and "k" not in modifiers
+    if event in _HARDWARE_EVENTS:
+        return PERF_TYPE_HARDWARE, _HARDWARE_EVENTS[event], exclude_kernel
+    if event in _SOFTWARE_EVENTS:
+        return PERF_TYPE_SOFTWARE, _SOFTWARE_EVENTS[event], exclude_kernel
+    if len(event) > 1 and event[0] == "r" and all(c in "0123456789abcdefABCDEF" for c in event[1:]):
+        return PERF_TYPE_RAW, int(event[1:], 16), exclude_kernel
+    parts = event.split("-")
+    if len(parts) >= 3:
+        cache, op, result = "-".join(parts[:-2]), parts[-2], parts[-1]
+        # "L1-dcache-load-misses", "LLC-loads" (result omitted = accesses)
+        if result in _CACHE_OPS and "-".join(parts[:-1]) in _CACHE_IDS:
+            cache, op, result = "-".join(parts[:-1]), result, "accesses"
+        if cache in _CACHE_IDS and op in _CACHE_OPS and result in ("misses", "accesses"):
+            config = _CACHE_IDS[cache] | (_CACHE_OPS[op] << 8) | ((1 if result == "misses" else 0) << 16)
+            return PERF_TYPE_HW_CACHE, config, exclude_kernel
+    if len(parts) == 2 and parts[0] in _CACHE_IDS and parts[1] in _CACHE_OPS:
+        return PERF_TYPE_HW_CACHE, _CACHE_IDS[parts[0]] | (_CACHE_OPS[parts[1]] << 8), exclude_kernel
+    raise PerfEventUnavailable(f"event '{name}' is not a generic perf event")
+
+
+def _syscall():
+    nr = _SYSCALL_NR.get(platform.machine())
+    if nr is None:
+        raise PerfEventUnavailable(f"perf_event_open syscall number unknown for {platform.machine()}")
+    libc = ctypes.CDLL(None, use_errno=True)
+    libc.syscall.restype = ctypes.c_long
+    return libc, nr
+
+
+def user_space_label(event: str) -> str:
+    '''Name of `event` restricted to user space, as perf writes it ("cycles:u", "cycles:pu").'''
+    return f"{event}u" if ":" in event else f"{event}:u"
+
+
+def _open_counter(libc, nr: int, event: str, pid: int) -> tuple[int, bool]:
+    '''Open `event` on `pid`; returns (fd, True if it fell back to counting user space only).'''
+    event_type, config, exclude_kernel = resolve_event(event)
+    attr = PerfEventAttr()
+    attr.type = event_type
+    attr.size = ctypes.sizeof(PerfEventAttr)
+    attr.config = config
+    attr.read_format = PERF_FORMAT_TOTAL_TIME_ENABLED | PERF_FORMAT_TOTAL_TIME_RUNNING
+    attr.flags = _FLAG_DISABLED | _FLAG_INHERIT | _FLAG_ENABLE_ON_EXEC | _FLAG_EXCLUDE_HV
+    if exclude_kernel:
+        attr.flags |= _FLAG_EXCLUDE_KERNEL
+    fd = libc.syscall(nr, ctypes.byref(attr), pid, -1, -1, PERF_FLAG_FD_CLOEXEC)
+    err = ctypes.get_errno() if fd < 0 else 0
+    fell_back = False
+    if fd < 0 and err in (errno.EACCES, errno.EPERM) and not exclude_kernel and "k" not in event.partition(":")[2]:
+        # Kernel counting not permitted here (perf_event_paranoid / CAP_PERFMON): count user space only
+        attr.flags |= _FLAG_EXCLUDE_KERNEL
+        fd = libc.syscall(nr, ctypes.byref(attr), pid, -1, -1, PERF_FLAG_FD_CLOEXEC)
+        err = ctypes.get_errno() if fd < 0 else 0
+        fell_back = True
+    if fd < 0:
+        raise PerfEventUnavailable(f"perf_event_open({event}) failed: {os.strerror(err)}")
+    if fell_back:
+        log.info(f"[perf_events] Kernel counting of {event} not permitted; counting {user_space_label(event)}")
+    return fd, fell_back
+
+
+def _read_counter(fd: int) -> tuple[float | None, float]:
+    '''Return (scaled value, running percentage) of a counter; value None if it never ran.'''
+    value, enabled, running = struct.unpack("QQQ", os.read(fd, 24))
+    if running == 0:
+        return None, 0.0
+    if running < enabled:
+        return value * enabled / running, 100.0 * running / enabled
+    return float(value), 100.0
+
+
+def run_counted(cmd: list[str], events: list[str], core: int | None = None,
+                timeout: float = 40, cwd: str | None = None) -> tuple[subprocess.CompletedProcess, dict[str, tuple[float, float]], float]:
+    '''Run `cmd` once with `events` counted on it.
+
+    Returns:
+        tuple: (CompletedProcess with bytes stdout/stderr, {label: (value or None, running %)}, elapsed seconds),
+            where the label is the event name, or user_space_label(event) if it could only count user space.
+    Raises:
+        PerfEventUnavailable: If any counter cannot be opened.
+        subprocess.TimeoutExpired: If the process exceeds `timeout`.
+    '''
+    libc, nr = _syscall()
+    for event in events:
+        resolve_event(event)  # fail before starting the process
+    gate_r, gate_w = os.pipe()
+
+    # The child shell blocks on the gate pipe until the counters are open, then execs the PoC,
+    # which enables them (enable_on_exec). Popen itself cannot block in a pre-exec hook, since it
+    # waits for the exec to happen before returning.
+    trampoline = ["/bin/sh", "-c", f'read -r _ <&{gate_r} && exec "$@"', "sh", *cmd]
+    fds, labels = [], []
+    proc = subprocess.Popen(trampoline, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd,
+                            pass_fds=(gate_r,))
+    os.close(gate_r)
+    try:
+        try:
+            if core is not None:
+                os.sched_setaffinity(proc.pid, {core})
+            for event in events:
+                fd, fell_back = _open_counter(libc, nr, event, proc.pid)
+                fds.append(fd)
+                labels.append(user_space_label(event) if fell_back else event)
+        except Exception:
+            proc.kill()
+            raise
+        finally:
+            # Release the child: it execs the PoC (or dies if it was killed above)
+            try:
+                os.write(gate_w, b"\n")
+            except OSError:
+                pass
+            os.close(gate_w)
+        start = time.perf_counter()
+        try:
+            stdout, stderr = proc.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            raise
+        elapsed = time.perf_counter() - start
+        counts = {label: _read_counter(fd) for label, fd in zip(labels, fds)}
+    finally:
+        for fd in fds:
+            os.close(fd)
+        if proc.poll() is None:
+            proc.kill()
+            proc.wait()
+    return subprocess.CompletedProcess(cmd, proc.returncode, stdout, stderr), counts, elapsed
+
+
+def collect(cmd: list[str], events: list[str], repeat: int = 1, core: int | None = None,
+            timeout: float = 40, cwd: str | None = None) -> tuple[str, str, list[dict], float]:
+    '''Run `cmd` `repeat` times and aggregate the counters like `perf stat -r`.
+
+    Returns:
+        tuple: (stdout of the last run, stderr of the last run, rows, mean elapsed seconds), where rows use
+            the same keys as measureHPC.parse_perf_csv (event, value, status, unit, variance_pct, running_pct).
+    '''
+    samples: dict[str, list] = {}
+    running: dict[str, list] = {}
+    elapsed = []
+    for _ in range(max(1, repeat)):
+        ret, counts, seconds = run_counted(cmd, events, core=core, timeout=timeout, cwd=cwd)
+        elapsed.append(seconds)
+        for label, (value, pct) in counts.items():
+            samples.setdefault(label, []).append(value)
+            running.setdefault(label, []).append(pct)
+
+    rows = []
+    for event in samples:
+        values = [v for v in samples[event] if v is not None]
+        if not values:
+            rows.append({"event": event, "value": None, "status": "not counted",
+                         "unit": "", "variance_pct": None, "running_pct": 0.0})
+            continue
+        mean = statistics.fmean(values)
+        variance = None
+        if len(values) > 1 and mean:
+            # Same definition as perf stat -r: stddev of the mean, relative to the mean
+            variance = 100.0 * statistics.stdev(values) / math.sqrt(len(values)) / mean
+        unit = ""
+        if event.partition(":")[0] in ("task-clock", "cpu-clock"):
+            # Clock events count nanoseconds; perf reports them in msec
+            mean, unit = mean / 1e6, "msec"
+        rows.append({"event": event, "value": mean, "status": "ok", "unit": unit,
+                     "variance_pct": variance, "running_pct": statistics.fmean(running[event])})
+    stdout = ret.stdout.decode('utf-8', errors='replace')
+    stderr = ret.stderr.decode('utf-8', errors='replace')
+    return stdout, stderr, rows, statistics.fmean(elapsed)
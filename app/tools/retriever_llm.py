@@ -20,6 +20,11 @@ from pydantic import BaseModel, Field # type: ignore
 import tiktoken
 import re
 import os
+import threading
+import hashlib
+import json
+import shutil
+from concurrent.futures import ThreadPoolExecutor
 
 # Get UNAME from environment, default to 'anonymous' for backward compatibility
 UNAME = os.getenv('UNAME', 'anonymous')
@@ -31,126 +36,373 @@ import numpy as np
 from typing import Any, Dict
 
 
-from app_config import get_logger
+from app_config import config, get_logger
 log = get_logger(__name__)
 
 # Define cache directory and file path
 # CACHE_DIR = Path(f"{HOME_DIR}/workdir/RAG_Dir_GPT/.chroma_db")
 # CACHE_DIR = Path(f"{HOME_DIR}/workdir/RAG_Dir_Claude/.chroma_db")
 
-def get_embeddings(model_key: str):
+EMBEDDER_OPENAI = "text-embedding-3-large"
+EMBEDDER_HF = "BAAI/bge-small-en-v1.5"
+
+# Process-wide caches: the embedding model and the opened Chroma store are
+# expensive to construct, so every rag_tool call in a run shares them.
+#   _EMBEDDINGS_CACHE   : embedder name -> embeddings object
+#   _VECTOR_STORE_CACHE : (model family, attack vector) -> (vector store, doc dir signature)
+_CACHE_LOCK = threading.RLock()
+_EMBEDDINGS_CACHE: Dict[str, Any] = {}
+_VECTOR_STORE_CACHE: Dict[tuple[str, str], tuple[Any, tuple]] = {}
+
+
+def get_embedder_name(model_key: str) -> str:
     key = (model_key or "").lower()
     if "gpt" in key or "openai" in key or "4o" in key:
-        return OpenAIEmbeddings(model="text-embedding-3-large")
-    return HuggingFaceEmbeddings(model_name="BAAI/bge-small-en-v1.5")
+        return EMBEDDER_OPENAI
+    return EMBEDDER_HF
 
 
-def get_cache_and_doc_dir(selected_model_key: str, attack_vector: str):
+def get_embeddings(model_key: str):
+    """Return the embeddings object for the model key, loading it at most once per process."""
+    name = get_embedder_name(model_key)
+    with _CACHE_LOCK:
+        embeddings = _EMBEDDINGS_CACHE.get(name)
+        if embeddings is None:
+            log.info(f"[+] Loading embedding model: {name}")
+            if name == EMBEDDER_OPENAI:
+                embeddings = OpenAIEmbeddings(model=name)
+            else:
+                embeddings = HuggingFaceEmbeddings(model_name=name)
+            _EMBEDDINGS_CACHE[name] = embeddings
+        return embeddings
+
+
+def get_rag_family(selected_model_key: str) -> str:
+    """Map a model key to the suffix of its RAG_Dir_<family> directory."""
     key = (selected_model_key or "").lower()
-    attack_vector = (attack_vector or "").strip()
     # Expandable mapping-by-substring (add 'llama', 'deepseek', etc. as you add stores)
     if "claude" in key or "anthropic" in key:
-        cache_dir = Path(f"{HOME_DIR}/workdir/RAG_Dir_Claude/{attack_vector}/.chroma_db")
-        doc_dir = f"{HOME_DIR}/workdir/RAG_Dir_Claude/{attack_vector}"
-    elif "gpt" in key or "openai" in key or "4o" in key:
-        cache_dir = Path(f"{HOME_DIR}/workdir/RAG_Dir_GPT/{attack_vector}/.chroma_db")
-        doc_dir = f"{HOME_DIR}/workdir/RAG_Dir_GPT/{attack_vector}"
-    elif "qwen3-coder" in key or "together" in key:
-        cache_dir = Path(f"{HOME_DIR}/workdir/RAG_Dir_Qwen3/{attack_vector}/.chroma_db")
-        doc_dir = f"{HOME_DIR}/workdir/RAG_Dir_Qwen3/{attack_vector}"
-    elif "llama" in key or "maverick" in key or "ollama" in key:
-        cache_dir = Path(f"{HOME_DIR}/workdir/RAG_Dir_Llama/{attack_vector}/.chroma_db")
-        doc_dir = f"{HOME_DIR}/workdir/RAG_Dir_Llama/{attack_vector}"
-    elif "deepseek" in key:
-        cache_dir = Path(f"{HOME_DIR}/workdir/RAG_Dir_deepseek/{attack_vector}/.chroma_db")
-        doc_dir = f"{HOME_DIR}/workdir/RAG_Dir_deepseek/{attack_vector}"
-    else:
-        # Safe default (keep GPT as fallback)
-        cache_dir = Path(f"{HOME_DIR}/workdir/RAG_Dir_GPT/{attack_vector}/.chroma_db")
-        doc_dir = f"{HOME_DIR}/workdir/RAG_Dir_GPT/{attack_vector}"
+        return "Claude"
+    if "gpt" in key or "openai" in key or "4o" in key:
+        return "GPT"
+    if "qwen3-coder" in key or "together" in key:
+        return "Qwen3"
+    if "llama" in key or "maverick" in key or "ollama" in key:
+        return "Llama"
+    if "deepseek" in key:
+        return "deepseek"
+    # Safe default (keep GPT as fallback)
+    return "GPT"
+
+
+def get_cache_and_doc_dir(selected_model_key: str, attack_vector: str):
+    attack_vector = (attack_vector or "").strip()
+    family = get_rag_family(selected_model_key)
+    cache_dir = Path(f"{HOME_DIR}/workdir/RAG_Dir_{family}/{attack_vector}/.chroma_db")
+    doc_dir = f"{HOME_DIR}/workdir/RAG_Dir_{family}/{attack_vector}"
     return cache_dir, doc_dir
 
+
+def _doc_dir_signature(document_directory: str) -> tuple:
+    """Cheap (path, mtime, size) signature of the RAG documents, ignoring the Chroma store."""
+    entries = []
+    for root, dirs, files in os.walk(document_directory):
+        dirs[:] = [d for d in dirs if d != ".chroma_db"]
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((os.path.relpath(path, document_directory), st.st_mtime_ns, st.st_size))
+    return tuple(sorted(entries))
+
+
+def get_vector_store(selected_model_key: str, attack_vector: str):
+    """Return the vector store for (model family, attack vector), opening it at most once per process.
+
+    The cached store is re-synced (see initialize_retriever) when the documents
+    in the RAG directory change on disk; use invalidate_retriever_cache() to
+    force a reopen.
+    """
+    family = get_rag_family(selected_model_key)
+    cache_key = (family, (attack_vector or "").strip())
+    cache_dir, document_directory = get_cache_and_doc_dir(selected_model_key, attack_vector)
+    signature = _doc_dir_signature(document_directory)
+
+    with _CACHE_LOCK:
+        cached = _VECTOR_STORE_CACHE.get(cache_key)
+        if cached is not None and cached[1] == signature:
+            return cached[0]
+
+        if cached is not None:
+            log.info(f"[+] RAG directory {document_directory} changed, re-syncing vector store")
+        log.info(f"[rag_tool] Using doc_dir={document_directory}, cache_dir={cache_dir}")
+        embeddings = get_embeddings(selected_model_key)
+        vector_store = initialize_retriever(document_directory, cache_dir, embeddings)
+        _VECTOR_STORE_CACHE[cache_key] = (vector_store, signature)
+        return vector_store
+
+
+def invalidate_retriever_cache(selected_model_key: str | None = None, attack_vector: str | None = None) -> None:
+    """Drop cached vector stores so the next lookup reopens them from disk.
+
+    With no arguments every cached store is dropped; otherwise only the entries
+    matching the given model family and/or attack vector. Loaded embedding
+    models are kept since they do not depend on the documents.
+    """
+    family = get_rag_family(selected_model_key) if selected_model_key else None
+    attack_vector = (attack_vector or "").strip() or None
+    with _CACHE_LOCK:
+        for key in list(_VECTOR_STORE_CACHE):
+            if family is not None and key[0] != family:
+                continue
+            if attack_vector is not None and key[1] != attack_vector:
+                continue
+            del _VECTOR_STORE_CACHE[key]
+            log.info(f"[+] Invalidated cached vector store for {key}")
+
+# Document types indexed from a RAG directory and the loader used for each.
+_LOADERS_BY_EXT = {
+    ".pdf": PyMuPDFLoader,
+    ".txt": TextLoader,
+    ".html": BSHTMLLoader,
+}
+MANIFEST_FILE = "rag_manifest.json"
+
+
+def build_corpus_manifest(document_directory: str) -> Dict[str, str]:
+    """Return {relative path: sha256 of contents} for every indexable document."""
+    manifest = {}
+    for root, dirs, files in os.walk(document_directory):
+        dirs[:] = [d for d in dirs if d != ".chroma_db"]
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in _LOADERS_BY_EXT:
+                continue
+            path = os.path.join(root, name)
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+            manifest[os.path.relpath(path, document_directory)] = digest.hexdigest()
+    return dict(sorted(manifest.items()))
+
+
+def corpus_manifest_hash(manifest: Dict[str, str]) -> str:
+    """Single hash identifying the exact set of document contents in a manifest."""
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _read_manifest(manifest_path: Path) -> Dict[str, Any] | None:
+    try:
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data.get("files", {})
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warning(f"[!] Ignoring unreadable RAG manifest {manifest_path} ({e})")
+        return None
+
+
+def _write_manifest(manifest_path: Path, files: Dict[str, Any]) -> None:
+    tmp_path = manifest_path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"files": files}, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def _open_chroma(cache_dir: Path, embeddings):
+    return Chroma(persist_directory=str(cache_dir), embedding_function=embeddings)
+
+
 def initialize_retriever(document_directory: str, cache_dir: Path, embeddings, force_refresh: bool = False):
     """
     overview of the workflow:
         Document Loading: loading documents from a specified directory.     
         Text Splitting: segments the text into chunks of a specified size with optional overlap between chunks.
         Embedding Generation: For each text chunk, the function generates embeddings using a model like OpenAIEmbeddings. 
-        Vector Store Creation: The generated embeddings are stored in a vector store, such as InMemoryVectorStore that allows rapid retrieval based on semantic similarity.
+        Vector Store Creation: The generated embeddings are stored in a persistent Chroma vector store that allows rapid retrieval based on semantic similarity.
     Obj:     
-        Build vector store once and cache doc chunks + their embeddings to disk.
-        Subsequent calls load cached docs/embeddings unless force_refresh=True or cache missing.
+        Keep the Chroma store in sync with the documents, re-embedding only what changed.
+        A manifest of per-file content hashes (and the chunk ids each file produced) is kept
+        next to the store; added or changed files are re-chunked and re-embedded, deleted
+        files have their chunks removed. force_refresh=True, or a store without a manifest,
+        triggers a full rebuild.
     """
     # Ensure cache dir exists
     cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = cache_dir / MANIFEST_FILE
 
-    # If Chroma DB exists and not force_refresh, load it
-    if not force_refresh and any(cache_dir.iterdir()):
-        try:
-            vector_store = Chroma(
-                persist_directory=str(cache_dir),
-                embedding_function=embeddings
-            )
-            log.info(f"[+] Loaded Chroma vector store from {cache_dir}")
-            return vector_store
-        except Exception as e:
-            log.warning(f"[!] Failed loading Chroma DB ({e}), rebuilding vector store.")
-
-    log.info(f"[+] Building Chroma vector store from documents in {document_directory}...")
-    loaders = []
-    pdf_loader = DirectoryLoader(
-        path=document_directory,
-        glob="**/*.pdf",
-        loader_cls=PyMuPDFLoader,
-        recursive=True,
-        silent_errors=False
-    )
-    loaders.append(pdf_loader)
-    text_loader = DirectoryLoader(
-        path=document_directory,
-        glob="**/*.txt",
-        loader_cls=TextLoader,
-        recursive=True,
-        silent_errors=False
-    )
-    loaders.append(text_loader)
-    html_loader = DirectoryLoader(
-        path=document_directory,
-        glob="**/*.html",
-        loader_cls=BSHTMLLoader,
-        recursive=True,
-        silent_errors=False
-    )
-    loaders.append(html_loader)
+    current = build_corpus_manifest(document_directory)
+    indexed = None if force_refresh else _read_manifest(manifest_path)
 
-    documents = []
-    for loader in loaders:
-        loaded_docs = loader.load()
-        for doc in loaded_docs:
-            log.info(f"[+] Loaded document: {doc.metadata.get('source', 'Unknown Source')}")
-        documents.extend(loaded_docs)
+    try:
+        vector_store = _open_chroma(cache_dir, embeddings)
+    except Exception as e:
+        log.warning(f"[!] Failed loading Chroma DB ({e}), rebuilding vector store.")
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        vector_store = _open_chroma(cache_dir, embeddings)
+        indexed = None
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=6000, chunk_overlap=1500)
-    docs = text_splitter.split_documents(documents)
+    if indexed is None:
+        # No trustworthy record of what the store holds: start from an empty collection.
+        log.info(f"[+] Building Chroma vector store from documents in {document_directory}...")
+        vector_store.delete_collection()
+        vector_store = _open_chroma(cache_dir, embeddings)
+        indexed = {}
 
-    vector_store = Chroma.from_documents(
-        docs,
-        embeddings,
-        persist_directory=str(cache_dir)
-    )
-    vector_store.persist()
-    log.info(f"[+] Chroma vector store built and persisted to {cache_dir}")
+    added   = [rel for rel in current if rel not in indexed]
+    changed = [rel for rel in current if rel in indexed and indexed[rel]["sha256"] != current[rel]]
+    deleted = [rel for rel in indexed if rel not in current]
+
+    if not (added or changed or deleted):
+        log.info(f"[+] Loaded Chroma vector store from {cache_dir} (up to date, {len(current)} documents)")
+        return vector_store
+
+    log.info(f"[+] Syncing Chroma vector store: {len(added)} added, {len(changed)} changed, {len(deleted)} deleted")
 
-    # Token counting (unchanged)
+    for rel in changed + deleted:
+        ids = indexed.pop(rel).get("ids", [])
+        if ids:
+            vector_store.delete(ids=ids)
+        log.info(f"[+] Removed {len(ids)} stale chunks of: {rel}")
+
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=6000, chunk_overlap=1500)
     encoding = tiktoken.encoding_for_model("text-embedding-3-large")
     total_tokens = 0
-    for doc in docs:
-        num_tokens = len(encoding.encode(doc.page_content))
-        total_tokens += num_tokens
+    for rel in added + changed:
+        path = os.path.join(document_directory, rel)
+        loader_cls = _LOADERS_BY_EXT[os.path.splitext(rel)[1].lower()]
+        loaded_docs = loader_cls(path).load()
+        log.info(f"[+] Loaded document: {path}")
+        docs = text_splitter.split_documents(loaded_docs)
+        ids = [f"{rel}:{current[rel][:16]}:{i}" for i in range(len(docs))]
+        if docs:
+            vector_store.add_documents(docs, ids=ids)
+        indexed[rel] = {"sha256": current[rel], "ids": ids}
+        total_tokens += sum(len(encoding.encode(doc.page_content)) for doc in docs)
+
+    if hasattr(vector_store, "persist"):
+        vector_store.persist()
+    _write_manifest(manifest_path, indexed)
+    log.info(f"[+] Chroma vector store synced and persisted to {cache_dir}")
 
     log.info(f"*********************  Total number of tokens processed: {total_tokens}  ***************************")
     return vector_store
 
+# Persistent cache of retrieval results, shared by all runs on this workdir.
+# Entries are keyed by (query, corpus manifest hash, embedder, k), so any
+# document change or embedder switch naturally misses.
+RESULT_CACHE_DIR = Path(f"{HOME_DIR}/workdir/.rag_cache")
+_CORPUS_HASH_MEMO: Dict[str, tuple[tuple, str]] = {}
+
+
+def get_corpus_hash(document_directory: str) -> str:
+    """Manifest hash of the RAG directory, recomputed only when the files' mtime/size change."""
+    signature = _doc_dir_signature(document_directory)
+    with _CACHE_LOCK:
+        memo = _CORPUS_HASH_MEMO.get(document_directory)
+        if memo is not None and memo[0] == signature:
+            return memo[1]
+    corpus_hash = corpus_manifest_hash(build_corpus_manifest(document_directory))
+    with _CACHE_LOCK:
+        _CORPUS_HASH_MEMO[document_directory] = (signature, corpus_hash)
+    return corpus_hash
+
+
+def _result_cache_path(query: str, corpus_hash: str, embedder: str, k: int) -> Path:
+    key = json.dumps({"query": query, "corpus": corpus_hash, "embedder": embedder, "k": k}, sort_keys=True)
+    return RESULT_CACHE_DIR / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()}.json"
+
+
+def _load_cached_result(path: Path) -> tuple[str, str] | None:
+    if not config.RAG_RESULT_CACHE:
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return data["query"], data["result"]
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.warning(f"[!] Ignoring unreadable retrieval cache entry {path} ({e})")
+        return None
+
+
+def _store_cached_result(path: Path, result: tuple[str, str]) -> None:
+    # Only successful retrievals are cached; errors and empty results are retried next time.
+    if not config.RAG_RESULT_CACHE or not result[0]:
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"query": result[0], "result": result[1]}, f)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        log.warning(f"[!] Failed to write retrieval cache entry {path} ({e})")
+
+
+def _serialize_docs(query: str, retrieved_docs) -> tuple[str, str]:
+    """Format similarity-search hits the way rag_tool returns them."""
+    if not retrieved_docs:
+        return "", "No relevant documents found."
+    serialized_docs = "\n\n".join(
+        f"Source: {doc.metadata}\nContent: {doc.page_content}"
+        for doc in retrieved_docs
+    )
+    return query, serialized_docs
+
+
+def prefetch_retrievals(queries: List[str], state: Dict[str, Any] | None = None, k: int = 1) -> List[tuple[str, str]]:
+    """Answer all curated queries up front.
+
+    Queries found in the persistent result cache are served from disk; the rest
+    are embedded in a single batch and the similarity searches run
+    concurrently against the shared vector store. Results are returned in the
+    order of `queries`, each in the same (query, serialized_docs) /
+    ("", error) form as rag_tool.
+    """
+    queries = list(queries or [])
+    if not queries:
+        return []
+    selected_model_key = (state or {}).get("selected_model_key") or "gpt-4o"
+    attack_vector = (state or {}).get("attack_vector")
+
+    _, document_directory = get_cache_and_doc_dir(selected_model_key, attack_vector)
+    corpus_hash = get_corpus_hash(document_directory)
+    embedder = get_embedder_name(selected_model_key)
+    cache_paths = [_result_cache_path(query, corpus_hash, embedder, k) for query in queries]
+    results: List[tuple[str, str] | None] = [_load_cached_result(path) for path in cache_paths]
+    missing = [i for i, result in enumerate(results) if result is None]
+    log.info(f"[prefetch_retrievals] {len(queries) - len(missing)}/{len(queries)} queries served from the result cache")
+    if not missing:
+        return results
+
+    vector_store = get_vector_store(selected_model_key, attack_vector)
+    embeddings = get_embeddings(selected_model_key)
+    vectors = embeddings.embed_documents([queries[i] for i in missing])
+    log.info(f"[prefetch_retrievals] Embedded {len(missing)} queries in one batch")
+
+    def search(item):
+        i, vector = item
+        try:
+            result = _serialize_docs(queries[i], vector_store.similarity_search_by_vector(vector, k=k))
+        except Exception as e:
+            return i, ("", str(e))
+        _store_cached_result(cache_paths[i], result)
+        return i, result
+
+    workers = max(1, min(len(missing), config.RETRIEVAL_PREFETCH_WORKERS))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for i, result in pool.map(search, zip(missing, vectors)):
+            results[i] = result
+    log.info(f"[prefetch_retrievals] Completed {len(missing)} similarity searches")
+    return results
+
+
 class RetrieveResponse(BaseModel):
     query: str = Field(default=None, description="The search query")
     state: Dict[str, Any] = Field(default_factory=dict)
@@ -182,26 +434,27 @@ def rag_tool(query: str, state: Dict[str, Any] | None = None) -> tuple[str, str]
         if state and "selected_model_key" in state:
             selected_model_key = state["selected_model_key"]
         attack_vector = (state or {}).get("attack_vector")
-        cache_dir, document_directory = get_cache_and_doc_dir(selected_model_key, attack_vector)
 
         log.info(f"[rag_tool] selected_model_key={selected_model_key}")
-        log.info(f"[rag_tool] Using doc_dir={document_directory}, cache_dir={cache_dir}")
 
-        embeddings = get_embeddings(selected_model_key)
-        vector_store = initialize_retriever(document_directory, cache_dir, embeddings)
+        # Repeated runs ask the same curated queries: serve them from the result cache
+        _, document_directory = get_cache_and_doc_dir(selected_model_key, attack_vector)
+        cache_path = _result_cache_path(
+            query, get_corpus_hash(document_directory), get_embedder_name(selected_model_key), 1)
+        cached = _load_cached_result(cache_path)
+        if cached is not None:
+            log.info(f"[rag_tool] Result cache hit: {cache_path.name}")
+            return cached
+
+        vector_store = get_vector_store(selected_model_key, attack_vector)
 
         # Perform similarity search in the vector store
         retrieved_docs = vector_store.similarity_search(query, k=1)
 
-        if not retrieved_docs:
-            return "", "No relevant documents found."
-
         # Format the retrieved documents
-        serialized_docs = "\n\n".join(
-            f"Source: {doc.metadata}\nContent: {doc.page_content}"
-            for doc in retrieved_docs
-        )
-        return query, serialized_docs
+        result = _serialize_docs(query, retrieved_docs)
+        _store_cached_result(cache_path, result)
+        return result
 
     except Exception as e:
         return "", str(e)
@@ -3,10 +3,14 @@
 REPEAT_COUNT=1
 SLEEP_SECONDS=1 # 5 minutes
 CSV_FILE="run_times.csv"
+BATCH_FILE=""
+MAX_CONCURRENT=""
 
 usage() {
   echo "Usage: $0 [--repeat N] [--sleep SECONDS]"
+  echo "       $0 --batch MATRIX_JSON [--max-concurrent N]"
   echo "Defaults: --repeat 1, --sleep 1"
+  echo "MATRIX_JSON must be inside ./workdir (it is read from the container mount)."
   exit 1
 }
 
@@ -21,6 +25,14 @@ while [[ $# -gt 0 ]]; do
       SLEEP_SECONDS="$2"
       shift 2
       ;;
+    --batch)
+      BATCH_FILE="$2"
+      shift 2
+      ;;
+    --max-concurrent)
+      MAX_CONCURRENT="$2"
+      shift 2
+      ;;
     *)
       usage
       ;;
@@ -33,13 +45,29 @@ if [[ ! -f "$CSV_FILE" ]]; then
 fi
 
 docker compose down 2>/dev/null || true
+
+# Build the image once; every run below reuses it
+docker compose build 2>&1 | grep -v "no such file or directory" || true
+
+if [[ -n "$BATCH_FILE" ]]; then
+    # Concurrent sweep inside one container (see app/batch_scheduler.py)
+    BATCH_REL="${BATCH_FILE#./}"
+    BATCH_REL="${BATCH_REL#workdir/}"
+    EXTRA_ARGS=""
+    if [[ -n "$MAX_CONCURRENT" ]]; then
+      EXTRA_ARGS="--max-concurrent $MAX_CONCURRENT"
+    fi
+    docker compose run --rm --entrypoint /bin/bash app -c \
+      "taskset -c \${UGEN_CPUSET:-2,3,4,5} python3 app.py --batch ~/workdir/$BATCH_REL --results ~/workdir/runs/results.csv $EXTRA_ARGS" 2>&1
+    echo "Batch completed. Results: workdir/runs/results.csv"
+    exit 0
+fi
+
 for ((i = 1; i <= REPEAT_COUNT; i++)); do
     START_TIME=$(date +"%Y-%m-%d %H:%M:%S")
     START_SEC=$(date +%s)
     echo "[$i/$REPEAT_COUNT] Starting run at $START_TIME"
 
-    # Build the image first, then run container
-    docker compose build 2>&1 | grep -v "no such file or directory" || true
     docker compose run --rm app 2>&1
     
     # Wait briefly after completion